@@ -0,0 +1,166 @@
+# balanced_sampler.py - Carga de lotes balanceados directamente desde dataset/
+"""
+Sampler de Keras que lee las imágenes de los splits originales, reasigna
+las clases al vuelo (por ejemplo leve/severa -> con_plaga) y arma lotes
+balanceados o ponderados por clase sin copiar imágenes a otro directorio.
+
+Expone los mismos atributos que `flow_from_directory` (`samples`,
+`classes`, `class_indices`, `filepaths`) para poder reemplazarlo.
+"""
+
+import math
+import time
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+from tensorflow import keras
+from tensorflow.keras.preprocessing.image import ImageDataGenerator
+
+from dataset_index import CLASSES, list_images
+
+# Mapa de clases para el modelo binario
+BINARY_CLASS_MAP = {
+    'sin_plaga': 'sin_plaga',
+    'infestacion_leve': 'con_plaga',
+    'infestacion_severa': 'con_plaga'
+}
+
+def load_image_array(path, img_size, dtype=np.float32) -> np.ndarray:
+    """Decodifica una imagen a un array RGB (float32 por defecto) de tamaño (alto, ancho)."""
+    height, width = img_size
+    with Image.open(path) as img:
+        # Decodificación completa y vecino más cercano, igual que load_img y
+        # make_image_dataset: el modelo ve los mismos píxeles al entrenar y al evaluar
+        img = img.convert('RGB').resize((width, height), Image.NEAREST)
+        return np.asarray(img, dtype=dtype)
+
+class BalancedImageSampler(keras.utils.PyDataset):
+    """
+    Lotes de imágenes desde root/<split>/<clase_origen>/.
+
+    Args:
+        root: Directorio del dataset original
+        split: 'train', 'val' o 'test'
+        class_map: Clase de origen -> clase objetivo (None = sin cambios)
+        class_weights: Peso de muestreo por clase objetivo (None = balanceado)
+        balanced: Si es False se recorren los archivos en orden, una vez por época
+        img_size: Tamaño de salida (alto, ancho), como target_size
+        batch_size: Tamaño de lote
+        image_data_generator: Augmentation y normalización (por defecto solo rescale 1/255)
+        class_mode: 'binary' o 'categorical'
+        steps_per_epoch: Lotes por época (por defecto, los necesarios para ver cada imagen una vez)
+        shuffle: Mezclar el orden en modo no balanceado
+        seed: Semilla; cada lote se genera con (seed, época, índice) y es reproducible
+        files: Lista explícita de (ruta, clase_origen) en lugar de leer root/split
+            (la usa cross_validation.py para los folds)
+        shard_index, num_shards: Parte de los lotes que genera este worker en
+            entrenamiento distribuido (cada worker produce lotes distintos)
+        **kwargs: workers, use_multiprocessing, max_queue_size de PyDataset
+    """
+
+    def __init__(self, root='dataset', split='train', class_map: Optional[Dict[str, str]] = None,
+                 class_weights: Optional[Dict[str, float]] = None, balanced: bool = True,
+                 img_size=(224, 224), batch_size: int = 32,
+                 image_data_generator: Optional[ImageDataGenerator] = None,
+                 class_mode: str = 'categorical', steps_per_epoch: Optional[int] = None,
+                 shuffle: bool = True, seed: int = 42,
+                 files: Optional[Sequence[Tuple[str, str]]] = None, shard_index: int = 0,
+                 num_shards: int = 1, **kwargs):
+        super().__init__(**kwargs)
+        class_map = class_map or {c: c for c in CLASSES}
+
+        self.img_size = tuple(img_size)
+        self.batch_size = batch_size
+        self.class_mode = class_mode
+        self.balanced = balanced
+        self.shuffle = shuffle
+        self.seed = seed
+        self.shard_index = shard_index
+        self.num_shards = num_shards
+        self.epoch = 0
+        self.load_times = []  # Segundos de cada __getitem__ (los lee ThroughputProfiler)
+        self.image_data_generator = image_data_generator or ImageDataGenerator(rescale=1./255)
+
+        # Índices alfabéticos, igual que flow_from_directory
+        target_classes = sorted(set(class_map.values()))
+        self.class_indices = {name: i for i, name in enumerate(target_classes)}
+
+        if files is None:
+            files = [
+                (str(path), source_class)
+                for source_class in sorted(class_map)
+                for path in list_images(Path(root) / split / source_class)
+            ]
+        self.filepaths = [str(path) for path, _ in files]
+        classes = [self.class_indices[class_map[source_class]] for _, source_class in files]
+        self.classes = np.array(classes, dtype=np.int64)
+        self.samples = len(self.filepaths)
+        self.num_classes = len(target_classes)
+
+        # Archivos disponibles por clase y probabilidad de muestrear cada una
+        self._files_by_class = [np.nonzero(self.classes == i)[0] for i in range(self.num_classes)]
+        weights = np.array([
+            (class_weights or {}).get(name, 1.0) if len(self._files_by_class[i]) else 0.0
+            for name, i in self.class_indices.items()
+        ], dtype=np.float64)
+        self.class_probabilities = weights / weights.sum() if weights.sum() > 0 else weights
+
+        # Con varios workers la época global recorre el dataset una vez
+        self._steps = steps_per_epoch or math.ceil(self.samples / (batch_size * num_shards))
+        self._reorder()
+
+    def _reorder(self):
+        # Todos los workers calculan la misma permutación y toman su parte
+        order = np.arange(self.samples)
+        if not self.balanced and self.shuffle:
+            order = np.random.default_rng((self.seed, self.epoch)).permutation(self.samples)
+        if self.num_shards > 1:
+            # Misma cantidad por worker (se repiten unas pocas imágenes) para
+            # que ningún worker quede con un lote vacío
+            order = np.resize(order, math.ceil(self.samples / self.num_shards) * self.num_shards)
+        self._order = order[self.shard_index::self.num_shards]
+
+    def _global_index(self, index) -> int:
+        return index * self.num_shards + self.shard_index
+
+    def __len__(self):
+        return self._steps
+
+    def _batch_indices(self, index) -> np.ndarray:
+        if not self.balanced:
+            return self._order[index * self.batch_size:(index + 1) * self.batch_size]
+
+        rng = np.random.default_rng((self.seed, self.epoch, self._global_index(index)))
+        chosen_classes = rng.choice(self.num_classes, size=self.batch_size, p=self.class_probabilities)
+        return np.array([rng.choice(self._files_by_class[c]) for c in chosen_classes])
+
+    def __getitem__(self, index):
+        start = time.perf_counter()
+        indices = self._batch_indices(index)
+        batch_x = np.empty((len(indices), *self.img_size, 3), dtype=np.float32)
+        seeds = np.random.default_rng((self.seed, self.epoch, self._global_index(index), 1)).integers(0, 2**31, len(indices))
+
+        for j, i in enumerate(indices):
+            x = load_image_array(self.filepaths[i], self.img_size)
+            params = self.image_data_generator.get_random_transform(x.shape, seed=int(seeds[j]))
+            x = self.image_data_generator.apply_transform(x, params)
+            batch_x[j] = self.image_data_generator.standardize(x)
+
+        labels = self.classes[indices]
+        if self.class_mode == 'binary':
+            batch_y = labels.astype(np.float32)
+        else:
+            batch_y = keras.utils.to_categorical(labels, self.num_classes)
+
+        self.load_times.append(time.perf_counter() - start)
+        return batch_x, batch_y
+
+    def on_epoch_end(self):
+        self.epoch += 1
+        self._reorder()
+
+    def class_counts(self) -> Dict[str, int]:
+        """Número de imágenes disponibles por clase objetivo."""
+        return {name: int((self.classes == i).sum()) for name, i in self.class_indices.items()}
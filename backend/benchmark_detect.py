@@ -0,0 +1,84 @@
+# benchmark_detect.py - Latencia de detect_advanced con las ramas CNN y OpenCV en secuencia o en paralelo
+"""
+Mide por separado la rama CNN (redimensionado + predicción adaptativa) y
+la rama OpenCV (máscara de hoja + contornos), y luego detect_advanced
+completo con las ramas una tras otra y en paralelo. Con las ramas en
+paralelo la latencia debería acercarse al máximo de las dos, no a su suma.
+
+La reutilización por hash perceptual se desactiva para que cada corrida
+haga el análisis completo. El reparto de hilos se controla con las mismas
+variables de entorno que el servidor (INFERENCE_THREADS, OPENCV_THREADS).
+
+Uso:
+    python benchmark_detect.py                      # Primera imagen de dataset/test
+    python benchmark_detect.py foto.jpg --runs 50
+"""
+
+import time
+import argparse
+from typing import Callable, Dict
+
+import numpy as np
+import cv2
+
+from dataset_index import CLASSES, list_images
+from main import detector
+
+BENCHMARK_RUNS = 30
+
+def measure(fn: Callable[[], object], runs: int) -> Dict[str, float]:
+    """Latencia media y p95 en ms (tras una corrida de calentamiento)."""
+    fn()
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    return {'mean_ms': float(np.mean(times)), 'p95_ms': float(np.percentile(times, 95))}
+
+def default_image() -> str:
+    for clase in CLASSES:
+        images = list_images(f'dataset/test/{clase}')
+        if images:
+            return str(images[0])
+    raise SystemExit("❌ No hay imágenes en dataset/test; indique una imagen")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara detect_advanced con ramas en secuencia y en paralelo")
+    parser.add_argument('image', nargs='?', help="Imagen de prueba (por defecto, una de dataset/test)")
+    parser.add_argument('--runs', type=int, default=BENCHMARK_RUNS)
+    args = parser.parse_args()
+
+    path = args.image or default_image()
+    with open(path, 'rb') as f:
+        image_bytes = f.read()
+    image = detector.decode_image(image_bytes)
+    rgb = np.asarray(image)
+    print(f"🖼️  {path} ({rgb.shape[1]}x{rgb.shape[0]}), {args.runs} corridas")
+
+    def detect(concurrent: bool):
+        def run():
+            detector.concurrent_branches = concurrent
+            return detector.detect_advanced(image_bytes, reutilizar=False)
+        return run
+
+    results = {
+        'Rama CNN': measure(lambda: detector.predict_adaptive(detector.preprocess_image(image)), args.runs),
+        'Rama OpenCV': measure(lambda: detector.analyze_with_opencv(cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)), args.runs),
+        'detect_advanced secuencial': measure(detect(False), args.runs),
+        'detect_advanced en paralelo': measure(detect(True), args.runs)
+    }
+
+    print(f"\n{'Medición':30} {'ms':>8} {'p95':>8}")
+    print("-" * 48)
+    for name, r in results.items():
+        print(f"{name:30} {r['mean_ms']:8.1f} {r['p95_ms']:8.1f}")
+
+    cnn, opencv = results['Rama CNN']['mean_ms'], results['Rama OpenCV']['mean_ms']
+    sequential = results['detect_advanced secuencial']['mean_ms']
+    concurrent = results['detect_advanced en paralelo']['mean_ms']
+    print(f"\nSuma de ramas: {cnn + opencv:.1f} ms | máximo: {max(cnn, opencv):.1f} ms")
+    print(f"⚡ En paralelo: {sequential / concurrent:.2f}x más rápido que en secuencia")
+
+if __name__ == "__main__":
+    main()
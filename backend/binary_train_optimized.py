@@ -1,33 +1,46 @@
 import os
-import shutil
 import random
+import argparse
 import numpy as np
+from training_profile import apply_training_profile
 import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
-from sklearn.metrics import classification_report, confusion_matrix
 import matplotlib.pyplot as plt
 from datetime import datetime
+from materialize import materialize, print_counts
+from balanced_sampler import BalancedImageSampler, BINARY_CLASS_MAP
+from model_config import IMG_SIZE, build_backbone, with_preprocessing, write_model_config
+from model_bundle import benchmark, dataset_hash, save_bundle
+from evaluation import PARITY_IMAGES, evaluate_generator
+from distributed import (
+    check_resume_agreement, cluster_info, get_strategy, scale_learning_rate, training_input, worker_path
+)
+from training_callbacks import FullStateCheckpoint, ThroughputProfiler, load_latest_checkpoint
 
 # Configuración
-IMG_SIZE = (224, 224)
+# IMG_SIZE y el alpha de MobileNetV2 vienen de model_config (model_arch.json opcional
+# o IMG_SIZE/MOBILENET_ALPHA; por defecto 224 px y alpha 1.0)
 BATCH_SIZE = 32
 EPOCHS = 30
+LEARNING_RATE = 0.001  # Por worker; se escala con el número de workers
+DATA_DIR = 'dataset'
+CLASS_SAMPLING_WEIGHTS = None  # None = balanceado; p.ej. {'con_plaga': 1.5, 'sin_plaga': 1.0}
+LOADER_WORKERS = 4
+CHECKPOINT_DIR = 'checkpoints/binario'  # Checkpoints completos para --resume
+CHECKPOINT_EVERY = 1
+CHECKPOINT_KEEP = 3
 
 def create_balanced_binary_dataset():
-    """Crear dataset binario perfectamente balanceado"""
+    """
+    Crear dataset binario perfectamente balanceado en dataset_binary/.
+    
+    El entrenamiento ya no lo necesita (BalancedImageSampler lee dataset/
+    directamente); se conserva para exportar una copia física del split.
+    """
     print("🔄 CREANDO DATASET BINARIO BALANCEADO")
     print("="*50)
     
-    # Eliminar dataset anterior si existe
-    if os.path.exists('dataset_binary'):
-        shutil.rmtree('dataset_binary')
-    
-    # Crear estructura
-    for split in ['train', 'val', 'test']:
-        for class_name in ['sin_plaga', 'con_plaga']:
-            os.makedirs(f'dataset_binary/{split}/{class_name}', exist_ok=True)
-    
     # Recopilar todas las imágenes
     def get_all_images(base_path, class_name):
         """Obtener todas las imágenes de una clase de todos los splits"""
@@ -35,7 +48,7 @@ def create_balanced_binary_dataset():
         for split in ['train', 'val', 'test']:
             path = f'{base_path}/{split}/{class_name}'
             if os.path.exists(path):
-                for img in os.listdir(path):
+                for img in sorted(os.listdir(path)):
                     if img.lower().endswith(('.jpg', '.jpeg', '.png')):
                         all_images.append((split, path, img))
         return all_images
@@ -85,29 +98,35 @@ def create_balanced_binary_dataset():
     sin_plaga_splits = split_data(sin_plaga_selected)
     con_plaga_splits = split_data(con_plaga_selected)
     
-    # Copiar archivos
-    def copy_images(splits, class_name, is_plague=False):
+    # Asignar archivos (destino relativo -> origen)
+    def assign_images(splits, class_name, is_plague=False):
+        assignments = {}
         counts = {}
         for split_name, images in splits.items():
-            count = 0
             for item in images:
                 if is_plague:
                     split, path, original_name, new_name = item
                     src = os.path.join(path, original_name)
-                    dst = f'dataset_binary/{split_name}/{class_name}/{new_name}'
+                    dst = f'{split_name}/{class_name}/{new_name}'
                 else:
                     split, path, img_name = item
                     src = os.path.join(path, img_name)
-                    dst = f'dataset_binary/{split_name}/{class_name}/{img_name}'
+                    dst = f'{split_name}/{class_name}/{img_name}'
                 
-                shutil.copy2(src, dst)
-                count += 1
-            counts[split_name] = count
-        return counts
-    
-    # Copiar imágenes
-    sin_plaga_counts = copy_images(sin_plaga_splits, 'sin_plaga', False)
-    con_plaga_counts = copy_images(con_plaga_splits, 'con_plaga', True)
+                assignments[dst] = src
+            counts[split_name] = len(images)
+        return assignments, counts
+    
+    sin_plaga_assignments, sin_plaga_counts = assign_images(sin_plaga_splits, 'sin_plaga', False)
+    con_plaga_assignments, con_plaga_counts = assign_images(con_plaga_splits, 'con_plaga', True)
+    
+    # Enlazar imágenes; solo se tocan las que cambiaron desde la última ejecución
+    counts = materialize(
+        {**sin_plaga_assignments, **con_plaga_assignments},
+        'dataset_binary',
+        exclusive=True
+    )
+    print_counts(counts)
     
     print(f"\n✅ DATASET BINARIO CREADO:")
     for split in ['train', 'val', 'test']:
@@ -123,45 +142,50 @@ def create_balanced_binary_dataset():
     print(f"\nTOTAL: {total_final} imágenes")
     return True
 
-def create_binary_model():
-    """Crear modelo optimizado para clasificación binaria"""
+def create_binary_model(profile=None, learning_rate=LEARNING_RATE, dropout=0.4,
+                        unfrozen_layers=20, dense_units=(256, 128)):
+    """
+    Crear modelo optimizado para clasificación binaria.
+    
+    Los hiperparámetros (los ajusta sweep.py) son: learning_rate, dropout de
+    la primera capa densa (baja 0.1 por capa), capas finales de MobileNetV2
+    que se entrenan y ancho de las capas densas.
+    """
     print("\n🏗️ CONSTRUYENDO MODELO BINARIO")
     
     # Modelo base
-    base_model = tf.keras.applications.MobileNetV2(
-        input_shape=(*IMG_SIZE, 3),
-        include_top=False,
-        weights='imagenet'
-    )
+    base_model = build_backbone()
     
     # Descongelar últimas capas para fine-tuning
     base_model.trainable = True
-    for layer in base_model.layers[:-20]:
+    for layer in base_model.layers[:-unfrozen_layers]:
         layer.trainable = False
     
     # Arquitectura optimizada para binario
+    head = [tf.keras.layers.GlobalAveragePooling2D()]
+    for i, units in enumerate(dense_units):
+        head += [
+            tf.keras.layers.BatchNormalization(),
+            tf.keras.layers.Dense(units, activation='relu'),
+            tf.keras.layers.Dropout(max(0.0, dropout - 0.1 * i))
+        ]
     model = tf.keras.Sequential([
         base_model,
-        tf.keras.layers.GlobalAveragePooling2D(),
-        tf.keras.layers.BatchNormalization(),
-        tf.keras.layers.Dense(256, activation='relu'),
-        tf.keras.layers.Dropout(0.4),
-        tf.keras.layers.BatchNormalization(),
-        tf.keras.layers.Dense(128, activation='relu'),
-        tf.keras.layers.Dropout(0.3),
-        tf.keras.layers.Dense(1, activation='sigmoid', name='output')  # Salida binaria
+        *head,
+        tf.keras.layers.Dense(1, activation='sigmoid', name='output', dtype='float32')  # Salida binaria
     ])
     
     # Compilar para clasificación binaria
     model.compile(
-        optimizer=tf.keras.optimizers.Adam(learning_rate=0.001),
+        optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
         loss='binary_crossentropy',
         metrics=[
             'accuracy',
             tf.keras.metrics.Precision(name='precision'),
             tf.keras.metrics.Recall(name='recall'),
             tf.keras.metrics.AUC(name='auc')
-        ]
+        ],
+        jit_compile=(profile or {}).get('jit_compile', False)
     )
     
     print(f"✅ Modelo binario creado")
@@ -169,11 +193,17 @@ def create_binary_model():
     
     return model
 
-def train_binary_model():
-    """Entrenar el modelo binario"""
+def train_binary_model(profile=None, resume=False, strategy=None):
+    """
+    Entrenar el modelo binario (con resume=True continúa el último checkpoint).
+    Con varios workers solo el jefe evalúa y guarda; el resto retorna None.
+    """
     print("\n🚀 ENTRENANDO MODELO BINARIO")
     print("="*50)
     
+    strategy = strategy or tf.distribute.get_strategy()
+    worker_index, num_workers = cluster_info()
+    
     # Crear generadores
     train_datagen = ImageDataGenerator(
         rescale=1./255,
@@ -188,42 +218,70 @@ def train_binary_model():
     
     val_datagen = ImageDataGenerator(rescale=1./255)
     
-    # Cargar datos
-    train_gen = train_datagen.flow_from_directory(
-        'dataset_binary/train',
-        target_size=IMG_SIZE,
+    # Cargar datos directamente desde dataset/ (leve + severa -> con_plaga)
+    train_gen = BalancedImageSampler(
+        DATA_DIR, 'train',
+        class_map=BINARY_CLASS_MAP,
+        class_weights=CLASS_SAMPLING_WEIGHTS,  # None = lotes 50%/50%
+        img_size=IMG_SIZE,
         batch_size=BATCH_SIZE,
+        image_data_generator=train_datagen,
         class_mode='binary',  # Modo binario
-        shuffle=True
+        shard_index=worker_index,
+        num_shards=num_workers,
+        workers=LOADER_WORKERS
     )
     
-    val_gen = val_datagen.flow_from_directory(
-        'dataset_binary/val',
-        target_size=IMG_SIZE,
+    val_gen = BalancedImageSampler(
+        DATA_DIR, 'val',
+        class_map=BINARY_CLASS_MAP,
+        balanced=False,
+        shuffle=False,
+        img_size=IMG_SIZE,
         batch_size=BATCH_SIZE,
+        image_data_generator=val_datagen,
         class_mode='binary',
-        shuffle=False
+        shard_index=worker_index,
+        num_shards=num_workers,
+        workers=LOADER_WORKERS
     )
     
-    test_gen = val_datagen.flow_from_directory(
-        'dataset_binary/test',
-        target_size=IMG_SIZE,
+    test_gen = BalancedImageSampler(
+        DATA_DIR, 'test',
+        class_map=BINARY_CLASS_MAP,
+        balanced=False,
+        shuffle=False,
+        img_size=IMG_SIZE,
         batch_size=BATCH_SIZE,
+        image_data_generator=val_datagen,
         class_mode='binary',
-        shuffle=False
+        shard_index=worker_index,
+        num_shards=num_workers,
+        workers=LOADER_WORKERS
     )
     
     print(f"📊 Clases detectadas: {train_gen.class_indices}")
     print(f"📊 Train: {train_gen.samples} | Val: {val_gen.samples} | Test: {test_gen.samples}")
-    
-    # Crear modelo
-    model = create_binary_model()
-    
-    # Callbacks
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    print(f"📊 Imágenes de entrenamiento por clase: {train_gen.class_counts()}")
+    
+    if num_workers > 1:
+        print(f"🌐 {num_workers} workers: lote global {BATCH_SIZE * num_workers} ({BATCH_SIZE} por worker)")
+    
+    # Crear modelo o recuperar el último checkpoint completo
+    with strategy.scope():
+        model, resume_state = load_latest_checkpoint(CHECKPOINT_DIR) if resume else (None, None)
+        if resume:
+            check_resume_agreement(strategy, resume_state)
+        if model is None:
+            if resume:
+                print(f"⚠️  No hay checkpoints en {CHECKPOINT_DIR}, se entrena desde cero")
+            model = create_binary_model(profile, scale_learning_rate(LEARNING_RATE, num_workers))
+    
+    # Callbacks (al reanudar se conserva el timestamp de la ejecución original)
+    timestamp = resume_state['run_id'] if resume_state else datetime.now().strftime("%Y%m%d_%H%M%S")
     callbacks = [
         tf.keras.callbacks.ModelCheckpoint(
-            f'models/best_binary_model_{timestamp}.h5',
+            worker_path(f'models/best_binary_model_{timestamp}.h5'),
             monitor='val_accuracy',
             save_best_only=True,
             mode='max',
@@ -241,53 +299,92 @@ def train_binary_model():
             patience=4,
             min_lr=1e-7,
             verbose=1
+        ),
+        ThroughputProfiler(
+            batch_size=BATCH_SIZE * num_workers,  # Lote global
+            log_dir=worker_path(f'logs/binary_{timestamp}'),
+            sampler=train_gen,
+            profile_steps=(profile or {}).get('profile_steps')
         )
     ]
+    # Debe ir al final: restaura su estado tras el on_train_begin de los demás
+    callbacks.append(FullStateCheckpoint(
+        worker_path(CHECKPOINT_DIR),
+        run_id=timestamp,
+        callbacks=list(callbacks),
+        samplers=[train_gen],
+        every_n_epochs=CHECKPOINT_EVERY,
+        keep_last=CHECKPOINT_KEEP,
+        resume_state=resume_state
+    ))
+    initial_epoch = resume_state['epoch'] + 1 if resume_state else 0
     
     # Entrenar
     print(f"🎯 Iniciando entrenamiento por {EPOCHS} épocas...")
     history = model.fit(
-        train_gen,
+        training_input(train_gen, num_workers),
         epochs=EPOCHS,
-        validation_data=val_gen,
+        initial_epoch=initial_epoch,
+        validation_data=training_input(val_gen, num_workers),
         callbacks=callbacks,
         verbose=1
     )
     
+    # Evaluación, guardado y gráficas solo en el worker jefe
+    if worker_index != 0:
+        return None
+    if num_workers > 1:
+        # Copia fuera de la estrategia para evaluar todo el conjunto de prueba
+        trained = model
+        model = tf.keras.models.clone_model(trained)
+        model.set_weights(trained.get_weights())
+    
     # Evaluar
     print(f"\n📊 EVALUACIÓN FINAL:")
-    test_loss, test_acc, test_prec, test_rec, test_auc = model.evaluate(test_gen, verbose=1)
-    
-    # Calcular F1-Score
-    f1_score = 2 * (test_prec * test_rec) / (test_prec + test_rec) if (test_prec + test_rec) > 0 else 0
+    # Una sola pasada sobre test: métricas y matriz de confusión salen de las mismas predicciones
+    results = evaluate_generator(model, test_gen)
     
     print(f"\n📈 RESULTADOS FINALES:")
-    print(f"   Accuracy: {test_acc:.4f}")
-    print(f"   Precision: {test_prec:.4f}")
-    print(f"   Recall: {test_rec:.4f}")
-    print(f"   F1-Score: {f1_score:.4f}")
-    print(f"   AUC: {test_auc:.4f}")
-    
-    # Matriz de confusión
-    predictions = model.predict(test_gen)
-    predicted_classes = (predictions > 0.5).astype(int).flatten()
-    true_classes = test_gen.classes
-    
-    cm = confusion_matrix(true_classes, predicted_classes)
+    print(f"   Accuracy: {results['accuracy']:.4f}")
+    print(f"   Precision: {results['precision']:.4f}")
+    print(f"   Recall: {results['recall']:.4f}")
+    print(f"   F1-Score: {results['f1_score']:.4f}")
+    print(f"   AUC: {results['auc']:.4f}")
+    
     print(f"\n📊 MATRIZ DE CONFUSIÓN:")
-    print(f"   [[Sin Plaga, Con Plaga]]")
-    print(f"   {cm}")
+    print(f"   {sorted(test_gen.class_indices, key=test_gen.class_indices.get)}")
+    print(f"   {results['confusion_matrix']}")
     
-    # Guardar modelo final
+    # Guardar modelo final (con el preprocesamiento incluido: recibe uint8)
     os.makedirs('models', exist_ok=True)
+    model = with_preprocessing(model)
     model.save('models/binary_whitefly_detector.h5')
     print(f"\n💾 Modelo guardado: models/binary_whitefly_detector.h5")
     
+    save_bundle(
+        model, 'models/binary_whitefly_detector.bundle',
+        sorted(test_gen.class_indices, key=test_gen.class_indices.get), 'binary',
+        data_hash=dataset_hash(DATA_DIR),
+        benchmarks=benchmark(model, results, test_gen.filepaths[0] if len(test_gen.filepaths) else None,
+                             test_gen.filepaths[:PARITY_IMAGES]),
+        epochs_trained=len(history.history.get('loss', [])),
+        run_id=timestamp
+    )
+    print(f"📦 Bundle guardado: models/binary_whitefly_detector.bundle")
+    
+    # Configuración para modelos .h5 sin bundle
+    write_model_config(
+        sorted(test_gen.class_indices, key=test_gen.class_indices.get),
+        kind='binary',
+        timestamp=datetime.now().isoformat(),
+        epochs_trained=len(history.history.get('loss', []))
+    )
+    
     # Gráficas
     plot_training_results(history, timestamp)
     
     # Prueba individual
-    test_individual_prediction(model)
+    test_individual_prediction(model, test_gen)
     
     return model
 
@@ -336,34 +433,29 @@ def plot_training_results(history, timestamp):
     print(f"📊 Gráficas guardadas: binary_training_results_{timestamp}.png")
     plt.show()
 
-def test_individual_prediction(model):
+def test_individual_prediction(model, test_gen):
     """Probar predicción individual"""
     print(f"\n🧪 PRUEBA INDIVIDUAL:")
     
     # Buscar una imagen de cada clase
-    sin_plaga_path = None
-    con_plaga_path = None
-    
-    if os.path.exists('dataset_binary/test/sin_plaga'):
-        sin_plaga_files = os.listdir('dataset_binary/test/sin_plaga')
-        if sin_plaga_files:
-            sin_plaga_path = f"dataset_binary/test/sin_plaga/{sin_plaga_files[0]}"
+    def first_image(class_name):
+        matches = np.nonzero(test_gen.classes == test_gen.class_indices[class_name])[0]
+        return test_gen.filepaths[matches[0]] if len(matches) else None
     
-    if os.path.exists('dataset_binary/test/con_plaga'):
-        con_plaga_files = os.listdir('dataset_binary/test/con_plaga')
-        if con_plaga_files:
-            con_plaga_path = f"dataset_binary/test/con_plaga/{con_plaga_files[0]}"
+    sin_plaga_path = first_image('sin_plaga')
+    con_plaga_path = first_image('con_plaga')
     
     def predict_image(image_path, expected_class):
         if not os.path.exists(image_path):
             return
         
+        # El modelo guardado escala y redimensiona: recibe los píxeles tal cual
         img = tf.keras.preprocessing.image.load_img(image_path, target_size=IMG_SIZE)
-        img_array = tf.keras.preprocessing.image.img_to_array(img)
-        img_array = np.expand_dims(img_array, axis=0) / 255.0
+        img_array = np.asarray(img)[None]
         
-        prediction = model.predict(img_array)[0][0]
-        predicted_class = "Con Plaga" if prediction > 0.5 else "Sin Plaga"
+        # La salida es P(sin_plaga): con_plaga=0, sin_plaga=1 en orden alfabético
+        prediction = model.predict_on_batch(img_array)[0][0]
+        predicted_class = "Sin Plaga" if prediction > 0.5 else "Con Plaga"
         confidence = prediction if prediction > 0.5 else 1 - prediction
         
         print(f"🔍 {expected_class}:")
@@ -382,21 +474,30 @@ def main():
     print("🌱 SISTEMA BINARIO DE DETECCIÓN DE MOSCA BLANCA")
     print("="*60)
     
+    parser = argparse.ArgumentParser(description="Entrenamiento del modelo binario")
+    parser.add_argument('--resume', action='store_true',
+                        help=f"Continuar desde el último checkpoint en {CHECKPOINT_DIR}")
+    args = parser.parse_args()
+    
+    # Aplicar perfil de rendimiento (hilos, XLA, precisión mixta)
+    profile = apply_training_profile()
+    
+    # Estrategia distribuida si TF_CONFIG describe varios workers (launch_distributed.py)
+    strategy = get_strategy()
+    
     # Establecer semilla para reproducibilidad
     random.seed(42)
     tf.random.set_seed(42)
     np.random.seed(42)
     
-    # Crear dataset balanceado
-    if create_balanced_binary_dataset():
-        print("\n✅ Dataset binario creado exitosamente")
-        
-        # Entrenar modelo
-        model = train_binary_model()
-        
-        print(f"\n🎉 ¡ENTRENAMIENTO COMPLETADO!")
-        print(f"💾 Modelo guardado como: models/binary_whitefly_detector.h5")
-        print(f"🎯 Sistema listo para detectar: SIN PLAGA vs CON PLAGA")
+    # Entrenar modelo (lotes balanceados leídos directamente de dataset/)
+    model = train_binary_model(profile, resume=args.resume, strategy=strategy)
+    if model is None:
+        return
+    
+    print(f"\n🎉 ¡ENTRENAMIENTO COMPLETADO!")
+    print(f"💾 Modelo guardado como: models/binary_whitefly_detector.h5")
+    print(f"🎯 Sistema listo para detectar: SIN PLAGA vs CON PLAGA")
     
     print("="*60)
 
@@ -0,0 +1,220 @@
+# compare_models.py - Comparación de varios modelos sobre el mismo conjunto de prueba
+"""
+Decodifica y preprocesa cada imagen de prueba una sola vez y entrega el
+mismo lote a todos los modelos candidatos (en hilos paralelos). Al final
+imprime una tabla con métricas, latencia media y p95, tamaño y memoria.
+
+El pico de memoria de cada modelo se mide aparte, en un proceso propio que
+lo carga y predice un lote completo de evaluación: en el proceso principal
+los modelos comparten el allocator y se evalúan a la vez, así que la RSS
+no separa lo que usa cada uno.
+
+Uso:
+    python compare_models.py                          # Todos los .h5/.keras/.bundle de models/
+    python compare_models.py models/a.h5 models/b.h5  # Modelos concretos
+    python compare_models.py --test-dir dataset/test --workers 4
+"""
+
+import os
+import glob
+import time
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+import psutil
+from tensorflow import keras
+
+from balanced_sampler import BINARY_CLASS_MAP, load_image_array
+from dataset_index import CLASSES, list_images
+from evaluation import EVAL_BATCH_SIZE, compute_metrics, model_input_size
+from model_bundle import BUNDLE_EXTENSION, ModelBundle
+from model_config import accepts_uint8
+
+LATENCY_RUNS = 50
+MEMORY_SAMPLE_SECONDS = 0.002  # Intervalo de muestreo de la RSS durante la medición del pico
+
+def _rss_mb() -> float:
+    return psutil.Process().memory_info().rss / (1024 ** 2)
+
+def _load_model(path: str):
+    """(modelo, bundle o None) de un .h5/.keras/.bundle."""
+    bundle = ModelBundle(path) if path.endswith(BUNDLE_EXTENSION) else None
+    return (bundle.model if bundle else keras.models.load_model(path, compile=False)), bundle
+
+def _dummy_batch(model, batch_size: int) -> np.ndarray:
+    dtype = np.uint8 if accepts_uint8(model) else np.float32
+    return np.zeros((batch_size, *model_input_size(model), 3), dtype=dtype)
+
+def _peak_memory_worker(path: str, batch_size: int) -> float:
+    """
+    (Proceso hijo) Aumento máximo de RSS en MB al cargar el modelo y
+    predecir un lote de `batch_size` imágenes. TensorFlow ya está importado
+    al empezar, así que no cuenta en la medición.
+    """
+    baseline = _rss_mb()
+    peak = baseline
+    stop = threading.Event()
+
+    def sample():
+        nonlocal peak
+        while not stop.is_set():
+            peak = max(peak, _rss_mb())
+            stop.wait(MEMORY_SAMPLE_SECONDS)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    try:
+        model, _ = _load_model(path)
+        model.predict_on_batch(_dummy_batch(model, batch_size))
+    finally:
+        stop.set()
+        sampler.join()
+    return max(peak, _rss_mb()) - baseline
+
+def measure_peak_memory(candidates: List[Dict], batch_size: int = EVAL_BATCH_SIZE):
+    """Pico de memoria de cada modelo con un lote de evaluación, un proceso nuevo por modelo."""
+    context = multiprocessing.get_context('spawn')
+    for candidate in candidates:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            candidate['peak_memory_mb'] = executor.submit(
+                _peak_memory_worker, candidate['path'], batch_size
+            ).result()
+
+def load_candidates(paths: List[str]) -> List[Dict]:
+    """Carga los modelos uno a uno midiendo la memoria que ocupa cargar cada uno."""
+    candidates = []
+    for path in paths:
+        before = _rss_mb()
+        model, bundle = _load_model(path)
+        size = model_input_size(model)
+        uint8 = accepts_uint8(model)
+        model.predict_on_batch(_dummy_batch(model, 1))  # Reserva buffers
+        binary = model.output_shape[-1] == 1
+
+        candidates.append({
+            'name': os.path.basename(path),
+            'path': path,
+            'model': model,
+            'bundle': bundle,
+            'img_size': size,
+            'uint8': uint8,
+            'binary': binary,
+            'class_names': bundle.classes if bundle else
+                           sorted(set(BINARY_CLASS_MAP.values())) if binary else sorted(CLASSES),
+            'file_mb': os.path.getsize(path) / (1024 ** 2),
+            'load_memory_mb': _rss_mb() - before,
+            'probs': []
+        })
+        print(f"📦 {os.path.basename(path)}: {'binario' if binary else 'multiclase'}, entrada {size}")
+    return candidates
+
+def run_comparison(candidates: List[Dict], filepaths: List[str], source_classes: List[str],
+                   batch_size: int = EVAL_BATCH_SIZE, workers: int = 4):
+    """Recorre el conjunto de prueba decodificando cada lote una sola vez."""
+    # Los modelos con preprocesamiento incluido reciben los píxeles uint8 tal cual
+    inputs = {(c['img_size'], c['uint8']) for c in candidates}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(filepaths), batch_size):
+            paths = filepaths[start:start + batch_size]
+
+            # Un único decode por imagen y tamaño de entrada
+            pixels = {
+                size: np.stack([load_image_array(p, size, np.uint8) for p in paths])
+                for size in {size for size, _ in inputs}
+            }
+            batches = {
+                (size, uint8): pixels[size] if uint8 else pixels[size] / np.float32(255)
+                for size, uint8 in inputs
+            }
+
+            futures = [
+                executor.submit(c['model'].predict_on_batch, batches[c['img_size'], c['uint8']])
+                for c in candidates
+            ]
+            for candidate, future in zip(candidates, futures):
+                candidate['probs'].append(np.asarray(future.result()).reshape(len(paths), -1))
+
+            print(f"\r   {min(start + batch_size, len(filepaths))}/{len(filepaths)} imágenes",
+                  end='', flush=True)
+    print()
+
+    for candidate in candidates:
+        probs = np.concatenate(candidate['probs'])
+        names = candidate['class_names']
+        if candidate['binary']:
+            labels = [names.index(BINARY_CLASS_MAP[c]) for c in source_classes]
+        else:
+            labels = [names.index(c) for c in source_classes]
+        # Los bundles deciden con el umbral de su manifiesto, como el servidor
+        bundle = candidate['bundle']
+        y_pred = bundle.decide(bundle.probabilities(probs)) if bundle else None
+        candidate['metrics'] = compute_metrics(labels, probs, names, y_pred=y_pred)
+
+def measure_latency(candidates: List[Dict], sample_path: str, runs: int = LATENCY_RUNS):
+    """Latencia de una imagen por modelo, medida en secuencia para no interferir."""
+    for candidate in candidates:
+        x = load_image_array(sample_path, candidate['img_size'], np.uint8)[None]
+        if not candidate['uint8']:
+            x = x / np.float32(255)
+        candidate['model'](x, training=False)  # Calentamiento
+        times = []
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            candidate['model'](x, training=False)
+            times.append((time.perf_counter() - t0) * 1000)
+        candidate['latency_mean_ms'] = float(np.mean(times))
+        candidate['latency_p95_ms'] = float(np.percentile(times, 95))
+
+def print_table(candidates: List[Dict]):
+    """Tabla comparativa lado a lado."""
+    header = (f"{'Modelo':40} {'Acc':>7} {'Prec':>7} {'Rec':>7} {'F1':>7} {'AUC':>7} "
+              f"{'ms':>7} {'p95':>7} {'MB':>7} {'Carga':>7} {'Pico':>7}")
+    print("\n" + header)
+    print("-" * len(header))
+    for c in sorted(candidates, key=lambda c: -c['metrics']['accuracy']):
+        m = c['metrics']
+        print(f"{c['name'][:40]:40} {m['accuracy']:7.4f} {m['precision']:7.4f} {m['recall']:7.4f} "
+              f"{m['f1_score']:7.4f} {m['auc']:7.4f} {c['latency_mean_ms']:7.1f} "
+              f"{c['latency_p95_ms']:7.1f} {c['file_mb']:7.1f} {c['load_memory_mb']:7.0f} "
+              f"{c.get('peak_memory_mb', float('nan')):7.0f}")
+    print("\nms/p95: latencia por imagen | MB: archivo | Carga: RSS al cargar (MB) | "
+          "Pico: RSS máxima con un lote de evaluación, en un proceso aparte (MB)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara modelos sobre el mismo conjunto de prueba")
+    parser.add_argument('models', nargs='*', help="Rutas de modelos (por defecto, todos los de models/)")
+    parser.add_argument('--test-dir', default='dataset/test')
+    parser.add_argument('--batch-size', type=int, default=EVAL_BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=4, help="Modelos evaluados en paralelo")
+    args = parser.parse_args()
+
+    paths = args.models or sorted(glob.glob('models/*.h5') + glob.glob('models/*.keras') +
+                                  glob.glob(f'models/*{BUNDLE_EXTENSION}'))
+    if not paths:
+        print("❌ No se encontraron modelos")
+        return
+
+    filepaths, source_classes = [], []
+    for clase in CLASSES:
+        images = list_images(os.path.join(args.test_dir, clase))
+        filepaths.extend(str(p) for p in images)
+        source_classes.extend([clase] * len(images))
+    if not filepaths:
+        print(f"❌ No hay imágenes en {args.test_dir}")
+        return
+
+    print(f"🏁 Comparando {len(paths)} modelos sobre {len(filepaths)} imágenes\n")
+    candidates = load_candidates(paths)
+    run_comparison(candidates, filepaths, source_classes, args.batch_size, args.workers)
+    measure_latency(candidates, filepaths[0])
+    print("📏 Midiendo el pico de memoria de cada modelo...")
+    measure_peak_memory(candidates, args.batch_size)
+    print_table(candidates)
+
+if __name__ == "__main__":
+    main()
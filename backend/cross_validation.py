@@ -0,0 +1,337 @@
+# cross_validation.py - Validación cruzada k-fold por grupos de imágenes
+"""
+Validación cruzada sobre train + val (test queda reservado). Los folds se
+asignan por grupos: todas las variantes de una misma foto de origen y los
+casi duplicados (dedupe_dataset.group_near_duplicates) caen en el mismo
+fold, así que ninguna foto se evalúa con una copia suya en entrenamiento.
+
+Los folds se entrenan en paralelo en un pool de procesos, cada uno con un
+número acotado de hilos. Modos:
+    full      - Entrena el modelo completo (fine-tuning y augmentation) en cada fold
+    features  - Backbone congelado: las características de MobileNetV2 se calculan
+                una sola vez (con caché en disco) y cada fold entrena solo la cabeza
+
+Tamaño de entrada y alpha salen de model_config (model_arch.json o
+IMG_SIZE/MOBILENET_ALPHA), igual que en el entrenamiento y el servidor.
+
+Uso:
+    python cross_validation.py                              # Binario, 5 folds, modo full
+    python cross_validation.py --mode features --folds 5
+    python cross_validation.py --kind multiclass --parallel 2 --epochs 10
+"""
+
+import os
+import json
+import argparse
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List
+
+import numpy as np
+
+from dataset_index import CLASSES
+from dedupe_dataset import build_hash_index, group_near_duplicates
+from model_config import ALPHA, IMG_SIZE
+
+FEATURES_DIR = 'cache/features'
+RESULTS_DIR = 'logs'
+METRICS = ['loss', 'accuracy', 'precision', 'recall', 'f1_score', 'auc']
+
+def _class_map(kind: str) -> Dict[str, str]:
+    from balanced_sampler import BINARY_CLASS_MAP
+    return BINARY_CLASS_MAP if kind == 'binary' else {c: c for c in CLASSES}
+
+def assign_folds(index: List[Dict], groups: List[List[int]], k: int, class_map: Dict[str, str],
+                 seed: int = 42) -> np.ndarray:
+    """
+    Fold de cada imagen. Los grupos se reparten de mayor a menor tamaño en el
+    fold con menos imágenes de la clase dominante del grupo (estratificación
+    aproximada sin separar nunca un grupo).
+    """
+    target_classes = sorted(set(class_map.values()))
+    counts = np.zeros((k, len(target_classes)), dtype=np.int64)
+    folds = np.full(len(index), -1, dtype=np.int64)
+
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(groups))
+    order = sorted(order, key=lambda g: -len(groups[g]))  # Estable: empates en orden aleatorio
+
+    for g in order:
+        members = groups[g]
+        labels = [target_classes.index(class_map[index[i]['clase']]) for i in members]
+        dominant = Counter(labels).most_common(1)[0][0]
+        fold = min(range(k), key=lambda f: (counts[f, dominant], counts[f].sum()))
+        folds[members] = fold
+        for label in labels:
+            counts[fold, label] += 1
+    return folds
+
+def _init_worker(threads: int, img_size, alpha: float):
+    """Límite de hilos y arquitectura del proceso (antes de importar TensorFlow)."""
+    os.environ['INTRA_OP_THREADS'] = str(threads)
+    os.environ['INTER_OP_THREADS'] = '1'
+    # Los modelos del fold se construyen con model_config: misma arquitectura que el padre
+    os.environ['IMG_SIZE'] = ','.join(str(s) for s in img_size)
+    os.environ['MOBILENET_ALPHA'] = str(alpha)
+
+def _extract_features(spec: Dict) -> str:
+    """
+    Características del backbone congelado (pooling promedio) para todas las
+    imágenes. Reutiliza las ya calculadas, indexadas por SHA-1 del contenido.
+    """
+    from training_profile import apply_training_profile
+    apply_training_profile(verbose=False)
+    from tensorflow import keras
+    from evaluation import make_image_dataset
+    from prediction_cache import content_hashes
+    from model_config import build_backbone
+
+    paths = spec['paths']
+    img_size = tuple(spec['img_size'])
+    cache_path = os.path.join(
+        FEATURES_DIR, f"mobilenetv2_a{spec['alpha']}_{img_size[0]}x{img_size[1]}.npz"
+    )
+
+    known = {}
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as data:
+            for image_hash, feature in zip(data['image_hashes'], data['features']):
+                known[image_hash.tobytes()] = feature
+
+    keys = [bytes.fromhex(h) for h in content_hashes(paths)]
+    missing = {}
+    for key, path in zip(keys, paths):
+        if key not in known:
+            missing.setdefault(key, path)
+
+    if missing:
+        print(f"🧠 Calculando características de {len(missing)} imágenes "
+              f"({len(set(keys)) - len(missing)} en caché)")
+        backbone = keras.Sequential([
+            build_backbone(img_size, spec['alpha']),
+            keras.layers.GlobalAveragePooling2D()
+        ])
+        features = backbone.predict(make_image_dataset(list(missing.values()), img_size), verbose=0)
+        for key, feature in zip(missing, features):
+            known[key] = feature.astype(np.float32)
+
+        os.makedirs(FEATURES_DIR, exist_ok=True)
+        tmp_path = cache_path.replace('.npz', '.tmp.npz')
+        np.savez(
+            tmp_path,
+            image_hashes=np.frombuffer(b''.join(known), dtype=np.uint8).reshape(-1, 20),
+            features=np.stack(list(known.values()))
+        )
+        os.replace(tmp_path, cache_path)
+    return cache_path
+
+def _train_head(spec: Dict, train_idx: np.ndarray, val_idx: np.ndarray, labels: np.ndarray):
+    """Entrena solo la cabeza sobre las características precalculadas."""
+    from tensorflow import keras
+    from prediction_cache import content_hashes
+
+    with np.load(spec['features_path']) as data:
+        known = {h.tobytes(): f for h, f in zip(data['image_hashes'], data['features'])}
+    features = np.stack([known[bytes.fromhex(h)] for h in content_hashes(spec['paths'])])
+
+    num_classes = len(spec['class_names'])
+    binary = spec['kind'] == 'binary'
+
+    inputs = keras.Input(shape=features.shape[1:])
+    x = inputs
+    for i, units in enumerate(spec['dense_units']):
+        x = keras.layers.BatchNormalization()(x)
+        x = keras.layers.Dense(units, activation='relu')(x)
+        x = keras.layers.Dropout(max(0.0, spec['dropout'] - 0.1 * i))(x)
+    outputs = keras.layers.Dense(1 if binary else num_classes,
+                                 activation='sigmoid' if binary else 'softmax', dtype='float32')(x)
+    model = keras.Model(inputs, outputs)
+    model.compile(
+        optimizer=keras.optimizers.Adam(learning_rate=spec['learning_rate']),
+        loss='binary_crossentropy' if binary else 'sparse_categorical_crossentropy'
+    )
+
+    # Mismo peso total por clase, como los lotes balanceados del sampler
+    counts = np.bincount(labels[train_idx], minlength=num_classes)
+    class_weight = {c: len(train_idx) / (num_classes * n) for c, n in enumerate(counts) if n}
+
+    model.fit(
+        features[train_idx], labels[train_idx].astype(np.float32),
+        validation_data=(features[val_idx], labels[val_idx].astype(np.float32)),
+        epochs=spec['epochs'], batch_size=spec['batch_size'], class_weight=class_weight,
+        callbacks=[keras.callbacks.EarlyStopping(patience=5, restore_best_weights=True)],
+        verbose=0
+    )
+    return model.predict(features[val_idx], batch_size=256, verbose=0)
+
+def _train_full(spec: Dict, train_idx: np.ndarray, val_idx: np.ndarray):
+    """Entrena el modelo completo del fold con el sampler balanceado."""
+    from tensorflow import keras
+    from balanced_sampler import BalancedImageSampler
+    from evaluation import predict_files
+
+    binary = spec['kind'] == 'binary'
+    if binary:
+        from binary_train_optimized import create_binary_model
+        model = create_binary_model(spec['profile'], learning_rate=spec['learning_rate'],
+                                    dropout=spec['dropout'], dense_units=tuple(spec['dense_units']))
+    else:
+        from train_model import WhiteflyModelTrainer
+        model = WhiteflyModelTrainer(spec['profile']).build_model(
+            learning_rate=spec['learning_rate'], dropout=spec['dropout'],
+            dense_units=tuple(spec['dense_units'])
+        )
+
+    files = list(zip(spec['paths'], spec['source_classes']))
+    common = dict(
+        class_map=spec['class_map'],
+        img_size=tuple(spec['img_size']),
+        batch_size=spec['batch_size'],
+        class_mode='binary' if binary else 'categorical',
+        workers=spec['loader_workers']
+    )
+    train_gen = BalancedImageSampler(
+        files=[files[i] for i in train_idx],
+        image_data_generator=keras.preprocessing.image.ImageDataGenerator(
+            rescale=1./255, rotation_range=30, width_shift_range=0.2, height_shift_range=0.2,
+            horizontal_flip=True, zoom_range=0.2, brightness_range=[0.8, 1.2], fill_mode='nearest'
+        ),
+        **common
+    )
+    val_gen = BalancedImageSampler(files=[files[i] for i in val_idx], balanced=False,
+                                   shuffle=False, **common)
+
+    model.fit(
+        train_gen, epochs=spec['epochs'], validation_data=val_gen,
+        callbacks=[keras.callbacks.EarlyStopping(monitor='val_loss', patience=5,
+                                                 restore_best_weights=True)],
+        verbose=0
+    )
+    return predict_files(model, val_gen.filepaths)
+
+def _run_fold(spec: Dict) -> Dict:
+    """Entrena y evalúa un fold (se ejecuta en el pool)."""
+    from training_profile import apply_training_profile
+    spec['profile'] = apply_training_profile(verbose=False)
+    from evaluation import compute_metrics
+
+    folds = np.asarray(spec['folds'])
+    labels = np.asarray(spec['labels'])
+    train_idx = np.nonzero(folds != spec['fold'])[0]
+    val_idx = np.nonzero(folds == spec['fold'])[0]
+
+    if spec['mode'] == 'features':
+        probs = _train_head(spec, train_idx, val_idx, labels)
+    else:
+        probs = _train_full(spec, train_idx, val_idx)
+
+    results = compute_metrics(labels[val_idx], probs, spec['class_names'])
+    return {'fold': spec['fold'], 'train_images': len(train_idx), 'val_images': len(val_idx),
+            **{m: results[m] for m in METRICS}}
+
+def run_cross_validation(kind='binary', k=5, mode='full', epochs=15, parallel=None,
+                         root='dataset', splits=('train', 'val'), learning_rate=1e-3,
+                         dropout=0.4, dense_units=(256, 128), batch_size=32,
+                         img_size=None, alpha=None, seed=42) -> Dict:
+    """Asigna folds por grupo, entrena todos en paralelo y resume las métricas."""
+    img_size = tuple(img_size or IMG_SIZE)
+    alpha = alpha if alpha is not None else ALPHA
+    class_map = _class_map(kind)
+    class_names = sorted(set(class_map.values()))
+
+    full_index = build_hash_index(root)
+    keep = [i for i, entry in enumerate(full_index) if entry['split'] in splits]
+    index = [full_index[i] for i in keep]
+    groups = group_near_duplicates(index)
+    folds = assign_folds(index, groups, k, class_map, seed)
+
+    paths = [str(entry['path']) for entry in index]
+    source_classes = [entry['clase'] for entry in index]
+    labels = [class_names.index(class_map[c]) for c in source_classes]
+
+    print(f"🧪 Validación cruzada {k}-fold ({kind}, modo {mode}): {len(index)} imágenes, "
+          f"{len(groups)} grupos de origen")
+    largest = max(len(g) for g in groups)
+    if largest > len(index) / k:
+        print(f"   ⚠️  El grupo más grande tiene {largest} imágenes (más que un fold): "
+              f"los folds quedarán desbalanceados; revisar con dedupe_dataset.py report")
+    for f in range(k):
+        fold_labels = Counter(class_names[labels[i]] for i in np.nonzero(folds == f)[0])
+        print(f"   Fold {f + 1}: {dict(sorted(fold_labels.items()))}")
+
+    cores = os.cpu_count() or 1
+    parallel = parallel or min(k, max(1, cores // 4))
+    threads = max(1, cores // parallel)
+
+    spec = {
+        'kind': kind, 'mode': mode, 'epochs': epochs, 'paths': paths,
+        'source_classes': source_classes, 'labels': labels, 'folds': folds.tolist(),
+        'class_map': class_map, 'class_names': class_names, 'learning_rate': learning_rate,
+        'dropout': dropout, 'dense_units': list(dense_units), 'batch_size': batch_size,
+        'img_size': list(img_size), 'alpha': alpha, 'loader_workers': max(1, min(4, threads))
+    }
+
+    # spawn: cada proceso importa TensorFlow por su cuenta con su límite de hilos
+    context = multiprocessing.get_context('spawn')
+
+    if mode == 'features':
+        with ProcessPoolExecutor(max_workers=1, mp_context=context,
+                                 initializer=_init_worker, initargs=(cores, img_size, alpha)) as executor:
+            spec['features_path'] = executor.submit(_extract_features, spec).result()
+
+    print(f"\n🚀 Entrenando {k} folds, {parallel} en paralelo ({threads} hilos c/u)...")
+    with ProcessPoolExecutor(max_workers=parallel, mp_context=context,
+                             initializer=_init_worker, initargs=(threads, img_size, alpha)) as executor:
+        fold_results = list(executor.map(_run_fold, [{**spec, 'fold': f} for f in range(k)]))
+
+    summary = {
+        m: {'mean': float(np.nanmean([r[m] for r in fold_results])),
+            'std': float(np.nanstd([r[m] for r in fold_results]))}
+        for m in METRICS
+    }
+    report = {
+        'kind': kind, 'mode': mode, 'folds': k, 'epochs': epochs,
+        'img_size': list(img_size), 'alpha': alpha,
+        'images': len(index), 'groups': len(groups),
+        'fold_results': fold_results, 'summary': summary
+    }
+    print_summary(report)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f"cv_{kind}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"\n💾 Resultados guardados en {path}")
+    return report
+
+def print_summary(report: Dict):
+    header = f"{'Fold':>5} " + " ".join(f"{m:>10}" for m in METRICS)
+    print("\n" + header)
+    print("-" * len(header))
+    for r in report['fold_results']:
+        print(f"{r['fold'] + 1:>5} " + " ".join(f"{r[m]:>10.4f}" for m in METRICS))
+    print("-" * len(header))
+    print(f"{'Media':>5} " + " ".join(f"{report['summary'][m]['mean']:>10.4f}" for m in METRICS))
+    print(f"{'Desv':>5} " + " ".join(f"{report['summary'][m]['std']:>10.4f}" for m in METRICS))
+
+def main():
+    parser = argparse.ArgumentParser(description="Validación cruzada k-fold por grupos de origen")
+    parser.add_argument('--kind', choices=['binary', 'multiclass'], default='binary')
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--mode', choices=['full', 'features'], default='full',
+                        help="features = backbone congelado con características en caché")
+    parser.add_argument('--epochs', type=int, default=15)
+    parser.add_argument('--parallel', type=int, default=None, help="Folds entrenados a la vez")
+    parser.add_argument('--dataset', default='dataset')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    defaults = {'binary': {'dropout': 0.4, 'dense_units': (256, 128)},
+                'multiclass': {'dropout': 0.5, 'dense_units': (512, 256, 128)}}[args.kind]
+    run_cross_validation(kind=args.kind, k=args.folds, mode=args.mode, epochs=args.epochs,
+                         parallel=args.parallel, root=args.dataset, seed=args.seed, **defaults)
+
+if __name__ == "__main__":
+    main()
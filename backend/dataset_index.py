@@ -0,0 +1,104 @@
+# dataset_index.py - Utilidades compartidas para recorrer el dataset
+"""
+Listado de imágenes por split/clase, normalización de nombres de Roboflow
+y una caché en disco de resultados por archivo invalidada por tamaño y mtime.
+"""
+
+import os
+import re
+import json
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+SPLITS = ['train', 'val', 'test']
+CLASSES = ['sin_plaga', 'infestacion_leve', 'infestacion_severa']
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# "foto (copy 1).jpg" -> "foto.jpg"
+_COPY_SUFFIX = re.compile(r'\s*\(copy \d+\)$', re.IGNORECASE)
+# "foto_jpg.rf.<hash>" -> "foto"
+_ROBOFLOW_SUFFIX = re.compile(r'_(jpe?g|png)\.rf\.[0-9a-f]+$', re.IGNORECASE)
+
+def list_images(directory) -> List[Path]:
+    """Lista las imágenes de un directorio, ordenadas por nombre."""
+    directory = Path(directory)
+    if not directory.exists():
+        return []
+    return sorted(
+        p for p in directory.iterdir()
+        if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS
+    )
+
+def iter_dataset_images(root='dataset', splits=SPLITS, classes=CLASSES) -> Iterator[Tuple[str, str, Path]]:
+    """Recorre root/<split>/<clase>/ devolviendo (split, clase, ruta)."""
+    for split in splits:
+        for clase in classes:
+            for path in list_images(Path(root) / split / clase):
+                yield split, clase, path
+
+def source_frame_key(filename: str) -> str:
+    """
+    Obtiene la foto de origen a partir del nombre del archivo, eliminando
+    los sufijos de copia y las variantes exportadas por Roboflow.
+    """
+    stem = Path(filename).stem
+    stem = _COPY_SUFFIX.sub('', stem)
+    stem = _ROBOFLOW_SUFFIX.sub('', stem)
+    return stem
+
+class FileStatCache:
+    """
+    Caché JSON de resultados por archivo.
+
+    Cada entrada se asocia a la ruta relativa a `root` y se invalida cuando
+    cambia el tamaño o la fecha de modificación del archivo.
+    """
+
+    def __init__(self, cache_path, root='.'):
+        self.cache_path = Path(cache_path)
+        self.root = Path(root)
+        self.entries: Dict[str, Dict] = {}
+        if self.cache_path.exists():
+            try:
+                with open(self.cache_path) as f:
+                    self.entries = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                self.entries = {}
+
+    def _key(self, path) -> str:
+        return os.path.relpath(path, self.root)
+
+    @staticmethod
+    def _stat(path) -> Tuple[int, float]:
+        st = os.stat(path)
+        return st.st_size, st.st_mtime
+
+    def get(self, path) -> Optional[Dict]:
+        """Retorna el valor cacheado si el archivo no ha cambiado."""
+        entry = self.entries.get(self._key(path))
+        if entry is None:
+            return None
+        try:
+            size, mtime = self._stat(path)
+        except OSError:
+            return None
+        if entry['size'] != size or entry['mtime'] != mtime:
+            return None
+        return entry['value']
+
+    def put(self, path, value: Dict):
+        size, mtime = self._stat(path)
+        self.entries[self._key(path)] = {'size': size, 'mtime': mtime, 'value': value}
+
+    def prune(self, paths):
+        """Elimina entradas de archivos que ya no están en `paths`."""
+        keep = {self._key(p) for p in paths}
+        self.entries = {k: v for k, v in self.entries.items() if k in keep}
+
+    def save(self):
+        """Escritura atómica para no dejar la caché a medias."""
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.cache_path.with_suffix(self.cache_path.suffix + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.cache_path)
@@ -0,0 +1,266 @@
+# dedupe_dataset.py - Deduplicación del dataset entre splits
+"""
+Detecta imágenes duplicadas y casi duplicadas en dataset/ usando un hash
+exacto (SHA-1) y un hash perceptual (dHash de 64 bits) calculados en
+paralelo. Las imágenes se agrupan por foto de origen para evitar que
+variantes de la misma foto queden repartidas entre train, val y test.
+
+Uso:
+    python dedupe_dataset.py report [dataset]          - Mostrar duplicados y fugas entre splits
+    python dedupe_dataset.py drop [dataset] [--apply]  - Eliminar copias exactas
+    python dedupe_dataset.py unify [dataset] [--apply] - Mover cada grupo a un único split
+    python dedupe_dataset.py reuse [dataset] [umbral]  - Comprobar el umbral de reutilización del servidor
+
+Sin --apply solo se muestra lo que se haría.
+"""
+
+import os
+import sys
+import hashlib
+from pathlib import Path
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from dataset_index import SPLITS, FileStatCache, iter_dataset_images, source_frame_key
+
+INDEX_FILENAME = '.hash_index.json'
+HAMMING_THRESHOLD = 6  # Bits distintos para considerar dos imágenes casi iguales
+REUSE_CHECK_THRESHOLD = 4  # REUSE_HAMMING_THRESHOLD por defecto del servidor
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """Hash perceptual por diferencias horizontales (dHash)."""
+    # En JPEG, draft() decodifica a baja resolución directamente
+    image.draft('L', (hash_size * 8, hash_size * 8))
+    gray = image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = np.asarray(gray, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+def _hash_file(path: str) -> Tuple[str, Dict]:
+    """Calcula SHA-1 y dHash de un archivo (se ejecuta en el pool)."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    sha1 = hashlib.sha1(data).hexdigest()
+    try:
+        with Image.open(path) as img:
+            phash = f"{dhash(img):016x}"
+    except Exception:
+        phash = None
+    return path, {'sha1': sha1, 'dhash': phash}
+
+def build_hash_index(root='dataset', workers=None) -> List[Dict]:
+    """
+    Retorna una entrada por imagen con split, clase, ruta y hashes.
+    Solo se calculan los archivos nuevos o modificados desde la última vez.
+    """
+    cache = FileStatCache(Path(root) / INDEX_FILENAME, root)
+    images = list(iter_dataset_images(root))
+
+    pending = [str(path) for _, _, path in images if cache.get(path) is None]
+    if pending:
+        print(f"🔢 Calculando hashes de {len(pending)} imágenes nuevas "
+              f"({len(images) - len(pending)} en caché)...")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for path, value in executor.map(_hash_file, pending, chunksize=32):
+                cache.put(path, value)
+    else:
+        print(f"🔢 {len(images)} imágenes, todos los hashes en caché")
+
+    cache.prune(path for _, _, path in images)
+    cache.save()
+
+    index = []
+    for split, clase, path in images:
+        value = cache.get(path)
+        index.append({'split': split, 'clase': clase, 'path': path, **value})
+    return index
+
+def group_near_duplicates(index: List[Dict], threshold: int = HAMMING_THRESHOLD) -> List[List[int]]:
+    """
+    Agrupa las entradas que comparten foto de origen, contenido exacto o
+    un dHash a distancia de Hamming <= threshold. Retorna listas de índices.
+    """
+    parent = list(range(len(index)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parent[rj] = ri
+
+    # Misma foto de origen o mismo contenido
+    first_seen = {}
+    for i, entry in enumerate(index):
+        for key in (('src', source_frame_key(entry['path'].name)), ('sha1', entry['sha1'])):
+            if key in first_seen:
+                union(first_seen[key], i)
+            else:
+                first_seen[key] = i
+
+    # Hash perceptual cercano (comparación vectorizada)
+    hashed = [i for i, entry in enumerate(index) if entry['dhash']]
+    hashes = np.array([int(index[i]['dhash'], 16) for i in hashed], dtype=np.uint64)
+    for pos in range(len(hashes) - 1):
+        distances = np.bitwise_count(hashes[pos + 1:] ^ hashes[pos])
+        for offset in np.nonzero(distances <= threshold)[0]:
+            union(hashed[pos], hashed[pos + 1 + offset])
+
+    groups = defaultdict(list)
+    for i in range(len(index)):
+        groups[find(i)].append(i)
+    return list(groups.values())
+
+def cross_class_pairs(index: List[Dict], threshold: int) -> Tuple[List[Tuple[int, int, int]], Optional[int]]:
+    """
+    Pares (i, j, distancia) de imágenes de clases distintas con dHash a
+    `threshold` bits o menos, y la menor distancia entre clases distintas.
+    Con el servidor reutilizando resultados a ese umbral, cada par sería
+    una foto que recibe el diagnóstico de otra clase.
+    """
+    hashed = [i for i, entry in enumerate(index) if entry['dhash']]
+    hashes = np.array([int(index[i]['dhash'], 16) for i in hashed], dtype=np.uint64)
+    classes = np.array([index[i]['clase'] for i in hashed])
+    pairs, closest = [], None
+    for pos in range(len(hashes) - 1):
+        other = classes[pos + 1:] != classes[pos]
+        if not other.any():
+            continue
+        distances = np.bitwise_count(hashes[pos + 1:] ^ hashes[pos])
+        nearest = int(distances[other].min())
+        closest = nearest if closest is None else min(closest, nearest)
+        for offset in np.nonzero(other & (distances <= threshold))[0]:
+            pairs.append((hashed[pos], hashed[pos + 1 + offset], int(distances[offset])))
+    return pairs, closest
+
+def reuse_report(index: List[Dict], threshold: int = REUSE_CHECK_THRESHOLD) -> bool:
+    """Indica si reutilizar resultados a `threshold` bits mezclaría clases en este dataset."""
+    pairs, closest = cross_class_pairs(index, threshold)
+    print(f"\n🔁 Reutilización con umbral de {threshold} bits:")
+    print(f"   Menor distancia entre imágenes de clases distintas: {closest}")
+    if not pairs:
+        print(f"   ✅ Ningún par de clases distintas queda a {threshold} bits o menos")
+        return True
+    print(f"   ⚠️  {len(pairs)} pares de clases distintas se confundirían, p.ej.:")
+    for i, j, distance in sorted(pairs, key=lambda p: p[2])[:10]:
+        print(f"      {distance:2d} bits: {index[i]['path']} ({index[i]['clase']}) ~ "
+              f"{index[j]['path']} ({index[j]['clase']})")
+    print(f"   Use REUSE_HAMMING_THRESHOLD < {closest}")
+    return False
+
+def report(index: List[Dict], groups: List[List[int]]):
+    """Imprime un resumen de duplicados y fugas entre splits."""
+    exact = defaultdict(list)
+    for entry in index:
+        exact[entry['sha1']].append(entry)
+    exact_copies = sum(len(v) - 1 for v in exact.values())
+
+    leaking = [g for g in groups if len({index[i]['split'] for i in g}) > 1]
+    conflicts = [g for g in groups if len({index[i]['clase'] for i in g}) > 1]
+
+    print(f"\n📊 Reporte de duplicados:")
+    print(f"   Imágenes: {len(index)}")
+    print(f"   Copias exactas: {exact_copies}")
+    print(f"   Grupos de foto de origen: {len(groups)}")
+    print(f"   Grupos repartidos entre splits: {len(leaking)}")
+    print(f"   Grupos con clases distintas: {len(conflicts)}")
+
+    leaked_test = sum(1 for g in leaking for i in g if index[i]['split'] == 'test')
+    if leaked_test:
+        print(f"\n⚠️  {leaked_test} imágenes de test tienen variantes en train/val")
+
+def drop_exact_copies(index: List[Dict], apply: bool = False) -> int:
+    """Elimina archivos con contenido idéntico, conservando uno por grupo."""
+    exact = defaultdict(list)
+    for entry in index:
+        exact[entry['sha1']].append(entry)
+
+    removed = 0
+    for entries in exact.values():
+        if len(entries) < 2:
+            continue
+        # Conservar el del split más prioritario y sin sufijo de copia
+        entries.sort(key=lambda e: (SPLITS.index(e['split']), '(copy' in e['path'].name, e['path'].name))
+        for entry in entries[1:]:
+            if apply:
+                entry['path'].unlink()
+            removed += 1
+
+    action = "Eliminadas" if apply else "Se eliminarían"
+    print(f"🗑️  {action} {removed} copias exactas")
+    return removed
+
+def unify_splits(index: List[Dict], groups: List[List[int]], apply: bool = False) -> int:
+    """
+    Mueve cada grupo al split donde tiene más imágenes (empate: train, val,
+    test). La clase de cada imagen no se modifica.
+    """
+    moved = 0
+    for group in groups:
+        splits = [index[i]['split'] for i in group]
+        if len(set(splits)) < 2:
+            continue
+        target = max(SPLITS, key=lambda s: (splits.count(s), -SPLITS.index(s)))
+
+        for i in group:
+            entry = index[i]
+            if entry['split'] == target:
+                continue
+            src = entry['path']
+            dst = src.parents[2] / target / entry['clase'] / src.name
+            if apply:
+                dst.parent.mkdir(parents=True, exist_ok=True)
+                if dst.exists():
+                    src.unlink()
+                else:
+                    os.replace(src, dst)
+            moved += 1
+
+    action = "Movidas" if apply else "Se moverían"
+    print(f"📦 {action} {moved} imágenes para que cada grupo quede en un solo split")
+    return moved
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    apply = '--apply' in sys.argv
+
+    if not args:
+        print("Uso:")
+        print("  python dedupe_dataset.py report [dataset]          - Mostrar duplicados")
+        print("  python dedupe_dataset.py drop [dataset] [--apply]  - Eliminar copias exactas")
+        print("  python dedupe_dataset.py unify [dataset] [--apply] - Un split por grupo")
+        print("  python dedupe_dataset.py reuse [dataset] [umbral]  - Umbral de reutilización seguro")
+    else:
+        command = args[0]
+        root = args[1] if len(args) > 1 else 'dataset'
+
+        if command in ("report", "drop", "unify"):
+            index = build_hash_index(root)
+
+            if command == "drop":
+                drop_exact_copies(index, apply)
+                if apply:
+                    index = build_hash_index(root)
+
+            groups = group_near_duplicates(index)
+
+            if command == "unify":
+                unify_splits(index, groups, apply)
+                if apply:
+                    index = build_hash_index(root)
+                    groups = group_near_duplicates(index)
+
+            report(index, groups)
+        elif command == "reuse":
+            threshold = int(args[2]) if len(args) > 2 else REUSE_CHECK_THRESHOLD
+            reuse_report(build_hash_index(root), threshold)
+        else:
+            print("❌ Comando no reconocido")
@@ -0,0 +1,141 @@
+# distributed.py - Entrenamiento data-parallel con MultiWorkerMirroredStrategy
+"""
+Utilidades para repartir el entrenamiento entre varios procesos (en una
+misma máquina o en varios hosts) con tf.distribute.MultiWorkerMirroredStrategy.
+
+Cada proceso lee su configuración de la variable TF_CONFIG, que prepara
+launch_distributed.py. Sin TF_CONFIG todo se comporta como un único proceso.
+
+Reparto:
+    - Cada worker genera solo sus lotes (BalancedImageSampler con shard_index/num_shards)
+    - Lote global = lote por worker x número de workers
+    - Learning rate escalado linealmente con el número de workers
+    - Solo el worker jefe (índice 0) escribe modelos, logs y gráficas
+"""
+
+import os
+import json
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
+
+import numpy as np
+import tensorflow as tf
+
+def cluster_info() -> Tuple[int, int]:
+    """(índice de este worker, número de workers) según TF_CONFIG."""
+    config = json.loads(os.environ.get('TF_CONFIG', '{}'))
+    workers = config.get('cluster', {}).get('worker', [])
+    if len(workers) <= 1:
+        return 0, 1
+    return int(config['task']['index']), len(workers)
+
+def is_chief() -> bool:
+    return cluster_info()[0] == 0
+
+def get_strategy():
+    """
+    MultiWorkerMirroredStrategy si TF_CONFIG describe más de un worker;
+    si no, la estrategia por defecto (un solo proceso).
+
+    Debe llamarse al inicio del programa, antes de crear modelos o tensores.
+    """
+    index, num_workers = cluster_info()
+    if num_workers == 1:
+        return tf.distribute.get_strategy()
+
+    strategy = tf.distribute.MultiWorkerMirroredStrategy(
+        communication_options=tf.distribute.experimental.CommunicationOptions(
+            implementation=tf.distribute.experimental.CommunicationImplementation.RING
+        )
+    )
+    print(f"🌐 Worker {index + 1}/{num_workers} "
+          f"({'jefe' if index == 0 else 'secundario'}) listo")
+    return strategy
+
+def scale_learning_rate(learning_rate: float, num_workers: int) -> float:
+    """Escalado lineal: el lote global crece con el número de workers."""
+    return learning_rate * num_workers
+
+def worker_path(path: str) -> str:
+    """
+    Ruta de escritura para este worker. El jefe escribe en `path`; el resto,
+    en un directorio temporal (todos deben guardar para no bloquear las
+    operaciones colectivas, pero solo la copia del jefe se conserva).
+    """
+    index, num_workers = cluster_info()
+    if num_workers == 1 or index == 0:
+        return path
+    return os.path.join(tempfile.gettempdir(), f'worker_{index}', path.lstrip(os.sep))
+
+def _mean_across_workers(strategy, value: float) -> float:
+    """Promedio de `value` entre todas las réplicas (operación colectiva: la llaman todos los workers)."""
+    per_replica = strategy.run(lambda: tf.constant(value, dtype=tf.float64))
+    return float(strategy.reduce(tf.distribute.ReduceOp.MEAN, per_replica, axis=None))
+
+def check_resume_agreement(strategy, resume_state) -> None:
+    """
+    Con varios workers, verifica que todos reanudan desde la misma época.
+
+    Cada worker lee el checkpoint de su propio disco y solo el jefe escribe
+    los reales: sin almacenamiento compartido los demás no encuentran nada
+    y empezarían en la época 0 mientras el jefe sigue en la N, con pasos
+    distintos por worker y las operaciones colectivas bloqueadas. Todos
+    los workers deben llamarla en el mismo punto; si no coinciden, todos
+    fallan con el mismo error.
+    """
+    _, num_workers = cluster_info()
+    if num_workers == 1:
+        return
+    epoch = float(resume_state['epoch']) if resume_state else -1.0
+    mean = _mean_across_workers(strategy, epoch)
+    variance = _mean_across_workers(strategy, epoch ** 2) - mean ** 2
+    if variance > 1e-6:
+        raise RuntimeError(
+            "Los workers no encuentran el mismo checkpoint para --resume. Con varios hosts, "
+            "el directorio de checkpoints debe estar en almacenamiento compartido "
+            "(todos leen el del jefe)."
+        )
+
+def sampler_dataset(sampler) -> tf.data.Dataset:
+    """
+    Envuelve un BalancedImageSampler en un tf.data.Dataset para la
+    estrategia distribuida.
+
+    El auto-sharding de tf.data se desactiva porque el sampler ya genera
+    solo los lotes de este worker; los lotes se cargan en un pool de hilos
+    de tamaño `sampler.workers`.
+    """
+    workers = getattr(sampler, 'workers', 1) or 1
+    steps = len(sampler)
+
+    def generator():
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque(executor.submit(sampler.__getitem__, i)
+                            for i in range(min(2 * workers, steps)))
+            next_index = len(pending)
+            while pending:
+                x, y = pending.popleft().result()
+                if next_index < steps:
+                    pending.append(executor.submit(sampler.__getitem__, next_index))
+                    next_index += 1
+                yield x, np.asarray(y, dtype=np.float32)
+        sampler.on_epoch_end()
+
+    label_shape = (None,) if sampler.class_mode == 'binary' else (None, sampler.num_classes)
+    dataset = tf.data.Dataset.from_generator(
+        generator,
+        output_signature=(
+            tf.TensorSpec((None, *sampler.img_size, 3), tf.float32),
+            tf.TensorSpec(label_shape, tf.float32)
+        )
+    ).apply(tf.data.experimental.assert_cardinality(steps)).prefetch(tf.data.AUTOTUNE)
+
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+    return dataset.with_options(options)
+
+def training_input(sampler, num_workers: int):
+    """Entrada para model.fit: el propio sampler o un dataset si hay varios workers."""
+    return sampler if num_workers == 1 else sampler_dataset(sampler)
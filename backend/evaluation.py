@@ -0,0 +1,174 @@
+# evaluation.py - Motor de evaluación por lotes
+"""
+Evalúa un modelo sobre una lista de imágenes en una sola pasada: decodifica
+en paralelo con tf.data, predice en lotes grandes y calcula todas las
+métricas (pérdida, accuracy, precision/recall/F1, AUC, matriz de confusión
+y reporte de clasificación) a partir de las probabilidades obtenidas.
+
+Lo usan ModelAnalyzer y los scripts de entrenamiento en lugar de combinar
+model.evaluate() con un segundo model.predict() sobre el mismo conjunto.
+"""
+
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import tensorflow as tf
+from sklearn.metrics import (
+    accuracy_score, classification_report, confusion_matrix,
+    precision_recall_fscore_support, roc_auc_score
+)
+
+EVAL_BATCH_SIZE = 64
+PARITY_IMAGES = 4         # Imágenes de test para comprobar el preprocesamiento incluido
+PARITY_TOLERANCE = 1e-3
+
+def model_input_size(model):
+    """
+    Tamaño (alto, ancho) con el que se entrenó el modelo. En modelos con
+    entrada uint8 de tamaño libre se toma de su capa Resizing.
+    """
+    size = tuple(model.input_shape[1:3])
+    if None in size:
+        resizing = next(l for l in model.layers if isinstance(l, tf.keras.layers.Resizing))
+        size = (resizing.height, resizing.width)
+    return size
+
+def make_image_dataset(filepaths: Sequence[str], img_size, batch_size: int = EVAL_BATCH_SIZE,
+                       rescale: float = 1./255, uint8: bool = False) -> tf.data.Dataset:
+    """
+    Dataset de tf.data que decodifica y redimensiona las imágenes en paralelo.
+    Con uint8=True entrega los píxeles sin convertir (modelos con el
+    preprocesamiento incluido).
+    """
+    def load(path):
+        image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+        image = tf.image.resize(image, img_size, method='nearest')
+        if uint8:
+            return tf.cast(image, tf.uint8)
+        return tf.cast(image, tf.float32) * rescale
+
+    return (
+        tf.data.Dataset.from_tensor_slices(list(filepaths))
+        .map(load, num_parallel_calls=tf.data.AUTOTUNE)
+        .batch(batch_size)
+        .prefetch(tf.data.AUTOTUNE)
+    )
+
+def predict_files(model, filepaths: Sequence[str], batch_size: int = EVAL_BATCH_SIZE,
+                  verbose: int = 0) -> np.ndarray:
+    """Probabilidades (N, clases) del modelo para cada archivo, en orden."""
+    if len(filepaths) == 0:
+        return np.zeros((0, model.output_shape[-1]), dtype=np.float32)
+    uint8 = tf.keras.backend.standardize_dtype(model.inputs[0].dtype) == 'uint8'
+    dataset = make_image_dataset(filepaths, model_input_size(model), batch_size, uint8=uint8)
+    probs = model.predict(dataset, verbose=verbose)
+    return np.asarray(probs, dtype=np.float32).reshape(len(filepaths), -1)
+
+def preprocessing_parity(model, filepaths: Sequence[str]) -> float:
+    """
+    Diferencia máxima de probabilidades entre el modelo con el
+    preprocesamiento incluido (imagen uint8 a resolución original) y su
+    modelo interno con las mismas imágenes cargadas como en entrenamiento.
+    Debe ser ~0; si no, el modelo servido ve otros píxeles que al entrenar.
+    """
+    from PIL import Image
+    from balanced_sampler import load_image_array
+    from model_config import accepts_uint8, strip_preprocessing
+
+    if not accepts_uint8(model):
+        return 0.0
+    inner = strip_preprocessing(model)
+    img_size = model_input_size(model)
+    diff = 0.0
+    for path in filepaths:
+        with Image.open(path) as image:
+            full = np.asarray(image.convert('RGB'))[None]
+        served = np.asarray(model.predict_on_batch(full))
+        trained = np.asarray(inner.predict_on_batch(load_image_array(path, img_size)[None] / np.float32(255)))
+        diff = max(diff, float(np.max(np.abs(served - trained))))
+    return diff
+
+def compute_metrics(y_true: Sequence[int], probs: np.ndarray, class_names: List[str],
+                    y_pred: Optional[Sequence[int]] = None) -> Dict:
+    """
+    Calcula las métricas a partir de las probabilidades.
+
+    Con una sola salida (sigmoide) la probabilidad corresponde a la clase de
+    índice 1. En multiclase, precision/recall/F1 son promedios macro.
+    `y_pred` permite pasar la clase ya decidida (p.ej. con el umbral de un
+    bundle); sin él se corta en 0.5 o se toma la más probable.
+    """
+    y_true = np.asarray(y_true, dtype=np.int64)
+    probs = np.asarray(probs, dtype=np.float64)
+    if y_pred is not None:
+        y_pred = np.asarray(y_pred, dtype=np.int64)
+    eps = 1e-7
+
+    if probs.shape[1] == 1:
+        p = np.clip(probs[:, 0], eps, 1 - eps)
+        if y_pred is None:
+            y_pred = (p > 0.5).astype(np.int64)
+        loss = -np.mean(y_true * np.log(p) + (1 - y_true) * np.log(1 - p))
+        precision, recall, f1, _ = precision_recall_fscore_support(
+            y_true, y_pred, average='binary', zero_division=0
+        )
+        auc_scores = p
+    else:
+        p = np.clip(probs, eps, 1.0)
+        if y_pred is None:
+            y_pred = np.argmax(probs, axis=1)
+        loss = -np.mean(np.log(p[np.arange(len(y_true)), y_true]))
+        precision, recall, f1, _ = precision_recall_fscore_support(
+            y_true, y_pred, average='macro', zero_division=0
+        )
+        auc_scores = probs / probs.sum(axis=1, keepdims=True)
+
+    try:
+        auc = roc_auc_score(y_true, auc_scores, multi_class='ovr') if probs.shape[1] > 1 \
+            else roc_auc_score(y_true, auc_scores)
+    except ValueError:
+        auc = float('nan')  # Falta alguna clase en y_true
+
+    labels = list(range(len(class_names)))
+    return {
+        'loss': float(loss),
+        'accuracy': float(accuracy_score(y_true, y_pred)),
+        'precision': float(precision),
+        'recall': float(recall),
+        'f1_score': float(f1),
+        'auc': float(auc),
+        'confusion_matrix': confusion_matrix(y_true, y_pred, labels=labels),
+        'classification_report': classification_report(
+            y_true, y_pred, labels=labels, target_names=class_names, digits=4, zero_division=0
+        ),
+        'y_true': y_true,
+        'y_pred': y_pred,
+        'probabilities': probs
+    }
+
+def evaluate_files(model, filepaths: Sequence[str], labels: Sequence[int], class_names: List[str],
+                   batch_size: int = EVAL_BATCH_SIZE, verbose: int = 1) -> Dict:
+    """Predice todas las imágenes en una pasada y calcula las métricas."""
+    probs = predict_files(model, filepaths, batch_size, verbose)
+    return compute_metrics(labels, probs, class_names)
+
+def evaluate_generator(model, generator, batch_size: int = EVAL_BATCH_SIZE, verbose: int = 1) -> Dict:
+    """
+    Evalúa usando la lista de archivos de un generador tipo flow_from_directory
+    (o BalancedImageSampler), sin recorrer sus lotes ni su augmentation.
+    """
+    class_names = sorted(generator.class_indices, key=generator.class_indices.get)
+    return evaluate_files(model, generator.filepaths, generator.classes, class_names,
+                          batch_size, verbose)
+
+def print_evaluation(results: Dict, title: str = "📈 Resultados en conjunto de prueba:"):
+    """Imprime las métricas escalares, la matriz de confusión y el reporte."""
+    print(f"\n{title}")
+    for metric in ['loss', 'accuracy', 'precision', 'recall', 'f1_score', 'auc']:
+        print(f"   {metric.capitalize()}: {results[metric]:.4f}")
+
+    print(f"\n📊 Matriz de Confusión:")
+    print(results['confusion_matrix'])
+
+    print("\n📈 Reporte de Clasificación:")
+    print(results['classification_report'])
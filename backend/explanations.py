@@ -0,0 +1,251 @@
+# explanations.py - Mapas de calor Grad-CAM bajo demanda
+"""
+Explicaciones de detecciones ya hechas, calculadas fuera de /api/detectar.
+
+El servidor guarda los bytes de las últimas imágenes analizadas por id de
+detección (LRU acotado). Al pedir la explicación de un id se encola un
+trabajo; un hilo de fondo junta los trabajos pendientes en un solo lote,
+calcula Grad-CAM sobre la última capa convolucional de MobileNetV2
+(`out_relu`) y escribe la superposición en explanations/<id>.png.
+
+La ruta de detección no cambia: solo anota un id y recuerda la imagen.
+Cuando una imagen sale del LRU se borra también su PNG, así que el disco
+usado queda acotado igual que la memoria.
+"""
+
+import io
+import os
+import re
+import queue
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+import cv2
+from PIL import Image
+
+EXPLANATIONS_DIR = 'explanations'
+CONV_LAYER = 'out_relu'     # Última activación convolucional de MobileNetV2
+MAX_STORED_IMAGES = 256     # Imágenes recientes disponibles para explicar
+EXPLAIN_BATCH_SIZE = 8
+OVERLAY_MAX_SIDE = 640      # Lado mayor de la imagen superpuesta
+HEATMAP_ALPHA = 0.4
+
+_ID_PATTERN = re.compile(r'[0-9a-f]{32}')  # uuid4().hex
+_splits = {}  # id(modelo interno) -> función de _find_conv_split
+
+def valid_id(detection_id: str) -> bool:
+    """Los ids se usan como nombre de archivo: solo se aceptan los generados por el servidor."""
+    return bool(_ID_PATTERN.fullmatch(detection_id))
+
+def _find_conv_split(model):
+    """
+    Localiza la salida convolucional dentro del modelo interno (entrada
+    float). Retorna una función x -> (mapa_convolucional, predicciones).
+    """
+    from tensorflow import keras
+
+    names = [layer.name for layer in model.layers]
+    if CONV_LAYER in names:
+        # Backbone aplanado en el grafo funcional (train_model.py)
+        split = keras.Model(model.inputs, [model.get_layer(CONV_LAYER).output, model.output])
+        return lambda x: split(x, training=False)
+
+    # Backbone anidado en un Sequential (binary_train_optimized.py, simple_train.py)
+    for i, layer in enumerate(model.layers):
+        if isinstance(layer, keras.Model) and CONV_LAYER in [l.name for l in layer.layers]:
+            head = model.layers[i + 1:]
+            def run(x, backbone=layer, head=head):
+                conv = backbone(x, training=False)
+                y = conv
+                for h in head:
+                    y = h(y, training=False)
+                return conv, y
+            return run
+    raise ValueError(f"El modelo no tiene la capa {CONV_LAYER}")
+
+def grad_cam(model, batch: np.ndarray, class_indices: Optional[List[Optional[int]]] = None):
+    """
+    Grad-CAM de un lote uint8 al tamaño de entrada.
+
+    Args:
+        model: Modelo servido (con o sin preprocesamiento incluido)
+        batch: uint8 (n, alto, ancho, 3)
+        class_indices: Clase a explicar por imagen (None = la predicha)
+
+    Returns:
+        (mapas en [0, 1] de forma (n, h, w), probabilidades por clase, clases explicadas)
+    """
+    import tensorflow as tf
+    from model_config import strip_preprocessing
+
+    inner = strip_preprocessing(model)
+    run = _splits.get(id(inner))
+    if run is None:
+        run = _splits[id(inner)] = _find_conv_split(inner)
+    x = tf.convert_to_tensor(batch, dtype=tf.float32) / 255.0
+
+    with tf.GradientTape() as tape:
+        conv, preds = run(x)
+        if preds.shape[-1] == 1:
+            # Sigmoide P(clase 1): la clase 0 se explica con 1 - p
+            probs = tf.concat([1 - preds, preds], axis=-1)
+        else:
+            probs = preds
+        chosen = [
+            int(c) if c is not None else int(i)
+            for c, i in zip(class_indices or [None] * len(batch), tf.argmax(probs, axis=-1).numpy())
+        ]
+        scores = tf.gather(probs, chosen, axis=1, batch_dims=1)
+        # Las imágenes del lote son independientes: el gradiente de la suma es el de cada una
+        total = tf.reduce_sum(scores)
+
+    grads = tape.gradient(total, conv)
+    weights = tf.reduce_mean(grads, axis=(1, 2), keepdims=True)
+    cams = tf.nn.relu(tf.reduce_sum(weights * conv, axis=-1)).numpy()
+    cams /= np.maximum(cams.max(axis=(1, 2), keepdims=True), 1e-8)
+    return cams, probs.numpy(), chosen
+
+def overlay_png(image_bytes: bytes, cam: np.ndarray) -> bytes:
+    """Superpone el mapa de calor sobre la imagen original (reducida) y la codifica en PNG."""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image = image.convert('RGB')
+        image.thumbnail((OVERLAY_MAX_SIDE, OVERLAY_MAX_SIDE))
+        rgb = np.asarray(image)
+    h, w = rgb.shape[:2]
+    heat = cv2.resize((cam * 255).astype(np.uint8), (w, h), interpolation=cv2.INTER_LINEAR)
+    heat = cv2.applyColorMap(heat, cv2.COLORMAP_JET)
+    blended = cv2.addWeighted(cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR), 1 - HEATMAP_ALPHA, heat, HEATMAP_ALPHA, 0)
+    ok, png = cv2.imencode('.png', blended)
+    if not ok:
+        raise ValueError("No se pudo codificar el PNG")
+    return png.tobytes()
+
+class ExplanationService:
+    """
+    Cola de explicaciones con un hilo de fondo que procesa por lotes.
+
+    Estados por id: 'pendiente', 'lista' (PNG en disco) o 'error'.
+    """
+
+    def __init__(self, detector, output_dir: str = EXPLANATIONS_DIR,
+                 max_images: int = MAX_STORED_IMAGES, batch_size: int = EXPLAIN_BATCH_SIZE):
+        self.detector = detector
+        self.output_dir = output_dir
+        self.max_images = max_images
+        self.batch_size = batch_size
+        self._images = OrderedDict()   # id -> bytes de la imagen (LRU)
+        self._status: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        os.makedirs(output_dir, exist_ok=True)
+
+    def remember(self, detection_id: str, image_bytes: bytes):
+        """Conserva la imagen de una detección para poder explicarla después."""
+        with self._lock:
+            self._images[detection_id] = image_bytes
+            self._images.move_to_end(detection_id)
+            while len(self._images) > self.max_images:
+                old_id, _ = self._images.popitem(last=False)
+                if self._status.pop(old_id, {}).get('estado') != 'pendiente' and \
+                        os.path.exists(self.path(old_id)):
+                    os.remove(self.path(old_id))
+
+    def path(self, detection_id: str) -> str:
+        return os.path.join(self.output_dir, f"{detection_id}.png")
+
+    def status(self, detection_id: str) -> Optional[Dict]:
+        """Estado de la explicación; None si nunca se pidió ni existe."""
+        with self._lock:
+            status = self._status.get(detection_id)
+        if status is None and os.path.exists(self.path(detection_id)):
+            status = {'estado': 'lista'}
+        return status
+
+    def request(self, detection_id: str, clase: Optional[str] = None) -> Optional[Dict]:
+        """
+        Encola la explicación de una detección. Retorna su estado, o None si
+        la imagen ya no está disponible.
+        """
+        current = self.status(detection_id)
+        if current is not None and current['estado'] in ('pendiente', 'lista') and clase is None:
+            return current
+        with self._lock:
+            if detection_id not in self._images:
+                return None
+            status = self._status[detection_id] = {'estado': 'pendiente'}
+        self._ensure_worker()
+        self._queue.put((detection_id, clase))
+        return status
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='grad-cam', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            jobs = [self._queue.get()]
+            # Junta lo que haya pendiente hasta completar un lote
+            while len(jobs) < self.batch_size:
+                try:
+                    jobs.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._process(jobs)
+            except Exception as e:
+                # El hilo sigue vivo: los trabajos del lote no quedan pendientes para siempre
+                for detection_id, _ in jobs:
+                    self._set(detection_id, {'estado': 'error', 'detalle': str(e)})
+
+    def _process(self, jobs):
+        detector = self.detector
+        # Decodificar; una imagen ilegible marca solo su trabajo como error
+        decoded = []
+        for detection_id, clase in jobs:
+            with self._lock:
+                image_bytes = self._images.get(detection_id)
+            if image_bytes is None:
+                self._set(detection_id, {'estado': 'error', 'detalle': 'Imagen no disponible'})
+                continue
+            try:
+                with Image.open(io.BytesIO(image_bytes)) as image:
+                    pixels = np.asarray(image.convert('RGB').resize(detector.img_size[::-1], Image.NEAREST))
+            except Exception as e:
+                self._set(detection_id, {'estado': 'error', 'detalle': f"Imagen ilegible: {e}"})
+                continue
+            class_index = detector.classes.index(clase) if clase in detector.classes else None
+            decoded.append((detection_id, image_bytes, pixels, class_index))
+        if not decoded:
+            return
+
+        batch = np.stack([pixels for _, _, pixels, _ in decoded])
+        try:
+            cams, probs, chosen = grad_cam(detector.model, batch, [c for _, _, _, c in decoded])
+        except Exception as e:
+            for detection_id, _, _, _ in decoded:
+                self._set(detection_id, {'estado': 'error', 'detalle': str(e)})
+            return
+
+        for i, (detection_id, image_bytes, _, _) in enumerate(decoded):
+            try:
+                png = overlay_png(image_bytes, cams[i])
+                tmp_path = self.path(detection_id) + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(png)
+                os.replace(tmp_path, self.path(detection_id))
+                self._set(detection_id, {
+                    'estado': 'lista',
+                    'clase_explicada': detector.classes[chosen[i]],
+                    'probabilidad': float(probs[i][chosen[i]])
+                })
+            except Exception as e:
+                self._set(detection_id, {'estado': 'error', 'detalle': str(e)})
+
+    def _set(self, detection_id: str, status: Dict):
+        with self._lock:
+            self._status[detection_id] = status
@@ -0,0 +1,234 @@
+# frontier.py - Frontera precisión / latencia por resolución y ancho del backbone
+"""
+Entrena el modelo con varias combinaciones de resolución de entrada y alpha
+de MobileNetV2, mide métricas en test y latencia en CPU, y grafica precisión
+frente a latencia para elegir el modelo más barato que cumpla el objetivo
+de recall de plaga.
+
+Cada combinación se entrena en un proceso aparte (IMG_SIZE y MOBILENET_ALPHA
+por variable de entorno, ver model_config.py); la latencia se mide al final
+en secuencia para que las mediciones no compitan por la CPU.
+
+Uso:
+    python frontier.py                                     # 96/128/160/224 px x alpha 0.35-1.0
+    python frontier.py --sizes 128 160 --alphas 0.5 1.0 --epochs 5
+    python frontier.py --recall-target 0.95 --kind multiclass
+
+Para usar la combinación elegida: crear backend/model_arch.json (no viene en
+el repositorio; otra ruta con MODEL_ARCH) con {"img_size": [160, 160],
+"alpha": 0.5} y reentrenar. El entrenamiento la registra en
+models/model_config.json, que es lo que lee el servidor.
+"""
+
+import os
+import sys
+import json
+import argparse
+import itertools
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+
+FRONTIER_DIR = 'logs/frontier'
+SIZES = [96, 128, 160, 224]
+ALPHAS = [0.35, 0.5, 0.75, 1.0]
+
+def pest_recall(y_true, y_pred, class_names: List[str]) -> float:
+    """Fracción de imágenes con plaga (cualquier nivel) que el modelo marca con plaga."""
+    pest = [i for i, name in enumerate(class_names) if name != 'sin_plaga']
+    y_true, y_pred = np.asarray(y_true), np.asarray(y_pred)
+    mask = np.isin(y_true, pest)
+    return float(np.isin(y_pred[mask], pest).mean()) if mask.any() else float('nan')
+
+def _train_point(spec: Dict) -> Dict:
+    """Entrena y evalúa una combinación (proceso hijo con IMG_SIZE/MOBILENET_ALPHA fijados)."""
+    from training_profile import apply_training_profile
+    profile = apply_training_profile(verbose=False)
+
+    from tensorflow import keras
+    from balanced_sampler import BalancedImageSampler, BINARY_CLASS_MAP
+    from evaluation import evaluate_generator
+    from model_config import IMG_SIZE
+
+    binary = spec['kind'] == 'binary'
+    if binary:
+        from binary_train_optimized import BATCH_SIZE, DATA_DIR, create_binary_model
+        model = create_binary_model(profile)
+    else:
+        from train_model import BATCH_SIZE, DATA_DIR, WhiteflyModelTrainer
+        model = WhiteflyModelTrainer(profile).build_model()
+
+    common = dict(
+        class_map=BINARY_CLASS_MAP if binary else None,
+        img_size=IMG_SIZE,
+        batch_size=BATCH_SIZE,
+        class_mode='binary' if binary else 'categorical',
+        workers=spec['loader_workers']
+    )
+    train_gen = BalancedImageSampler(
+        DATA_DIR, 'train',
+        image_data_generator=keras.preprocessing.image.ImageDataGenerator(
+            rescale=1./255, rotation_range=30, width_shift_range=0.2, height_shift_range=0.2,
+            horizontal_flip=True, zoom_range=0.2, brightness_range=[0.8, 1.2], fill_mode='nearest'
+        ),
+        **common
+    )
+    val_gen = BalancedImageSampler(DATA_DIR, 'val', balanced=False, shuffle=False, **common)
+    test_gen = BalancedImageSampler(DATA_DIR, 'test', balanced=False, shuffle=False, **common)
+
+    model.fit(
+        train_gen, epochs=spec['epochs'], validation_data=val_gen,
+        callbacks=[keras.callbacks.EarlyStopping(monitor='val_loss', patience=3,
+                                                 restore_best_weights=True)],
+        verbose=0
+    )
+
+    results = evaluate_generator(model, test_gen, verbose=0)
+    class_names = sorted(test_gen.class_indices, key=test_gen.class_indices.get)
+    os.makedirs(os.path.dirname(spec['model_path']), exist_ok=True)
+    model.save(spec['model_path'])
+
+    return {
+        'accuracy': results['accuracy'],
+        'f1_score': results['f1_score'],
+        'auc': results['auc'],
+        'pest_recall': pest_recall(results['y_true'], results['y_pred'], class_names)
+    }
+
+def train_points(kind: str, sizes: List[int], alphas: List[float], epochs: int,
+                 parallel: int) -> List[Dict]:
+    """Entrena cada combinación en su propio proceso."""
+    cores = os.cpu_count() or 1
+    threads = max(1, cores // parallel)
+    points = [
+        {'img_size': size, 'alpha': alpha,
+         'model_path': os.path.join(FRONTIER_DIR, kind, f'{size}px_a{alpha}', 'model.keras')}
+        for size, alpha in itertools.product(sizes, alphas)
+    ]
+
+    def run(point):
+        spec = {'kind': kind, 'epochs': epochs, 'model_path': point['model_path'],
+                'loader_workers': max(1, min(4, threads))}
+        env = dict(os.environ, IMG_SIZE=str(point['img_size']), MOBILENET_ALPHA=str(point['alpha']),
+                   INTRA_OP_THREADS=str(threads), INTER_OP_THREADS='1')
+        os.makedirs(os.path.dirname(point['model_path']), exist_ok=True)
+        with open(os.path.join(os.path.dirname(point['model_path']), 'train.log'), 'w') as log:
+            proc = subprocess.run([sys.executable, __file__, '_train', json.dumps(spec)],
+                                  stdout=subprocess.PIPE, stderr=log, text=True, env=env)
+        try:
+            metrics = json.loads(proc.stdout.strip().splitlines()[-1])
+        except (IndexError, json.JSONDecodeError):
+            print(f"   ❌ {point['img_size']}px α{point['alpha']}: falló (ver train.log)")
+            return None
+        print(f"   ✅ {point['img_size']}px α{point['alpha']}: accuracy {metrics['accuracy']:.4f}, "
+              f"recall plaga {metrics['pest_recall']:.4f}")
+        return {**point, **metrics}
+
+    print(f"🏋️  Entrenando {len(points)} combinaciones ({parallel} en paralelo, {threads} hilos c/u)")
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        return [p for p in executor.map(run, points) if p is not None]
+
+def measure_points(points: List[Dict], sample_path: str):
+    """Latencia en CPU de cada modelo, uno tras otro, con los hilos por defecto."""
+    from compare_models import load_candidates, measure_latency
+
+    for point in points:
+        candidate = load_candidates([point['model_path']])[0]
+        measure_latency([candidate], sample_path)
+        point.update(
+            latency_mean_ms=candidate['latency_mean_ms'],
+            latency_p95_ms=candidate['latency_p95_ms'],
+            file_mb=candidate['file_mb']
+        )
+        del candidate
+
+def pareto_front(points: List[Dict]) -> List[Dict]:
+    """Puntos que ningún otro supera a la vez en latencia y accuracy."""
+    front, best = [], -1.0
+    for point in sorted(points, key=lambda p: p['latency_mean_ms']):
+        if point['accuracy'] > best:
+            front.append(point)
+            best = point['accuracy']
+    return front
+
+def plot_frontier(points: List[Dict], recall_target: float, path: str):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(10, 7))
+    for point in points:
+        ok = point['pest_recall'] >= recall_target
+        ax.scatter(point['latency_mean_ms'], point['accuracy'], s=20 + point['file_mb'] * 4,
+                   c='tab:green' if ok else 'tab:gray', alpha=0.8)
+        ax.annotate(f"{point['img_size']}px α{point['alpha']}",
+                    (point['latency_mean_ms'], point['accuracy']),
+                    textcoords='offset points', xytext=(5, 5), fontsize=8)
+
+    front = pareto_front(points)
+    ax.plot([p['latency_mean_ms'] for p in front], [p['accuracy'] for p in front],
+            'b--', alpha=0.5, label='Frontera de Pareto')
+    ax.scatter([], [], c='tab:green', label=f'Recall de plaga ≥ {recall_target:.0%}')
+    ax.scatter([], [], c='tab:gray', label='Bajo el objetivo de recall')
+
+    ax.set_xlabel('Latencia por imagen en CPU (ms)')
+    ax.set_ylabel('Accuracy en test')
+    ax.set_title('Precisión vs. latencia (tamaño del punto = MB del modelo)')
+    ax.grid(True, alpha=0.3)
+    ax.legend()
+    fig.tight_layout()
+    fig.savefig(path, dpi=150)
+    plt.close(fig)
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == '_train':
+        print(json.dumps(_train_point(json.loads(sys.argv[2]))))
+        return
+
+    parser = argparse.ArgumentParser(description="Frontera precisión/latencia por resolución y alpha")
+    parser.add_argument('--kind', choices=['binary', 'multiclass'], default='binary')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--alphas', type=float, nargs='+', default=ALPHAS)
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--parallel', type=int, default=1, help="Combinaciones entrenadas a la vez")
+    parser.add_argument('--recall-target', type=float, default=0.9,
+                        help="Recall mínimo de imágenes con plaga")
+    parser.add_argument('--test-dir', default='dataset/test')
+    args = parser.parse_args()
+
+    points = train_points(args.kind, args.sizes, args.alphas, args.epochs, args.parallel)
+    if not points:
+        print("❌ Ninguna combinación terminó correctamente")
+        return
+
+    from dataset_index import CLASSES, list_images
+    sample = next(str(p) for c in CLASSES for p in list_images(os.path.join(args.test_dir, c)))
+    print("\n⏱️  Midiendo latencia en CPU...")
+    measure_points(points, sample)
+
+    print(f"\n{'Entrada':>8} {'Alpha':>6} {'Acc':>7} {'Recall':>7} {'AUC':>7} {'ms':>7} {'p95':>7} {'MB':>6}")
+    for p in sorted(points, key=lambda p: p['latency_mean_ms']):
+        print(f"{p['img_size']:>6}px {p['alpha']:>6} {p['accuracy']:7.4f} {p['pest_recall']:7.4f} "
+              f"{p['auc']:7.4f} {p['latency_mean_ms']:7.1f} {p['latency_p95_ms']:7.1f} {p['file_mb']:6.1f}")
+
+    eligible = [p for p in points if p['pest_recall'] >= args.recall_target]
+    if eligible:
+        best = min(eligible, key=lambda p: p['latency_mean_ms'])
+        print(f"\n🏆 Más barato con recall de plaga ≥ {args.recall_target:.0%}: "
+              f"{best['img_size']}px, alpha {best['alpha']} "
+              f"({best['latency_mean_ms']:.1f} ms, accuracy {best['accuracy']:.4f})")
+        print(f'   Crear model_arch.json y reentrenar: {{"img_size": [{best["img_size"]}, {best["img_size"]}], '
+              f'"alpha": {best["alpha"]}}}')
+    else:
+        print(f"\n⚠️  Ninguna combinación alcanza recall de plaga ≥ {args.recall_target:.0%}")
+
+    out_dir = os.path.join(FRONTIER_DIR, args.kind)
+    with open(os.path.join(out_dir, 'frontier.json'), 'w') as f:
+        json.dump(points, f, indent=4)
+    plot_frontier(points, args.recall_target, os.path.join(out_dir, 'frontier.png'))
+    print(f"\n💾 {out_dir}/frontier.json y {out_dir}/frontier.png")
+
+if __name__ == "__main__":
+    main()
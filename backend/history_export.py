@@ -0,0 +1,204 @@
+# history_export.py - Exportación columnar del historial de detecciones
+"""
+El servidor agrega cada detección como una línea JSON a
+history/detecciones.jsonl. Este módulo la recorre en streaming y la
+escribe como Apache Arrow IPC (stream) o Parquet, en lotes de
+`batch_size` filas (un row group por lote en Parquet), de modo que la
+memoria no depende del tamaño del historial.
+
+Las probabilidades por clase y las métricas de `analisis_visual` quedan
+como columnas tipadas, listas para pandas o DuckDB:
+
+    import pyarrow.parquet as pq;  pq.read_table('historial.parquet').to_pandas()
+    duckdb.sql("SELECT clase, avg(confianza) FROM 'historial.parquet' GROUP BY clase")
+
+Requiere pyarrow (opcional: pip install pyarrow).
+
+Uso:
+    python history_export.py historial.parquet
+    python history_export.py historial.arrow --desde 2024-01-01 --hasta 2024-02-01
+"""
+
+import os
+import io
+import json
+import argparse
+import threading
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+HISTORY_PATH = 'history/detecciones.jsonl'
+EXPORT_BATCH_SIZE = 50_000
+FORMATS = {'arrow': 'application/vnd.apache.arrow.stream', 'parquet': 'application/vnd.apache.parquet'}
+
+# Claves de 'distribuciones' (columnas prob_<clase>) y de 'analisis_visual' con su tipo
+PROBABILITY_COLUMNS = ['sin_plaga', 'leve', 'severa', 'con_plaga']
+VISUAL_COLUMNS = [
+    ('contornos_detectados', 'int32'),
+    ('area_promedio', 'float32'),
+    ('desviacion_areas', 'float32'),
+    ('densidad_estimada', 'float32'),
+    ('area_hoja_px', 'int64'),
+    ('fraccion_hoja', 'float32'),
+    ('mascara_hoja', 'bool_')
+]
+
+_append_lock = threading.Lock()
+
+def append_record(record: Dict, path: str = HISTORY_PATH):
+    """Agrega una detección al historial persistente (una línea JSON)."""
+    line = json.dumps(record, ensure_ascii=False) + '\n'
+    with _append_lock:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+def _parse_time(value) -> Optional[datetime]:
+    """Fecha ISO o datetime; las fechas con zona se pasan a hora local (como fecha_analisis)."""
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value
+
+def iter_records(path: str = HISTORY_PATH, desde=None, hasta=None) -> Iterator[Dict]:
+    """Detecciones con fecha_analisis en [desde, hasta), leídas línea a línea."""
+    desde, hasta = _parse_time(desde), _parse_time(hasta)
+    if not os.path.exists(path):
+        return
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            fecha = datetime.fromisoformat(record['fecha_analisis'])
+            if (desde and fecha < desde) or (hasta and fecha >= hasta):
+                continue
+            yield record
+
+def flatten(record: Dict) -> Dict:
+    """Una detección como fila plana con las columnas del esquema."""
+    deteccion = record.get('deteccion', {})
+    distribuciones = deteccion.get('distribuciones', {})
+    visual = deteccion.get('analisis_visual', {})
+    row = {
+        'fecha_analisis': datetime.fromisoformat(record['fecha_analisis']),
+        'id_deteccion': record.get('id_deteccion'),
+        'clase': deteccion.get('clase'),
+        'confianza': deteccion.get('confianza'),
+        'tta_aplicado': deteccion.get('tta_aplicado'),
+        'reutilizado': deteccion.get('reutilizado'),
+        'ubicacion': record.get('ubicacion')
+    }
+    for name in PROBABILITY_COLUMNS:
+        row[f'prob_{name}'] = distribuciones.get(name)
+    for name, _ in VISUAL_COLUMNS:
+        row[name] = visual.get(name)
+    return row
+
+def schema():
+    import pyarrow as pa
+
+    fields = [
+        pa.field('fecha_analisis', pa.timestamp('us')),
+        pa.field('id_deteccion', pa.string()),
+        pa.field('clase', pa.string()),
+        pa.field('confianza', pa.float32()),
+        pa.field('tta_aplicado', pa.bool_()),
+        pa.field('reutilizado', pa.bool_()),
+        pa.field('ubicacion', pa.string())
+    ]
+    fields += [pa.field(f'prob_{name}', pa.float32()) for name in PROBABILITY_COLUMNS]
+    fields += [pa.field(name, getattr(pa, dtype)()) for name, dtype in VISUAL_COLUMNS]
+    return pa.schema(fields)
+
+def record_batches(records: Iterator[Dict], batch_size: int = EXPORT_BATCH_SIZE):
+    """Agrupa las filas en RecordBatch de `batch_size` filas, columna por columna."""
+    import pyarrow as pa
+
+    target = schema()
+    columns: Dict[str, List] = {name: [] for name in target.names}
+    n = 0
+    for record in records:
+        for name, value in flatten(record).items():
+            columns[name].append(value)
+        n += 1
+        if n == batch_size:
+            yield pa.RecordBatch.from_pydict(columns, schema=target)
+            columns = {name: [] for name in target.names}
+            n = 0
+    if n:
+        yield pa.RecordBatch.from_pydict(columns, schema=target)
+
+class _ChunkSink(io.RawIOBase):
+    """Archivo de solo escritura que acumula bytes hasta que se retiran con take()."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def take(self) -> bytes:
+        data, self._chunks = b''.join(self._chunks), []
+        return data
+
+def export_chunks(fmt: str = 'parquet', path: str = HISTORY_PATH, desde=None, hasta=None,
+                  batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """
+    Bytes del archivo exportado, un fragmento por lote: sirve tanto para
+    escribir a disco como para una respuesta HTTP en streaming.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato desconocido: {fmt} (use {', '.join(FORMATS)})")
+
+    sink = _ChunkSink()
+    target = schema()
+    if fmt == 'arrow':
+        writer = pa.ipc.new_stream(sink, target)
+        write = writer.write_batch
+    else:
+        writer = pq.ParquetWriter(sink, target, compression='zstd')
+        write = writer.write_batch  # Un row group por lote
+
+    for batch in record_batches(iter_records(path, desde, hasta), batch_size):
+        write(batch)
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta el historial de detecciones a Arrow o Parquet")
+    parser.add_argument('output', help="Archivo de salida (.parquet o .arrow)")
+    parser.add_argument('--format', choices=sorted(FORMATS), help="Por defecto según la extensión")
+    parser.add_argument('--history', default=HISTORY_PATH)
+    parser.add_argument('--desde', help="Fecha ISO inicial (incluida)")
+    parser.add_argument('--hasta', help="Fecha ISO final (excluida)")
+    parser.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    fmt = args.format or ('arrow' if args.output.endswith(('.arrow', '.arrows', '.ipc')) else 'parquet')
+    size = 0
+    with open(args.output, 'wb') as f:
+        for chunk in export_chunks(fmt, args.history, args.desde, args.hasta, args.batch_size):
+            f.write(chunk)
+            size += len(chunk)
+    print(f"💾 {args.output} ({fmt}, {size / (1024 ** 2):.1f} MB)")
+
+if __name__ == "__main__":
+    main()
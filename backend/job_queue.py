@@ -0,0 +1,212 @@
+# job_queue.py - Cola persistente de trabajos en SQLite
+"""
+Trabajos pesados (análisis por teselas, lotes de imágenes) que no caben en
+una petición HTTP síncrona. La API los registra y responde al instante; un
+pool de hilos los ejecuta en orden de prioridad.
+
+Cada trabajo tiene:
+    - clave de idempotencia opcional: reenviar la misma clave devuelve el
+      trabajo existente en lugar de crear otro
+    - prioridad (mayor primero; a igual prioridad, el más antiguo)
+    - reintentos con espera exponencial hasta `max_intentos`
+    - estado: pendiente, en_proceso, completado o fallido
+
+Los trabajos que quedaron en_proceso al caerse el servidor vuelven a
+pendiente al arrancar.
+"""
+
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from contextlib import closing
+from typing import Callable, Dict, List, Optional
+
+JOBS_DB = 'jobs.db'
+RETRY_BASE_SECONDS = 2.0   # Espera antes del reintento n: base * 2^(n-1)
+POLL_INTERVAL = 0.5        # Segundos entre consultas cuando la cola está vacía
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trabajos (
+    id TEXT PRIMARY KEY,
+    tipo TEXT NOT NULL,
+    clave TEXT UNIQUE,
+    prioridad INTEGER NOT NULL DEFAULT 0,
+    estado TEXT NOT NULL DEFAULT 'pendiente',
+    datos TEXT NOT NULL,
+    resultado TEXT,
+    error TEXT,
+    intentos INTEGER NOT NULL DEFAULT 0,
+    max_intentos INTEGER NOT NULL DEFAULT 3,
+    creado REAL NOT NULL,
+    actualizado REAL NOT NULL,
+    disponible REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS trabajos_cola ON trabajos (estado, prioridad DESC, creado);
+"""
+
+class JobQueue:
+    """Cola de trabajos sobre un archivo SQLite (una conexión por operación)."""
+
+    def __init__(self, path: str = JOBS_DB):
+        self.path = path
+        with closing(self._connect()) as db:
+            db.executescript(SCHEMA)
+            # Lo que quedó a medias en una ejecución anterior vuelve a la cola
+            db.execute("UPDATE trabajos SET estado = 'pendiente' WHERE estado = 'en_proceso'")
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        db.execute('PRAGMA journal_mode=WAL')
+        return db
+
+    @staticmethod
+    def _row(row: Optional[sqlite3.Row]) -> Optional[Dict]:
+        if row is None:
+            return None
+        job = dict(row)
+        job['datos'] = json.loads(job['datos'])
+        job['resultado'] = json.loads(job['resultado']) if job['resultado'] else None
+        return job
+
+    def submit(self, tipo: str, datos: Dict, clave: Optional[str] = None,
+               prioridad: int = 0, max_intentos: int = 3) -> Dict:
+        """Registra un trabajo; con una clave ya usada retorna el existente."""
+        now = time.time()
+        with closing(self._connect()) as db:
+            db.execute(
+                "INSERT OR IGNORE INTO trabajos (id, tipo, clave, prioridad, datos, max_intentos, "
+                "creado, actualizado, disponible) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (uuid.uuid4().hex, tipo, clave, prioridad, json.dumps(datos), max_intentos, now, now, now)
+            )
+            if clave is not None:
+                row = db.execute("SELECT * FROM trabajos WHERE clave = ?", (clave,)).fetchone()
+            else:
+                row = db.execute("SELECT * FROM trabajos WHERE rowid = last_insert_rowid()").fetchone()
+        return self._row(row)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with closing(self._connect()) as db:
+            return self._row(db.execute("SELECT * FROM trabajos WHERE id = ?", (job_id,)).fetchone())
+
+    def list(self, estado: Optional[str] = None, limite: int = 50) -> List[Dict]:
+        query, params = "SELECT * FROM trabajos", ()
+        if estado:
+            query, params = query + " WHERE estado = ?", (estado,)
+        with closing(self._connect()) as db:
+            rows = db.execute(query + " ORDER BY creado DESC LIMIT ?", (*params, limite)).fetchall()
+        return [self._row(r) for r in rows]
+
+    def counts(self) -> Dict[str, int]:
+        with closing(self._connect()) as db:
+            rows = db.execute("SELECT estado, COUNT(*) FROM trabajos GROUP BY estado").fetchall()
+        return {estado: n for estado, n in rows}
+
+    def claim(self) -> Optional[Dict]:
+        """Toma el siguiente trabajo disponible y lo marca en_proceso (atómico entre hilos y procesos)."""
+        now = time.time()
+        db = self._connect()
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            row = db.execute(
+                "SELECT id FROM trabajos WHERE estado = 'pendiente' AND disponible <= ? "
+                "ORDER BY prioridad DESC, creado LIMIT 1", (now,)
+            ).fetchone()
+            if row is None:
+                db.execute('COMMIT')
+                return None
+            db.execute(
+                "UPDATE trabajos SET estado = 'en_proceso', intentos = intentos + 1, actualizado = ? "
+                "WHERE id = ?", (now, row['id'])
+            )
+            job = db.execute("SELECT * FROM trabajos WHERE id = ?", (row['id'],)).fetchone()
+            db.execute('COMMIT')
+            return self._row(job)
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        finally:
+            db.close()
+
+    def complete(self, job_id: str, resultado: Dict):
+        with closing(self._connect()) as db:
+            db.execute(
+                "UPDATE trabajos SET estado = 'completado', resultado = ?, error = NULL, actualizado = ? "
+                "WHERE id = ?", (json.dumps(resultado), time.time(), job_id)
+            )
+
+    def fail(self, job_id: str, error: str) -> str:
+        """Registra el error; reprograma el trabajo si le quedan intentos. Retorna el nuevo estado."""
+        now = time.time()
+        with closing(self._connect()) as db:
+            row = db.execute("SELECT intentos, max_intentos FROM trabajos WHERE id = ?", (job_id,)).fetchone()
+            if row['intentos'] < row['max_intentos']:
+                delay = RETRY_BASE_SECONDS * 2 ** (row['intentos'] - 1)
+                estado, disponible = 'pendiente', now + delay
+            else:
+                estado, disponible = 'fallido', now
+            db.execute(
+                "UPDATE trabajos SET estado = ?, error = ?, actualizado = ?, disponible = ? WHERE id = ?",
+                (estado, error, now, disponible, job_id)
+            )
+        return estado
+
+class WorkerPool:
+    """
+    Hilos que ejecutan los trabajos de la cola. `handlers` asocia cada tipo
+    con una función datos -> resultado (dict serializable a JSON).
+    `on_failure(trabajo)` se llama cuando un trabajo agota sus intentos
+    (p.ej. para borrar archivos que ya nadie va a procesar).
+    """
+
+    def __init__(self, jobs: JobQueue, handlers: Dict[str, Callable[[Dict], Dict]],
+                 workers: int = 2, poll_interval: float = POLL_INTERVAL,
+                 on_failure: Optional[Callable[[Dict], None]] = None):
+        self.jobs = jobs
+        self.handlers = handlers
+        self.on_failure = on_failure
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'trabajos-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def notify(self):
+        """Despierta a los hilos tras registrar un trabajo."""
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            job = self.jobs.claim()
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            handler = self.handlers.get(job['tipo'])
+            try:
+                if handler is None:
+                    raise ValueError(f"Tipo de trabajo desconocido: {job['tipo']}")
+                self.jobs.complete(job['id'], handler(job['datos']))
+            except Exception as e:
+                estado = self.jobs.fail(job['id'], f"{type(e).__name__}: {e}")
+                print(f"⚠️  Trabajo {job['id']} ({job['tipo']}) falló "
+                      f"(intento {job['intentos']}/{job['max_intentos']}): {e} -> {estado}")
+                if estado == 'fallido' and self.on_failure is not None:
+                    try:
+                        self.on_failure(job)
+                    except Exception as cleanup_error:
+                        print(f"⚠️  Limpieza del trabajo {job['id']} falló: {cleanup_error}")
@@ -0,0 +1,186 @@
+# launch_distributed.py - Lanzador de entrenamiento con varios workers
+"""
+Lanza un script de entrenamiento con MultiWorkerMirroredStrategy.
+
+En una máquina crea N procesos y reparte los núcleos entre ellos (hilos
+intra-op = núcleos / N). En varios hosts se ejecuta una vez en cada uno con
+el archivo de cluster y el índice del host:
+
+    {"workers": ["10.0.0.1:12345", "10.0.0.2:12345"]}
+
+Uso:
+    python launch_distributed.py --workers 4 train_model.py
+    python launch_distributed.py --workers 2 binary_train_optimized.py --resume
+    python launch_distributed.py --hosts cluster.json --task-index 0 train_model.py
+    python launch_distributed.py --benchmark [--counts 1 2 4 8]
+
+El worker 0 (jefe) escribe en la consola; el resto en logs/distributed/worker_<i>.log.
+"""
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+from typing import Dict, List
+
+BASE_PORT = 12345
+LOG_DIR = 'logs/distributed'
+SCALING_DIR = 'logs/scaling'
+BENCH_IMAGES = 2048   # Imágenes por época en el benchmark (fijas para cualquier N)
+BENCH_EPOCHS = 2      # La primera época incluye el trazado del grafo
+
+def worker_env(cluster: List[str], index: int, threads: int) -> Dict[str, str]:
+    """Entorno de un worker: TF_CONFIG y su cuota de hilos."""
+    return dict(
+        os.environ,
+        TF_CONFIG=json.dumps({
+            'cluster': {'worker': cluster},
+            'task': {'type': 'worker', 'index': index}
+        }),
+        INTRA_OP_THREADS=str(threads),
+        INTER_OP_THREADS='2'
+    )
+
+def launch_local(command: List[str], num_workers: int, base_port: int = BASE_PORT) -> int:
+    """Lanza `command` en num_workers procesos locales y espera a que terminen."""
+    cluster = [f'localhost:{base_port + i}' for i in range(num_workers)]
+    threads = max(1, (os.cpu_count() or 1) // num_workers)
+    os.makedirs(LOG_DIR, exist_ok=True)
+
+    print(f"🚀 Lanzando {num_workers} workers locales ({threads} hilos intra-op cada uno)")
+    processes, logs = [], []
+    for index in range(num_workers):
+        env = worker_env(cluster, index, threads)
+        if index == 0:
+            processes.append(subprocess.Popen(command, env=env))
+        else:
+            log = open(os.path.join(LOG_DIR, f'worker_{index}.log'), 'w')
+            logs.append(log)
+            processes.append(subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT))
+
+    try:
+        codes = [p.wait() for p in processes]
+    except KeyboardInterrupt:
+        for p in processes:
+            p.terminate()
+        raise
+    finally:
+        for log in logs:
+            log.close()
+
+    failed = [i for i, code in enumerate(codes) if code != 0]
+    if failed:
+        print(f"❌ Workers con error: {failed} (ver {LOG_DIR}/)")
+        return 1
+    return 0
+
+def launch_host(command: List[str], hosts_file: str, task_index: int) -> int:
+    """Ejecuta el worker de este host dentro de un cluster de varias máquinas."""
+    with open(hosts_file) as f:
+        cluster = json.load(f)['workers']
+    print(f"🌐 Worker {task_index + 1}/{len(cluster)} en {cluster[task_index]}")
+    env = worker_env(cluster, task_index, os.cpu_count() or 1)
+    return subprocess.call(command, env=env)
+
+def _bench_worker(out_dir: str, images: int, epochs: int):
+    """Entrenamiento corto del modelo binario (se ejecuta dentro de cada worker)."""
+    from training_profile import apply_training_profile
+    profile = apply_training_profile(verbose=False)
+
+    from distributed import cluster_info, get_strategy, scale_learning_rate, training_input, worker_path
+    strategy = get_strategy()
+
+    from balanced_sampler import BalancedImageSampler, BINARY_CLASS_MAP
+    from binary_train_optimized import (
+        BATCH_SIZE, DATA_DIR, IMG_SIZE, LEARNING_RATE, LOADER_WORKERS, create_binary_model
+    )
+    from training_callbacks import ThroughputProfiler
+
+    index, num_workers = cluster_info()
+    sampler = BalancedImageSampler(
+        DATA_DIR, 'train',
+        class_map=BINARY_CLASS_MAP,
+        img_size=IMG_SIZE,
+        batch_size=BATCH_SIZE,
+        class_mode='binary',
+        steps_per_epoch=max(1, images // (BATCH_SIZE * num_workers)),
+        shard_index=index,
+        num_shards=num_workers,
+        workers=LOADER_WORKERS
+    )
+    with strategy.scope():
+        model = create_binary_model(profile, scale_learning_rate(LEARNING_RATE, num_workers))
+
+    model.fit(
+        training_input(sampler, num_workers),
+        epochs=epochs,
+        callbacks=[ThroughputProfiler(BATCH_SIZE * num_workers, worker_path(out_dir), sampler=sampler, verbose=0)],
+        verbose=0
+    )
+
+def scaling_benchmark(counts: List[int], images: int = BENCH_IMAGES, epochs: int = BENCH_EPOCHS):
+    """Tiempo por época con 1, 2, 4, 8... workers sobre las mismas imágenes por época."""
+    results = []
+    for n in counts:
+        out_dir = os.path.join(SCALING_DIR, f'{n}_workers')
+        command = [sys.executable, __file__, '_bench_worker', out_dir, str(images), str(epochs)]
+        print(f"\n🏁 {n} worker(s)...")
+        if launch_local(command, n) != 0:
+            continue
+
+        with open(os.path.join(out_dir, 'throughput.json')) as f:
+            last = json.load(f)[-1]  # Época sin trazado del grafo
+        results.append({
+            'workers': n,
+            'epoch_time_s': last['wall_time_s'],
+            'images_per_sec': last['images_per_sec'],
+            'loader_utilization': last['loader_utilization']
+        })
+
+    if not results:
+        print("❌ Ninguna configuración terminó correctamente")
+        return results
+
+    base = results[0]['epoch_time_s'] * results[0]['workers']
+    print(f"\n{'Workers':>8} {'Época (s)':>10} {'img/s':>9} {'Speedup':>8} {'Eficiencia':>11} {'Carga datos':>12}")
+    for r in results:
+        r['speedup'] = base / r['epoch_time_s']
+        r['efficiency'] = r['speedup'] / r['workers']
+        print(f"{r['workers']:>8} {r['epoch_time_s']:>10.1f} {r['images_per_sec']:>9.1f} "
+              f"{r['speedup']:>7.2f}x {r['efficiency']:>10.0%} {r['loader_utilization']:>11.0%}")
+
+    os.makedirs(SCALING_DIR, exist_ok=True)
+    with open(os.path.join(SCALING_DIR, 'scaling_results.json'), 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f"\n💾 Resultados guardados en {SCALING_DIR}/scaling_results.json")
+    return results
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '_bench_worker':
+        _bench_worker(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]))
+        return
+
+    parser = argparse.ArgumentParser(description="Entrenamiento distribuido con varios workers")
+    parser.add_argument('script', nargs='?', default='binary_train_optimized.py')
+    parser.add_argument('script_args', nargs=argparse.REMAINDER,
+                        help="Argumentos para el script (p.ej. --resume)")
+    parser.add_argument('--workers', type=int, default=2, help="Workers locales")
+    parser.add_argument('--hosts', help="JSON con la lista de workers del cluster")
+    parser.add_argument('--task-index', type=int, default=0, help="Índice de este host en --hosts")
+    parser.add_argument('--port', type=int, default=BASE_PORT, help="Primer puerto local")
+    parser.add_argument('--benchmark', action='store_true', help="Medir escalado con --counts workers")
+    parser.add_argument('--counts', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    if args.benchmark:
+        scaling_benchmark(args.counts)
+        return
+
+    command = [sys.executable, args.script, *args.script_args]
+    if args.hosts:
+        sys.exit(launch_host(command, args.hosts, args.task_index))
+    sys.exit(launch_local(command, args.workers, args.port))
+
+if __name__ == "__main__":
+    main()
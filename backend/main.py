@@ -4,25 +4,45 @@ API REST para el sistema de detección de mosca blanca en cultivos hidropónicos
 Incluye endpoints para análisis de imágenes, entrenamiento y estadísticas.
 """
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 import tensorflow as tf
 from tensorflow import keras
-from tensorflow.keras.applications import MobileNetV2
 from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout
 from tensorflow.keras.models import Model
-from tensorflow.keras.preprocessing.image import img_to_array
 import numpy as np
 import cv2
 from PIL import Image
 import io
 from datetime import datetime
-from typing import List, Dict
+from typing import List, Dict, Optional
 import json
 import os
+import threading
+import uuid
+import hashlib
+import importlib.util
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from evaluation import model_input_size
+from model_config import build_backbone, read_model_config, with_preprocessing
+from model_bundle import DEFAULT_THRESHOLDS, ModelRegistry, class_probabilities, decide
+from dataset_index import CLASSES
+from perceptual_index import PerceptualIndex, image_dhash
+from explanations import ExplanationService, valid_id
+from job_queue import JobQueue, WorkerPool
+from history_export import FORMATS, append_record, export_chunks
 
-app = FastAPI(title="Sistema Detección Mosca Blanca", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # La cola de trabajos y sus hilos existen solo mientras corre el servidor
+    # (importar main, p.ej. desde benchmark_detect.py, no crea jobs.db)
+    iniciar_trabajos()
+    yield
+    detener_trabajos()
+
+app = FastAPI(title="Sistema Detección Mosca Blanca", version="1.0.0", lifespan=lifespan)
 
 # Configurar CORS para Flutter
 app.add_middleware(
@@ -34,24 +54,78 @@ app.add_middleware(
 )
 
 # Configuración global
-IMG_SIZE = (224, 224)
-MODEL_PATH = "models/whitefly_detector.h5"
-CONFIDENCE_THRESHOLD = 0.7
+MODELS_DIR = "models"
+MODEL_BUNDLE = os.environ.get('MODEL_BUNDLE', 'whitefly_detector')  # models/<nombre>.bundle
+MODEL_PATH = "models/whitefly_detector.h5"  # Modelo sin bundle (formato anterior)
+MODEL_CONFIG = read_model_config()  # Tamaño de entrada y alpha registrados al entrenar
+IMG_SIZE = MODEL_CONFIG['img_size']
+CONFIDENCE_THRESHOLD = 0.7  # Por debajo se aplica test-time augmentation (si el bundle no fija otro)
+TTA_CROP_FRACTION = 0.9
+TTA_VARIANTS = 7  # 2 volteos + 5 recortes
+# Reutilización de resultados de imágenes casi idénticas (0 entradas = desactivada)
+REUSE_INDEX_SIZE = int(os.environ.get('REUSE_INDEX_SIZE', 2048))
+REUSE_HAMMING_THRESHOLD = int(os.environ.get('REUSE_HAMMING_THRESHOLD', 4))  # Bits de dHash distintos
+# La reutilización es opcional por petición (reutilizar=true): comprobar antes el umbral
+# con `python dedupe_dataset.py reuse` para que no mezcle clases en el dataset propio
+REUSE_DEFAULT = os.environ.get('REUSE_DEFAULT', '0') == '1'
+TILE_OVERLAP = 0.1  # Solapamiento entre teselas del análisis de alta resolución
+# Máscara de hoja del análisis OpenCV: segmentación HSV del verde a baja resolución
+LEAF_MASK_MAX_SIDE = 256
+LEAF_HSV_LOW = (25, 40, 30)      # H en [0, 180) de OpenCV: amarillo verdoso...
+LEAF_HSV_HIGH = (95, 255, 255)   # ...hasta verde azulado
+LEAF_MIN_BLOB_FRACTION = 0.01    # Manchas verdes menores no cuentan como hoja
+LEAF_MIN_FRACTION = 0.05         # Con menos hoja visible se analiza el cuadro completo
+# Ramas CNN y OpenCV de detect_advanced en paralelo, con los núcleos repartidos entre ambas
+CONCURRENT_BRANCHES = os.environ.get('CONCURRENT_BRANCHES', '1') != '0'
+BRANCH_WORKERS = int(os.environ.get('BRANCH_WORKERS', 2))      # Hilos de la rama OpenCV
+INFERENCE_THREADS = int(os.environ.get('INFERENCE_THREADS', os.cpu_count() or 1))
+OPENCV_THREADS = int(os.environ.get('OPENCV_THREADS', max(1, INFERENCE_THREADS // 4)))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_UPLOADS_DIR = "uploads/jobs"
+# Nombres cortos de las clases en 'distribuciones' de la respuesta
+DISTRIBUTION_KEYS = {'infestacion_leve': 'leve', 'infestacion_severa': 'severa'}
+
+registry = ModelRegistry(MODELS_DIR)
+
+def configure_threads():
+    """
+    Reparte INFERENCE_THREADS entre OpenCV y TensorFlow (intra-op) para que
+    las dos ramas de detect_advanced no compitan por los mismos núcleos.
+    TensorFlow solo acepta el cambio antes de inicializar su runtime.
+    """
+    tf_threads = max(1, INFERENCE_THREADS - OPENCV_THREADS)
+    cv2.setNumThreads(OPENCV_THREADS)
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(tf_threads)
+    except RuntimeError as e:
+        print(f"⚠️  No se pudo fijar los hilos de TensorFlow: {e}")
+    print(f"🧵 Hilos: TensorFlow {tf_threads}, OpenCV {OPENCV_THREADS}")
+
+configure_threads()
 
 class WhiteflyDetector:
     """Detector de mosca blanca usando CNN."""
     
     def __init__(self):
-        self.model = None
+        self.bundle = None
+        self._model = None
+        self.img_size = tuple(IMG_SIZE)  # (alto, ancho)
+        # Índices de class_indices: orden alfabético salvo que el bundle diga otro
+        self.classes = sorted(MODEL_CONFIG.get('classes', CLASSES))
+        self.kind = 'multiclass'
+        self.confidence_threshold = CONFIDENCE_THRESHOLD
+        self.thresholds = dict(DEFAULT_THRESHOLDS)  # 'decision' corta la sigmoide en binarios
+        self.stats = {'inferencias': 0, 'tta_activado': 0, 'reutilizadas': 0}
+        self.similar = PerceptualIndex(REUSE_INDEX_SIZE) if REUSE_INDEX_SIZE > 0 else None
+        self.stats_lock = threading.Lock()
+        self._buffers = threading.local()  # Lote uint8 reutilizable por hilo
+        self.concurrent_branches = CONCURRENT_BRANCHES
+        self.branch_pool = ThreadPoolExecutor(max_workers=BRANCH_WORKERS, thread_name_prefix='rama-opencv')
         self.load_or_create_model()
     
     def create_model(self):
         """Crea un modelo CNN basado en MobileNetV2."""
-        base_model = MobileNetV2(
-            weights='imagenet',
-            include_top=False,
-            input_shape=(*IMG_SIZE, 3)
-        )
+        base_model = build_backbone(self.img_size, MODEL_CONFIG['alpha'])
         
         # Congelar las capas base
         base_model.trainable = False
@@ -64,10 +138,10 @@ class WhiteflyDetector:
         x = Dense(128, activation='relu')(x)
         x = Dropout(0.3)(x)
         
-        # Capa de salida: 3 clases (sin_plaga, infestacion_leve, infestacion_severa)
-        predictions = Dense(3, activation='softmax')(x)
+        # Capa de salida: una por clase, en orden alfabético como class_indices
+        predictions = Dense(len(self.classes), activation='softmax')(x)
         
-        model = Model(inputs=base_model.input, outputs=predictions)
+        model = with_preprocessing(Model(inputs=base_model.input, outputs=predictions), self.img_size)
         
         model.compile(
             optimizer=keras.optimizers.Adam(learning_rate=0.001),
@@ -77,77 +151,303 @@ class WhiteflyDetector:
         
         return model
     
+    @property
+    def model(self):
+        """Modelo servido; el del bundle se lee en la primera predicción."""
+        return self.bundle.model if self.bundle is not None else self._model
+    
+    @property
+    def model_loaded(self) -> bool:
+        return self.bundle.loaded if self.bundle is not None else self._model is not None
+    
     def load_or_create_model(self):
-        """Carga el modelo entrenado o crea uno nuevo."""
-        if os.path.exists(MODEL_PATH):
+        """Usa el bundle configurado; si no existe, el .h5 anterior o un modelo nuevo."""
+        if MODEL_BUNDLE in registry.names() or MODEL_BUNDLE.endswith('.bundle'):
+            self.bundle = registry.get(MODEL_BUNDLE)
+            print(f"Usando bundle {self.bundle.path} ({self.bundle.kind}, clases {self.bundle.classes})")
+            # Todo lo necesario para servir viene en el manifiesto
+            self.img_size = self.bundle.img_size
+            self.classes = self.bundle.classes
+            self.kind = self.bundle.kind
+            self.confidence_threshold = self.bundle.thresholds.get('tta_confidence', CONFIDENCE_THRESHOLD)
+            self.thresholds = {**DEFAULT_THRESHOLDS, **self.bundle.thresholds}
+        elif os.path.exists(MODEL_PATH):
             print(f"Cargando modelo desde {MODEL_PATH}")
-            self.model = keras.models.load_model(MODEL_PATH)
+            self._model = keras.models.load_model(MODEL_PATH)
+            self.check_input_size()
+            # Los modelos anteriores esperan float en [0, 1]: se les antepone el preprocesamiento
+            self._model = with_preprocessing(self._model, self.img_size)
+            if self._model.output_shape[-1] == 1:
+                self.kind, self.classes = 'binary', ['con_plaga', 'sin_plaga']
         else:
             print("Creando nuevo modelo...")
-            self.model = self.create_model()
+            self._model = self.create_model()
             os.makedirs(os.path.dirname(MODEL_PATH), exist_ok=True)
     
-    def preprocess_image(self, image_bytes: bytes) -> np.ndarray:
-        """Preprocesa la imagen para el modelo."""
-        # Convertir bytes a imagen PIL
+    def probabilities(self, outputs) -> np.ndarray:
+        """Salida del modelo -> probabilidad por clase (la sigmoide binaria da dos columnas)."""
+        return class_probabilities(outputs, self.kind)
+    
+    def decide(self, probs) -> np.ndarray:
+        """Índice de clase por fila; en binarios aplica el umbral 'decision' del bundle."""
+        return decide(probs, self.kind, self.thresholds)
+    
+    def check_input_size(self):
+        """Usa el tamaño de entrada real del modelo si no coincide con model_config.json."""
+        model_size = model_input_size(self._model)
+        if model_size != self.img_size:
+            print(f"⚠️  model_config.json indica {self.img_size} pero el modelo espera {model_size}; "
+                  f"se usa {model_size}")
+            self.img_size = model_size
+    
+    def batch_buffer(self) -> np.ndarray:
+        """
+        Lote uint8 preasignado del hilo actual: posición 0 para la imagen y
+        las siguientes TTA_VARIANTS para sus variantes. Se reutiliza entre
+        peticiones; el escalado a [0, 1] lo hace el propio modelo.
+        """
+        shape = (1 + TTA_VARIANTS, *self.img_size, 3)
+        buffer = getattr(self._buffers, 'batch', None)
+        if buffer is None or buffer.shape != shape:
+            buffer = self._buffers.batch = np.empty(shape, dtype=np.uint8)
+        return buffer
+    
+    @staticmethod
+    def decode_image(image_bytes: bytes) -> Image.Image:
+        """Decodifica la imagen una vez, en RGB, para todas las ramas del análisis."""
         image = Image.open(io.BytesIO(image_bytes))
         
         # Convertir a RGB si es necesario
         if image.mode != 'RGB':
             image = image.convert('RGB')
+        image.load()
+        return image
+    
+    def preprocess_image(self, image: Image.Image) -> np.ndarray:
+        """
+        Redimensiona la imagen decodificada dentro del lote del hilo.
+        
+        Returns:
+            El lote completo; la imagen queda en la posición 0
+        """
+        # Redimensionar (PIL recibe ancho, alto; vecino más cercano como en
+        # entrenamiento) y copiar los píxeles al lote
+        image = image.resize(self.img_size[::-1], Image.NEAREST)
+        batch = self.batch_buffer()
+        np.copyto(batch[0], np.asarray(image))
+        
+        return batch
+    
+    def build_tta_batch(self, batch: np.ndarray) -> np.ndarray:
+        """
+        Escribe en batch[1:] las variantes de test-time augmentation de
+        batch[0]: volteos y recortes pequeños (esquinas y centro)
+        redimensionados directamente sobre el lote.
+        """
+        img = batch[0]
+        h, w = img.shape[:2]
+        ch, cw = int(h * TTA_CROP_FRACTION), int(w * TTA_CROP_FRACTION)
+        crops = [
+            img[:ch, :cw], img[:ch, w - cw:], img[h - ch:, :cw], img[h - ch:, w - cw:],
+            img[(h - ch) // 2:(h - ch) // 2 + ch, (w - cw) // 2:(w - cw) // 2 + cw]
+        ]
+        np.copyto(batch[1], img[:, ::-1])
+        np.copyto(batch[2], img[::-1, :])
+        for dst, crop in zip(batch[3:], crops):
+            cv2.resize(crop, (w, h), dst=dst, interpolation=cv2.INTER_LINEAR)
+        return batch[1:]
+    
+    def predict_adaptive(self, batch: np.ndarray):
+        """
+        Una sola pasada si la confianza supera el umbral de TTA; si no,
+        evalúa todas las variantes TTA en una llamada y promedia.
         
-        # Redimensionar
-        image = image.resize(IMG_SIZE)
+        Returns:
+            (probabilidades, si se aplicó TTA)
+        """
+        predictions = self.probabilities(self.model.predict_on_batch(batch[:1]))[0]
+        use_tta = float(np.max(predictions)) < self.confidence_threshold
         
-        # Convertir a array y normalizar
-        img_array = img_to_array(image)
-        img_array = img_array / 255.0
+        if use_tta:
+            tta_predictions = self.probabilities(self.model.predict_on_batch(self.build_tta_batch(batch)))
+            predictions = np.vstack([predictions[None], tta_predictions]).mean(axis=0)
         
-        # Agregar dimensión de batch
-        img_array = np.expand_dims(img_array, axis=0)
+        with self.stats_lock:
+            self.stats['inferencias'] += 1
+            self.stats['tta_activado'] += int(use_tta)
         
-        return img_array
+        return predictions, use_tta
     
-    def detect_advanced(self, image_bytes: bytes) -> Dict:
+    def detect_advanced(self, image_bytes: bytes, reutilizar: bool = REUSE_DEFAULT,
+                        umbral_hamming: Optional[int] = None) -> Dict:
         """
         Detección avanzada con análisis visual complementario.
         Combina CNN con procesamiento de imágenes tradicional.
+        
+        Con reutilizar=True, si una imagen analizada hace poco está a
+        `umbral_hamming` bits de dHash o menos, se retorna su resultado sin
+        inferencia ('reutilizado': True). Por defecto siempre se analiza (y el
+        resultado se indexa para peticiones que sí pidan reutilizar).
         """
-        # Predicción con CNN
-        img_array = self.preprocess_image(image_bytes)
-        predictions = self.model.predict(img_array, verbose=0)
+        image_hash = None
+        if self.similar is not None:
+            image_hash = image_dhash(image_bytes)
+            if reutilizar:
+                threshold = REUSE_HAMMING_THRESHOLD if umbral_hamming is None else umbral_hamming
+                match = self.similar.lookup(image_hash, threshold)
+                if match is not None:
+                    previous, distance = match
+                    with self.stats_lock:
+                        self.stats['reutilizadas'] += 1
+                    return {
+                        **previous,
+                        'reutilizado': True,
+                        'distancia_hamming': distance,
+                        'timestamp_original': previous['timestamp'],
+                        'timestamp': datetime.now().isoformat()
+                    }
+        
+        image = self.decode_image(image_bytes)
+        rgb = np.asarray(image)
+        
+        # Análisis complementario con OpenCV: en el pool mientras corre la CNN
+        # (TensorFlow y OpenCV liberan el GIL, la latencia queda en la de la rama más lenta)
+        opencv_branch = lambda: self.analyze_with_opencv(cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR))
+        pending = self.branch_pool.submit(opencv_branch) if self.concurrent_branches else None
+        
+        # Predicción con CNN (TTA solo para imágenes de baja confianza)
+        batch = self.preprocess_image(image)
+        probs, tta_aplicado = self.predict_adaptive(batch)
+        predictions = probs[None]
         
         # Obtener clase y confianza
-        class_idx = np.argmax(predictions[0])
+        class_idx = int(self.decide(predictions)[0])
         confidence = float(predictions[0][class_idx])
         
-        classes = ['sin_plaga', 'infestacion_leve', 'infestacion_severa']
-        detected_class = classes[class_idx]
+        detected_class = self.classes[class_idx]
         
-        # Análisis complementario con OpenCV
-        image = Image.open(io.BytesIO(image_bytes))
-        cv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-        additional_analysis = self.analyze_with_opencv(cv_image)
+        additional_analysis = pending.result() if pending is not None else opencv_branch()
         
-        return {
+        result = {
             'clase': detected_class,
             'confianza': confidence,
             'distribuciones': {
-                'sin_plaga': float(predictions[0][0]),
-                'leve': float(predictions[0][1]),
-                'severa': float(predictions[0][2])
+                DISTRIBUTION_KEYS.get(name, name): float(p)
+                for name, p in zip(self.classes, predictions[0])
             },
             'analisis_visual': additional_analysis,
+            'tta_aplicado': tta_aplicado,
+            'timestamp': datetime.now().isoformat()
+        }
+        if image_hash is not None:
+            self.similar.add(image_hash, result)
+        
+        return {**result, 'reutilizado': False}
+    
+    def detect_tiled(self, image_bytes: bytes, grid: int = 3) -> Dict:
+        """
+        Análisis de imágenes de alta resolución: divide la imagen en
+        grid x grid teselas solapadas, clasifica todas en un lote y agrega.
+        Una plaga localizada que se pierde al reducir la foto completa
+        aparece en la tesela que la contiene.
+        """
+        rgb = np.asarray(self.decode_image(image_bytes))
+        opencv_branch = lambda: self.analyze_with_opencv(cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR))
+        pending = self.branch_pool.submit(opencv_branch) if self.concurrent_branches else None
+        H, W = rgb.shape[:2]
+        th, tw = int(H / grid * (1 + TILE_OVERLAP)), int(W / grid * (1 + TILE_OVERLAP))
+        tops = np.linspace(0, H - th, grid).astype(int) if grid > 1 else [0]
+        lefts = np.linspace(0, W - tw, grid).astype(int) if grid > 1 else [0]
+        boxes = [(int(t), int(l), min(th, H), min(tw, W)) for t in tops for l in lefts]
+        
+        h, w = self.img_size
+        batch = np.empty((len(boxes), h, w, 3), dtype=np.uint8)
+        for dst, (t, l, bh, bw) in zip(batch, boxes):
+            cv2.resize(rgb[t:t + bh, l:l + bw], (w, h), dst=dst, interpolation=cv2.INTER_AREA)
+        probs = self.probabilities(self.model.predict_on_batch(batch))
+        
+        mean = probs.mean(axis=0)
+        tile_classes = self.decide(probs)
+        overall = int(self.decide(mean)[0])
+        pest = [i for i, name in enumerate(self.classes) if name != 'sin_plaga']
+        tiles = [
+            {
+                'caja': {'y': t, 'x': l, 'alto': bh, 'ancho': bw},
+                'clase': self.classes[c],
+                'confianza': float(p[c])
+            }
+            for (t, l, bh, bw), p, c in zip(boxes, probs, tile_classes)
+        ]
+        return {
+            'clase': self.classes[overall],
+            'confianza': float(mean[overall]),
+            'distribuciones': {
+                DISTRIBUTION_KEYS.get(name, name): float(p) for name, p in zip(self.classes, mean)
+            },
+            'teselas': tiles,
+            'teselas_con_plaga': sum(int(c) in pest for c in tile_classes),
+            'max_probabilidad_plaga': float(probs[:, pest].sum(axis=1).max()) if pest else 0.0,
+            'analisis_visual': pending.result() if pending is not None else opencv_branch(),
             'timestamp': datetime.now().isoformat()
         }
     
+    def leaf_mask(self, image: np.ndarray):
+        """
+        Segmenta la hoja (píxeles verdes en HSV) sobre una copia reducida,
+        limpia la máscara con apertura/cierre y rellena los huecos, que es
+        donde quedan las moscas blancas.
+        
+        Returns:
+            ((y0, y1, x0, x1), máscara uint8 del recorte a resolución completa),
+            o None si la hoja ocupa menos de LEAF_MIN_FRACTION del cuadro
+        """
+        H, W = image.shape[:2]
+        scale = min(1.0, LEAF_MASK_MAX_SIDE / max(H, W))
+        sw, sh = max(1, round(W * scale)), max(1, round(H * scale))
+        small = cv2.resize(image, (sw, sh), interpolation=cv2.INTER_AREA)
+        
+        mask = cv2.inRange(cv2.cvtColor(small, cv2.COLOR_BGR2HSV), LEAF_HSV_LOW, LEAF_HSV_HIGH)
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+        
+        # Rellenar el contorno exterior de cada hoja descarta huecos y manchas sueltas
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        leaves = [c for c in contours if cv2.contourArea(c) >= LEAF_MIN_BLOB_FRACTION * sw * sh]
+        mask[:] = 0
+        cv2.drawContours(mask, leaves, -1, 255, thickness=cv2.FILLED)
+        if cv2.countNonZero(mask) < LEAF_MIN_FRACTION * sw * sh:
+            return None
+        
+        # Caja de la hoja llevada a resolución completa
+        x, y, bw, bh = cv2.boundingRect(mask)
+        x0, y0 = int(x / scale), int(y / scale)
+        x1, y1 = min(W, int(np.ceil((x + bw) / scale))), min(H, int(np.ceil((y + bh) / scale)))
+        roi_mask = cv2.resize(mask[y:y + bh, x:x + bw], (x1 - x0, y1 - y0), interpolation=cv2.INTER_NEAREST)
+        return (y0, y1, x0, x1), roi_mask
+    
     def analyze_with_opencv(self, image: np.ndarray) -> Dict:
-        """Análisis complementario con OpenCV."""
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        """
+        Análisis complementario con OpenCV, restringido a la hoja: el umbral
+        y los contornos se calculan solo dentro de la caja de la máscara y se
+        descartan fondo, bandejas y etiquetas. La densidad es por área de hoja.
+        """
+        leaf = self.leaf_mask(image)
+        if leaf is None:
+            roi, mask = image, None
+            leaf_area = image.shape[0] * image.shape[1]
+        else:
+            (y0, y1, x0, x1), mask = leaf
+            roi = image[y0:y1, x0:x1]
+            leaf_area = cv2.countNonZero(mask)
+        
+        gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
         blurred = cv2.GaussianBlur(gray, (5, 5), 0)
         
         # Detectar regiones brillantes (posibles moscas blancas)
         _, binary = cv2.threshold(blurred, 200, 255, cv2.THRESH_BINARY)
+        if mask is not None:
+            cv2.bitwise_and(binary, mask, dst=binary)
         
         # Encontrar contornos
         contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -168,7 +468,10 @@ class WhiteflyDetector:
             'contornos_detectados': len(valid_contours),
             'area_promedio': float(area_promedio),
             'desviacion_areas': float(area_std),
-            'densidad_estimada': len(valid_contours) / (image.shape[0] * image.shape[1]) * 10000
+            'densidad_estimada': len(valid_contours) / leaf_area * 10000,  # Por 10.000 px de hoja
+            'area_hoja_px': int(leaf_area),
+            'fraccion_hoja': leaf_area / (image.shape[0] * image.shape[1]),
+            'mascara_hoja': mask is not None
         }
     
     def generate_recommendations(self, detection_result: Dict) -> List[str]:
@@ -187,7 +490,7 @@ class WhiteflyDetector:
                 "Verificar sistema de ventilación"
             ])
         
-        elif clase == 'infestacion_leve' or (clase == 'sin_plaga' and contornos > 5):
+        elif clase in ('infestacion_leve', 'con_plaga') or (clase == 'sin_plaga' and contornos > 5):
             recommendations.extend([
                 "⚠️ Infestación leve detectada",
                 "Realizar inspección visual detallada",
@@ -221,6 +524,9 @@ class WhiteflyDetector:
 # Instancia global del detector
 detector = WhiteflyDetector()
 
+# Mapas de calor Grad-CAM bajo demanda (fuera de la ruta de detección)
+explicaciones = ExplanationService(detector)
+
 # Almacenamiento en memoria (en producción usar base de datos)
 historial_detecciones = []
 
@@ -235,13 +541,49 @@ async def root():
         "descripcion": "Sistema inteligente para detección de plagas en cultivos hidropónicos"
     }
 
+def analizar_imagen(contents: bytes, reutilizar: bool = REUSE_DEFAULT,
+                    umbral_hamming: Optional[int] = None) -> Dict:
+    """Detección, recomendaciones e historial de una imagen (síncrono o desde la cola)."""
+    # Realizar detección
+    resultado = detector.detect_advanced(contents, reutilizar, umbral_hamming)
+    
+    # Generar recomendaciones
+    recomendaciones = detector.generate_recommendations(resultado)
+    
+    # Id para pedir después la explicación de esta detección
+    deteccion_id = uuid.uuid4().hex
+    explicaciones.remember(deteccion_id, contents)
+    
+    # Crear respuesta completa
+    response = {
+        'exito': True,
+        'id_deteccion': deteccion_id,
+        'deteccion': resultado,
+        'recomendaciones': recomendaciones,
+        'ubicacion': 'Mesa de los Santos, Colombia',
+        'clima': 'Cálido',
+        'fecha_analisis': datetime.now().isoformat()
+    }
+    
+    # Guardar en historial (memoria y archivo JSONL persistente)
+    historial_detecciones.append(response)
+    append_record(response)
+    
+    return response
+
 @app.post("/api/detectar")
-async def detectar_plaga(file: UploadFile = File(...)):
+async def detectar_plaga(
+    file: UploadFile = File(...),
+    reutilizar: bool = REUSE_DEFAULT,
+    umbral_hamming: Optional[int] = Query(None, ge=0, le=64)
+):
     """
     Endpoint principal para detectar mosca blanca en una imagen.
     
     Args:
         file: Archivo de imagen (JPG, PNG)
+        reutilizar: Reutilizar el resultado de una imagen reciente casi idéntica
+        umbral_hamming: Bits de dHash distintos tolerados (por defecto REUSE_HAMMING_THRESHOLD)
     
     Returns:
         JSON con resultado de detección y recomendaciones
@@ -254,30 +596,157 @@ async def detectar_plaga(file: UploadFile = File(...)):
         # Leer imagen
         contents = await file.read()
         
-        # Realizar detección
-        resultado = detector.detect_advanced(contents)
-        
-        # Generar recomendaciones
-        recomendaciones = detector.generate_recommendations(resultado)
-        
-        # Crear respuesta completa
-        response = {
-            'exito': True,
-            'deteccion': resultado,
-            'recomendaciones': recomendaciones,
-            'ubicacion': 'Mesa de los Santos, Colombia',
-            'clima': 'Cálido',
-            'fecha_analisis': datetime.now().isoformat()
-        }
-        
-        # Guardar en historial
-        historial_detecciones.append(response)
-        
-        return JSONResponse(content=response)
+        return JSONResponse(content=analizar_imagen(contents, reutilizar, umbral_hamming))
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error en detección: {str(e)}")
 
+def _leer_subida(datos: Dict) -> bytes:
+    with open(datos['archivo'], 'rb') as f:
+        return f.read()
+
+def _borrar_subida(datos: Dict):
+    if os.path.exists(datos['archivo']):
+        os.remove(datos['archivo'])
+
+def _trabajo_deteccion(datos: Dict) -> Dict:
+    response = analizar_imagen(_leer_subida(datos), datos.get('reutilizar', REUSE_DEFAULT), datos.get('umbral_hamming'))
+    _borrar_subida(datos)
+    return response
+
+def _trabajo_teselado(datos: Dict) -> Dict:
+    resultado = detector.detect_tiled(_leer_subida(datos), datos.get('teselas', 3))
+    _borrar_subida(datos)
+    return {
+        'exito': True,
+        'deteccion': resultado,
+        'recomendaciones': detector.generate_recommendations(resultado),
+        'fecha_analisis': datetime.now().isoformat()
+    }
+
+MANEJADORES_TRABAJOS = {'deteccion': _trabajo_deteccion, 'analisis_teselado': _trabajo_teselado}
+
+# Cola persistente para análisis pesados y lotes de imágenes (se abre al arrancar el servidor)
+trabajos: Optional[JobQueue] = None
+trabajadores: Optional[WorkerPool] = None
+
+def iniciar_trabajos():
+    global trabajos, trabajadores
+    trabajos = JobQueue()
+    trabajadores = WorkerPool(
+        trabajos,
+        MANEJADORES_TRABAJOS,
+        workers=JOB_WORKERS,
+        # Sin más reintentos la subida ya no se va a leer
+        on_failure=lambda job: _borrar_subida(job['datos'])
+    )
+    trabajadores.start()
+
+def detener_trabajos():
+    if trabajadores is not None:
+        trabajadores.stop()
+
+@app.post("/api/trabajos", status_code=202)
+async def crear_trabajos(
+    files: List[UploadFile] = File(...),
+    tipo: str = 'deteccion',
+    prioridad: int = Query(0, ge=-10, le=10),
+    teselas: int = Query(3, ge=1, le=8),
+    reutilizar: bool = REUSE_DEFAULT,
+    clave: Optional[str] = Header(None, alias='Idempotency-Key')
+):
+    """
+    Registra uno o varios análisis y responde sin esperar a que terminen.
+    
+    Args:
+        files: Una o varias imágenes (un trabajo por imagen)
+        tipo: 'deteccion' o 'analisis_teselado' (imágenes de alta resolución)
+        prioridad: Mayor se procesa antes
+        teselas: Teselas por lado en 'analisis_teselado'
+        clave: Cabecera Idempotency-Key; reenviar la misma clave no duplica trabajos
+    
+    Returns:
+        Id, estado y URL de consulta de cada trabajo
+    """
+    if tipo not in MANEJADORES_TRABAJOS:
+        raise HTTPException(status_code=400, detail=f"Tipo desconocido; use uno de {sorted(MANEJADORES_TRABAJOS)}")
+    if any(not f.content_type.startswith('image/') for f in files):
+        raise HTTPException(status_code=400, detail="Todos los archivos deben ser imágenes")
+    
+    os.makedirs(JOB_UPLOADS_DIR, exist_ok=True)
+    creados = []
+    for i, file in enumerate(files):
+        contents = await file.read()
+        ext = os.path.splitext(file.filename or '')[1].lower() or '.jpg'
+        path = os.path.join(JOB_UPLOADS_DIR, f"{uuid.uuid4().hex}{ext}")
+        with open(path, 'wb') as f:
+            f.write(contents)
+        
+        datos = {
+            'archivo': path,
+            'nombre': file.filename,
+            'sha1': hashlib.sha1(contents).hexdigest(),
+            'reutilizar': reutilizar,
+            'teselas': teselas
+        }
+        job = trabajos.submit(
+            tipo, datos,
+            clave=None if clave is None else (clave if len(files) == 1 else f"{clave}:{i}"),
+            prioridad=prioridad
+        )
+        if job['datos']['archivo'] != path:
+            os.remove(path)  # Reenvío de un trabajo ya registrado
+        creados.append({'id': job['id'], 'estado': job['estado'], 'url': f"/api/trabajos/{job['id']}"})
+    
+    trabajadores.notify()
+    return {'trabajos': creados}
+
+@app.get("/api/trabajos/{trabajo_id}")
+async def obtener_trabajo(trabajo_id: str):
+    """Estado, intentos y resultado (cuando está completado) de un trabajo."""
+    job = trabajos.get(trabajo_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job
+
+@app.get("/api/trabajos")
+async def listar_trabajos(estado: Optional[str] = None, limite: int = Query(50, ge=1, le=500)):
+    """Trabajos recientes (sin resultados) y conteo por estado."""
+    return {
+        'conteo': trabajos.counts(),
+        'trabajos': [{k: v for k, v in job.items() if k != 'resultado'}
+                     for job in trabajos.list(estado, limite)]
+    }
+
+@app.post("/api/explicaciones/{deteccion_id}")
+async def solicitar_explicacion(deteccion_id: str, clase: Optional[str] = None):
+    """
+    Encola el mapa de calor Grad-CAM de una detección reciente.
+    
+    Args:
+        deteccion_id: 'id_deteccion' de la respuesta de /api/detectar
+        clase: Clase a explicar (por defecto la predicha)
+    """
+    if clase is not None and clase not in detector.classes:
+        raise HTTPException(status_code=400, detail=f"Clase desconocida; use una de {detector.classes}")
+    status = explicaciones.request(deteccion_id, clase) if valid_id(deteccion_id) else None
+    if status is None:
+        raise HTTPException(status_code=404, detail="La imagen de esa detección ya no está disponible")
+    return JSONResponse(
+        status_code=200 if status['estado'] == 'lista' else 202,
+        content={**status, 'url': f"/api/explicaciones/{deteccion_id}"}
+    )
+
+@app.get("/api/explicaciones/{deteccion_id}")
+async def obtener_explicacion(deteccion_id: str):
+    """PNG con el mapa de calor superpuesto, o el estado si aún no está listo."""
+    status = explicaciones.status(deteccion_id) if valid_id(deteccion_id) else None
+    if status is None:
+        raise HTTPException(status_code=404, detail="No se ha solicitado la explicación de esa detección")
+    if status['estado'] == 'lista':
+        return FileResponse(explicaciones.path(deteccion_id), media_type='image/png')
+    return JSONResponse(status_code=202 if status['estado'] == 'pendiente' else 500, content=status)
+
 @app.get("/api/historial")
 async def obtener_historial(limite: int = 10):
     """Obtiene el historial de detecciones."""
@@ -286,6 +755,27 @@ async def obtener_historial(limite: int = 10):
         'detecciones': historial_detecciones[-limite:]
     }
 
+@app.get("/api/historial/exportar")
+async def exportar_historial(formato: str = 'parquet', desde: Optional[datetime] = None,
+                             hasta: Optional[datetime] = None):
+    """
+    Historial persistente en formato columnar, enviado por lotes.
+    
+    Args:
+        formato: 'parquet' o 'arrow' (Arrow IPC stream)
+        desde: Fecha ISO inicial (incluida)
+        hasta: Fecha ISO final (excluida)
+    """
+    if formato not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Formato desconocido; use uno de {sorted(FORMATS)}")
+    if importlib.util.find_spec('pyarrow') is None:
+        raise HTTPException(status_code=503, detail="La exportación requiere pyarrow (pip install pyarrow)")
+    return StreamingResponse(
+        export_chunks(formato, desde=desde, hasta=hasta),
+        media_type=FORMATS[formato],
+        headers={'Content-Disposition': f'attachment; filename="historial.{formato}"'}
+    )
+
 @app.get("/api/estadisticas")
 async def obtener_estadisticas():
     """Calcula estadísticas del historial."""
@@ -311,12 +801,38 @@ async def obtener_estadisticas():
         }
     }
 
+@app.get("/api/metricas")
+async def obtener_metricas():
+    """Métricas de cómputo del detector (frecuencia de TTA y de resultados reutilizados)."""
+    with detector.stats_lock:
+        stats = dict(detector.stats)
+    total = stats['inferencias']
+    return {
+        'inferencias': total,
+        'tta_activado': stats['tta_activado'],
+        'tasa_tta': round(stats['tta_activado'] / total, 4) if total else 0.0,
+        'umbral_confianza': detector.confidence_threshold,
+        'reutilizadas': stats['reutilizadas'],
+        'indice_reutilizacion': len(detector.similar) if detector.similar is not None else 0,
+        'umbral_hamming': REUSE_HAMMING_THRESHOLD
+    }
+
+@app.get("/api/modelos")
+async def listar_modelos():
+    """Bundles disponibles (solo manifiestos) y el que está sirviendo el detector."""
+    return {
+        'activo': detector.bundle.name if detector.bundle is not None else MODEL_PATH,
+        'clases': detector.classes,
+        'tipo': detector.kind,
+        'bundles': registry.describe()
+    }
+
 @app.get("/api/salud")
 async def verificar_salud():
     """Verifica el estado del servicio."""
     return {
         'estado': 'operativo',
-        'modelo_cargado': detector.model is not None,
+        'modelo_cargado': detector.model_loaded,
         'timestamp': datetime.now().isoformat()
     }
 
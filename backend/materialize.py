@@ -0,0 +1,137 @@
+# materialize.py - Materialización incremental de splits del dataset
+"""
+Crea árboles de dataset (por ejemplo dataset_binary/) a partir de un mapa
+destino -> origen usando hardlinks o reflinks cuando el sistema de archivos
+lo permite, y copias en paralelo como último recurso.
+
+Un manifiesto en el directorio destino recuerda qué origen tiene cada
+archivo, de modo que al repetir un split con la misma semilla solo se tocan
+los archivos cuya asignación cambió.
+
+Nota: un hardlink comparte contenido con el original; las herramientas que
+modifiquen imágenes deben escribir archivos nuevos, nunca editar en sitio.
+"""
+
+import os
+import json
+import shutil
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+
+from dataset_index import IMAGE_EXTENSIONS
+
+MANIFEST_FILENAME = '.materialize_manifest.json'
+FICLONE = 0x40049409  # ioctl de Linux para reflinks (btrfs, xfs)
+
+def _reflink(src: str, dst: str):
+    """Clona el archivo compartiendo bloques (copy-on-write)."""
+    try:
+        import fcntl
+    except ImportError as e:
+        raise OSError("reflink no soportado en esta plataforma") from e
+
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            os.unlink(dst)
+            raise
+
+def _place_file(src: str, dst: str) -> str:
+    """Coloca src en dst: hardlink, reflink o copia. Retorna el método usado."""
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    try:
+        os.link(src, dst)
+        return 'linked'
+    except OSError:
+        pass
+    try:
+        _reflink(src, dst)
+        return 'reflinked'
+    except OSError:
+        pass
+    shutil.copy2(src, dst)
+    return 'copied'
+
+def _source_signature(src: str) -> Dict:
+    st = os.stat(src)
+    return {'src': os.path.abspath(src), 'size': st.st_size, 'mtime': st.st_mtime}
+
+def materialize(assignments: Dict[str, str], dest_root, exclusive: bool = False,
+                workers: int = 8) -> Dict[str, int]:
+    """
+    Sincroniza dest_root con las asignaciones dadas.
+
+    Args:
+        assignments: Ruta relativa dentro de dest_root -> archivo de origen
+        dest_root: Directorio destino
+        exclusive: Si es True, elimina también las imágenes de dest_root que
+            no estén en las asignaciones (aunque no las haya creado esta función)
+        workers: Hilos para colocar archivos en paralelo
+
+    Returns:
+        Conteo de archivos por operación realizada.
+    """
+    dest_root = Path(dest_root)
+    dest_root.mkdir(parents=True, exist_ok=True)
+    manifest_path = dest_root / MANIFEST_FILENAME
+
+    manifest = {}
+    if manifest_path.exists():
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            manifest = {}
+
+    counts = {'linked': 0, 'reflinked': 0, 'copied': 0, 'unchanged': 0, 'removed': 0}
+
+    # Eliminar archivos que ya no corresponden
+    stale = set(manifest) - set(assignments)
+    if exclusive:
+        for path in dest_root.rglob('*'):
+            if path.is_file() and path.suffix.lower() in IMAGE_EXTENSIONS:
+                rel = path.relative_to(dest_root).as_posix()
+                if rel not in assignments:
+                    stale.add(rel)
+    for rel in stale:
+        path = dest_root / rel
+        if os.path.lexists(path):
+            path.unlink()
+            counts['removed'] += 1
+        manifest.pop(rel, None)
+
+    # Determinar qué archivos hay que (re)colocar
+    pending = []
+    new_manifest = {}
+    for rel, src in assignments.items():
+        signature = _source_signature(src)
+        new_manifest[rel] = signature
+        if manifest.get(rel) == signature and (dest_root / rel).exists():
+            counts['unchanged'] += 1
+        else:
+            pending.append((src, dest_root / rel))
+
+    for parent in {dst.parent for _, dst in pending}:
+        parent.mkdir(parents=True, exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for method in executor.map(lambda item: _place_file(str(item[0]), str(item[1])), pending):
+            counts[method] += 1
+
+    tmp_path = manifest_path.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(new_manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+    return counts
+
+def print_counts(counts: Dict[str, int]):
+    """Resumen de la materialización."""
+    print(f"🔗 Enlazados: {counts['linked'] + counts['reflinked']} | "
+          f"Copiados: {counts['copied']} | "
+          f"Sin cambios: {counts['unchanged']} | "
+          f"Eliminados: {counts['removed']}")
@@ -0,0 +1,293 @@
+# model_bundle.py - Paquete autodescriptivo del modelo
+"""
+Un único archivo `.bundle` (zip sin compresión) con todo lo necesario para
+servir un modelo sin deducir nada:
+
+    manifest.json      clases en orden de salida, tipo (binary/multiclass),
+                       preprocesamiento, umbrales, hash de los datos de
+                       entrenamiento y métricas/latencia medidas
+    model.json         arquitectura Keras (incluye Rescaling/Resizing)
+    weights/0000.npy   un array por peso, en el orden de model.weights
+
+El manifiesto se lee al abrir el bundle; la arquitectura y los pesos solo
+cuando se pide `bundle.model`. Leer .npy sin comprimir y asignarlos con
+set_weights es mucho más rápido que reconstruir un .h5 con load_model.
+
+Uso:
+    python model_bundle.py models/whitefly_detector.h5          # Convierte un modelo existente
+    python model_bundle.py models/binary_whitefly_detector.h5 --kind binary
+    python model_bundle.py --list                               # Bundles en models/
+"""
+
+import os
+import io
+import json
+import hashlib
+import zipfile
+import argparse
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+BUNDLE_FORMAT = 1
+BUNDLE_EXTENSION = '.bundle'
+MODELS_DIR = 'models'
+DEFAULT_THRESHOLDS = {
+    'tta_confidence': 0.7,   # Por debajo el servidor aplica test-time augmentation
+    'decision': 0.5          # Corte de la sigmoide en modelos binarios
+}
+
+def class_probabilities(outputs, kind: str) -> np.ndarray:
+    """Salida del modelo -> probabilidad por clase; la sigmoide binaria (clase 1) da dos columnas."""
+    outputs = np.asarray(outputs, dtype=np.float32)
+    if kind == 'binary':
+        p = outputs.reshape(len(outputs), -1)[:, :1]
+        return np.hstack([1 - p, p])
+    return outputs
+
+def decide(probs, kind: str, thresholds: Optional[Dict] = None) -> np.ndarray:
+    """
+    Índice de clase por fila de `probs`: en binarios, la clase 1 si su
+    probabilidad alcanza el umbral 'decision'; en multiclase, la más probable.
+    """
+    probs = np.atleast_2d(probs)
+    if kind == 'binary':
+        cut = (thresholds or {}).get('decision', DEFAULT_THRESHOLDS['decision'])
+        return (probs[:, 1] >= cut).astype(np.int64)
+    return np.argmax(probs, axis=-1)
+
+def dataset_hash(root: str = 'dataset', splits: Sequence[str] = ('train', 'val')) -> str:
+    """Huella del contenido de los splits usados para entrenar (rutas y SHA-1 de cada imagen)."""
+    from dataset_index import list_images
+    from prediction_cache import content_hashes
+
+    paths = sorted(
+        str(path)
+        for split in splits if os.path.isdir(os.path.join(root, split))
+        for clase in sorted(os.listdir(os.path.join(root, split)))
+        for path in list_images(os.path.join(root, split, clase))
+    )
+    digest = hashlib.sha1()
+    for path, sha1 in zip(paths, content_hashes(paths)):
+        digest.update(f"{os.path.relpath(path, root)}:{sha1}\n".encode())
+    return digest.hexdigest()
+
+def benchmark(model, results: Optional[Dict] = None, sample_path: Optional[str] = None,
+              parity_paths: Sequence[str] = ()) -> Dict:
+    """
+    Métricas de test (de evaluate_generator), latencia en CPU con una imagen
+    de muestra y paridad del preprocesamiento incluido sobre `parity_paths`.
+    """
+    bench = {}
+    if results:
+        bench['test'] = {k: float(results[k]) for k in
+                         ['accuracy', 'precision', 'recall', 'f1_score', 'auc'] if k in results}
+    if sample_path:
+        from compare_models import measure_latency
+        from evaluation import model_input_size
+        from model_config import accepts_uint8
+
+        candidate = {'model': model, 'img_size': model_input_size(model), 'uint8': accepts_uint8(model)}
+        measure_latency([candidate], sample_path)
+        bench['latency_mean_ms'] = candidate['latency_mean_ms']
+        bench['latency_p95_ms'] = candidate['latency_p95_ms']
+    if parity_paths:
+        from evaluation import PARITY_TOLERANCE, preprocessing_parity
+
+        bench['preprocessing_max_diff'] = preprocessing_parity(model, parity_paths)
+        if bench['preprocessing_max_diff'] > PARITY_TOLERANCE:
+            print(f"⚠️  El preprocesamiento incluido difiere del de entrenamiento "
+                  f"(máx. {bench['preprocessing_max_diff']:.4f} en probabilidad)")
+    bench['measured'] = datetime.now().isoformat()
+    return bench
+
+def save_bundle(model, path: str, classes: Sequence[str], kind: Optional[str] = None,
+                thresholds: Optional[Dict] = None, data_hash: Optional[str] = None,
+                benchmarks: Optional[Dict] = None, **extra) -> Dict:
+    """
+    Empaqueta el modelo. `classes` va en el orden de las salidas del modelo
+    (índices de class_indices); en binarios, classes[1] es la clase de la
+    sigmoide. Los modelos con entrada float se envuelven con el
+    preprocesamiento antes de guardarlos.
+    """
+    from model_config import ALPHA, with_preprocessing
+    from evaluation import model_input_size
+
+    model = with_preprocessing(model)
+    kind = kind or ('binary' if model.output_shape[-1] == 1 else 'multiclass')
+    manifest = {
+        'format': BUNDLE_FORMAT,
+        'kind': kind,
+        'classes': list(classes),
+        'preprocessing': {
+            'input_dtype': 'uint8',
+            'img_size': list(model_input_size(model)),
+            'color': 'RGB',
+            'rescale': 1. / 255,
+            'in_graph': True
+        },
+        'thresholds': {**DEFAULT_THRESHOLDS, **(thresholds or {})},
+        'data_hash': data_hash,
+        'benchmarks': benchmarks or {},
+        'alpha': ALPHA,
+        'created': datetime.now().isoformat(),
+        **extra
+    }
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_STORED) as zf:
+        zf.writestr('manifest.json', json.dumps(manifest, indent=4))
+        zf.writestr('model.json', model.to_json())
+        for i, weights in enumerate(model.get_weights()):
+            buffer = io.BytesIO()
+            np.save(buffer, weights, allow_pickle=False)
+            zf.writestr(f'weights/{i:04d}.npy', buffer.getvalue())
+    os.replace(tmp_path, path)
+    return manifest
+
+class ModelBundle:
+    """Bundle abierto: manifiesto en memoria y modelo cargado bajo demanda."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        with zipfile.ZipFile(path) as zf:
+            self.manifest = json.loads(zf.read('manifest.json'))
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(self.path)[:-len(BUNDLE_EXTENSION)]
+
+    @property
+    def kind(self) -> str:
+        return self.manifest['kind']
+
+    @property
+    def classes(self) -> List[str]:
+        return self.manifest['classes']
+
+    @property
+    def img_size(self):
+        return tuple(self.manifest['preprocessing']['img_size'])
+
+    @property
+    def thresholds(self) -> Dict:
+        return self.manifest['thresholds']
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    @property
+    def model(self):
+        """Arquitectura y pesos se leen la primera vez que se piden."""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._load()
+        return self._model
+
+    def _load(self):
+        from tensorflow import keras
+
+        with zipfile.ZipFile(self.path) as zf:
+            model = keras.models.model_from_json(zf.read('model.json').decode())
+            names = sorted(n for n in zf.namelist() if n.startswith('weights/'))
+            weights = []
+            for name in names:
+                with zf.open(name) as f:
+                    weights.append(np.lib.format.read_array(f, allow_pickle=False))
+        model.set_weights(weights)
+        return model
+
+    def probabilities(self, outputs) -> np.ndarray:
+        """Salida del modelo -> probabilidad por clase en el orden de `classes`."""
+        return class_probabilities(outputs, self.kind)
+
+    def decide(self, probs) -> np.ndarray:
+        """Índice de clase por fila con el umbral de decisión del manifiesto."""
+        return decide(probs, self.kind, self.thresholds)
+
+    def describe(self) -> Dict:
+        """Manifiesto más ruta, tamaño y si el modelo ya está en memoria."""
+        return {
+            'nombre': self.name,
+            'ruta': self.path,
+            'mb': round(os.path.getsize(self.path) / (1024 ** 2), 2),
+            'cargado': self.loaded,
+            **self.manifest
+        }
+
+class ModelRegistry:
+    """
+    Bundles disponibles en un directorio. Abrir un bundle solo lee su
+    manifiesto; cada modelo se carga una vez y se comparte entre hilos.
+    """
+
+    def __init__(self, models_dir: str = MODELS_DIR):
+        self.models_dir = models_dir
+        self._bundles: Dict[str, ModelBundle] = {}
+        self._lock = threading.Lock()
+
+    def names(self) -> List[str]:
+        if not os.path.isdir(self.models_dir):
+            return []
+        return sorted(
+            f[:-len(BUNDLE_EXTENSION)] for f in os.listdir(self.models_dir)
+            if f.endswith(BUNDLE_EXTENSION)
+        )
+
+    def get(self, name: str) -> ModelBundle:
+        """Bundle por nombre (sin extensión) o por ruta."""
+        path = name if name.endswith(BUNDLE_EXTENSION) else \
+            os.path.join(self.models_dir, name + BUNDLE_EXTENSION)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No existe el bundle {path}")
+        with self._lock:
+            # Si el archivo se reemplazó (reentrenamiento) se vuelve a abrir
+            bundle = self._bundles.get(path)
+            if bundle is None or bundle.mtime != os.path.getmtime(path):
+                bundle = self._bundles[path] = ModelBundle(path)
+            return bundle
+
+    def describe(self) -> List[Dict]:
+        return [self.get(name).describe() for name in self.names()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Convierte modelos Keras a bundles autodescriptivos")
+    parser.add_argument('model', nargs='?', help="Modelo .h5/.keras a convertir")
+    parser.add_argument('--output', help="Por defecto <modelo>.bundle")
+    parser.add_argument('--kind', choices=['binary', 'multiclass'], help="Por defecto según la salida")
+    parser.add_argument('--classes', nargs='+', help="Clases en orden de salida (por defecto alfabético)")
+    parser.add_argument('--dataset', default='dataset', help="Dataset para el hash de entrenamiento")
+    parser.add_argument('--list', action='store_true', help="Lista los bundles de models/")
+    args = parser.parse_args()
+
+    if args.list or not args.model:
+        for info in ModelRegistry().describe():
+            print(f"📦 {info['nombre']}: {info['kind']}, {info['classes']}, "
+                  f"entrada {info['preprocessing']['img_size']}, {info['mb']} MB")
+        return
+
+    from tensorflow import keras
+    from balanced_sampler import BINARY_CLASS_MAP
+    from dataset_index import CLASSES
+
+    model = keras.models.load_model(args.model, compile=False)
+    kind = args.kind or ('binary' if model.output_shape[-1] == 1 else 'multiclass')
+    # Mismo orden que class_indices de los generadores (alfabético)
+    classes = args.classes or sorted(set(BINARY_CLASS_MAP.values()) if kind == 'binary' else CLASSES)
+    output = args.output or os.path.splitext(args.model)[0] + BUNDLE_EXTENSION
+
+    manifest = save_bundle(model, output, classes, kind, data_hash=dataset_hash(args.dataset),
+                           source=os.path.basename(args.model))
+    print(f"💾 {output}: {manifest['kind']}, clases {manifest['classes']}, "
+          f"entrada {manifest['preprocessing']['img_size']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+# model_config.py - Resolución de entrada y ancho del backbone
+"""
+Configuración única de arquitectura para entrenamiento y servidor: tamaño
+de entrada y `alpha` (multiplicador de ancho) de MobileNetV2.
+
+Los scripts de entrenamiento la leen de model_arch.json si existe (no viene
+en el repositorio; otra ruta con MODEL_ARCH), o de las variables IMG_SIZE y
+MOBILENET_ALPHA (p.ej. IMG_SIZE=160 MOBILENET_ALPHA=0.5), con 224 px y
+alpha 1.0 por defecto. La registran junto al modelo en
+models/model_config.json, que es lo que lee el servidor al arrancar.
+
+Los modelos exportados incluyen el preprocesamiento en el grafo
+(`with_preprocessing`): reciben uint8 de cualquier tamaño y hacen
+Rescaling(1/255) y Resizing dentro del modelo.
+"""
+
+import os
+import json
+from typing import Dict, List, Optional
+
+ARCH_PATH = os.environ.get('MODEL_ARCH', 'model_arch.json')
+MODEL_CONFIG_PATH = 'models/model_config.json'
+
+DEFAULT_ARCH = {
+    'img_size': [224, 224],   # (alto, ancho)
+    'alpha': 1.0              # 0.35, 0.5, 0.75, 1.0, 1.3 o 1.4 tienen pesos de ImageNet
+}
+
+def load_arch(path: str = ARCH_PATH) -> Dict:
+    """Arquitectura de entrenamiento: archivo, variables de entorno y valores por defecto."""
+    arch = dict(DEFAULT_ARCH)
+    if os.path.exists(path):
+        with open(path) as f:
+            arch.update(json.load(f))
+    if os.environ.get('IMG_SIZE'):
+        size = [int(s) for s in os.environ['IMG_SIZE'].split(',')]
+        arch['img_size'] = size * 2 if len(size) == 1 else size
+    if os.environ.get('MOBILENET_ALPHA'):
+        arch['alpha'] = float(os.environ['MOBILENET_ALPHA'])
+    arch['img_size'] = tuple(arch['img_size'])
+    return arch
+
+_ARCH = load_arch()
+IMG_SIZE = _ARCH['img_size']
+ALPHA = _ARCH['alpha']
+
+def build_backbone(img_size=None, alpha: Optional[float] = None, weights: str = 'imagenet'):
+    """MobileNetV2 sin la capa de clasificación con el tamaño y alpha configurados."""
+    from tensorflow import keras
+
+    img_size = tuple(img_size or IMG_SIZE)
+    return keras.applications.MobileNetV2(
+        input_shape=(*img_size, 3),
+        alpha=alpha if alpha is not None else ALPHA,
+        include_top=False,
+        weights=weights
+    )
+
+def read_model_config(path: str = MODEL_CONFIG_PATH) -> Dict:
+    """Configuración registrada del modelo servido (con valores por defecto si falta)."""
+    config = {'img_size': list(DEFAULT_ARCH['img_size']), 'alpha': DEFAULT_ARCH['alpha']}
+    if os.path.exists(path):
+        with open(path) as f:
+            config.update(json.load(f))
+    config['img_size'] = tuple(config['img_size'])
+    return config
+
+def write_model_config(classes: List[str], path: str = MODEL_CONFIG_PATH, **extra) -> Dict:
+    """Registra tamaño de entrada, alpha y clases del modelo entrenado."""
+    config = {'img_size': list(IMG_SIZE), 'alpha': ALPHA, 'classes': list(classes), **extra}
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(config, f, indent=4)
+    return config
+
+def accepts_uint8(model) -> bool:
+    """Indica si el modelo ya incluye el preprocesamiento (entrada uint8)."""
+    from tensorflow import keras
+    return keras.backend.standardize_dtype(model.inputs[0].dtype) == 'uint8'
+
+def with_preprocessing(model, img_size=None):
+    """
+    Envuelve un modelo que espera float en [0, 1] con el tamaño fijo de
+    entrenamiento para que reciba imágenes uint8 de cualquier tamaño.
+    Los modelos que ya reciben uint8 se retornan sin cambios.
+    """
+    from tensorflow import keras
+    if accepts_uint8(model):
+        return model
+
+    img_size = tuple(img_size or model.input_shape[1:3])
+    inputs = keras.Input(shape=(None, None, 3), dtype='uint8', name='image_uint8')
+    # Rescaling convierte a float32 y conmuta con el redimensionado. Vecino más
+    # cercano, como load_image_array y make_image_dataset en entrenamiento
+    x = keras.layers.Rescaling(1./255, dtype='float32', name='rescaling')(inputs)
+    x = keras.layers.Resizing(*img_size, interpolation='nearest', dtype='float32', name='resizing')(x)
+    return keras.Model(inputs, model(x), name=f"{model.name}_uint8")
+
+def strip_preprocessing(model):
+    """Modelo interno (entrada float) de un modelo envuelto, p.ej. para fine-tuning."""
+    return model.layers[-1] if accepts_uint8(model) else model
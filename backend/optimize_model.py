@@ -0,0 +1,311 @@
+# optimize_model.py - Poda por magnitud y clustering de pesos del modelo servido
+"""
+Reduce el modelo para equipos de borde en dos etapas de fine-tuning sobre
+los datos de entrenamiento:
+
+    1. Poda por magnitud: la fracción de pesos en cero sube siguiendo un
+       calendario polinomial hasta `--sparsity`; las máscaras se reaplican
+       después de cada lote para que el optimizador no reviva pesos podados.
+    2. Clustering: cada kernel se cuantiza a `--clusters` valores (k-means
+       1-D, conservando los ceros) y se ajustan los centroides compartidos.
+
+El resultado es un modelo Keras normal (sin capas envolventes), cargable
+por WhiteflyDetector. Se reportan tamaño, tamaño comprimido, latencia en
+CPU y métricas en test frente al modelo base.
+
+Uso:
+    python optimize_model.py                                   # models/whitefly_detector.h5
+    python optimize_model.py --model models/binary_whitefly_detector.h5 --sparsity 0.6
+    python optimize_model.py --scope head --clusters 32
+
+Nota: tensorflow-model-optimization no es compatible con Keras 3, por eso la
+poda y el clustering se implementan aquí como callbacks.
+"""
+
+from training_profile import apply_training_profile
+import os
+import gzip
+import json
+import argparse
+from datetime import datetime
+from typing import Dict, List
+
+import numpy as np
+from tensorflow import keras
+
+from balanced_sampler import BalancedImageSampler, BINARY_CLASS_MAP
+from compare_models import measure_latency
+from evaluation import evaluate_generator, model_input_size
+from model_config import accepts_uint8, strip_preprocessing, with_preprocessing
+
+DATA_DIR = 'dataset'
+BATCH_SIZE = 32
+FINE_TUNE_LR = 1e-4
+
+def _iter_layers(model):
+    """Todas las capas, entrando en submodelos (p.ej. MobileNetV2 dentro de Sequential)."""
+    for layer in model.layers:
+        if hasattr(layer, 'layers'):
+            yield from _iter_layers(layer)
+        else:
+            yield layer
+
+def prunable_kernels(model, scope: str = 'all') -> List:
+    """
+    Kernels a podar/agrupar: Dense y Conv2D (no depthwise, que tiene muy
+    pocos pesos). La capa de salida se deja intacta.
+    """
+    output_layer = model.layers[-1]
+    kernels = []
+    for layer in _iter_layers(model):
+        if layer is output_layer or isinstance(layer, keras.layers.DepthwiseConv2D):
+            continue
+        if isinstance(layer, keras.layers.Dense) or (
+                scope == 'all' and isinstance(layer, keras.layers.Conv2D)):
+            kernels.append(layer.kernel)
+    return kernels
+
+def sparsity(kernels) -> float:
+    total = sum(int(np.prod(k.shape)) for k in kernels)
+    zeros = sum(int(np.sum(keras.ops.convert_to_numpy(k) == 0)) for k in kernels)
+    return zeros / total if total else 0.0
+
+class PolynomialSparsity:
+    """s(t) = final + (inicial - final) * (1 - t)^power entre begin_step y end_step."""
+
+    def __init__(self, initial: float, final: float, begin_step: int, end_step: int, power: int = 3):
+        self.initial = initial
+        self.final = final
+        self.begin_step = begin_step
+        self.end_step = end_step
+        self.power = power
+
+    def __call__(self, step: int) -> float:
+        progress = np.clip((step - self.begin_step) / max(1, self.end_step - self.begin_step), 0, 1)
+        return self.final + (self.initial - self.final) * (1 - progress) ** self.power
+
+class MagnitudePruning(keras.callbacks.Callback):
+    """
+    Poda por magnitud por capa: cada `frequency` pasos recalcula la máscara
+    con el umbral que deja en cero la fracción indicada por el calendario;
+    después de cada lote reaplica la máscara.
+    """
+
+    def __init__(self, kernels, schedule: PolynomialSparsity, frequency: int = 100):
+        super().__init__()
+        self.kernels = kernels
+        self.schedule = schedule
+        self.frequency = frequency
+        self.masks = [np.ones(k.shape, dtype=bool) for k in kernels]
+        self.step = 0
+
+    def _update_masks(self):
+        target = self.schedule(self.step)
+        for i, kernel in enumerate(self.kernels):
+            magnitudes = np.abs(keras.ops.convert_to_numpy(kernel))
+            threshold = np.quantile(magnitudes, target) if target > 0 else -1.0
+            self.masks[i] = magnitudes > threshold
+
+    def _apply_masks(self):
+        for kernel, mask in zip(self.kernels, self.masks):
+            kernel.assign(keras.ops.convert_to_numpy(kernel) * mask)
+
+    def on_train_batch_end(self, batch, logs=None):
+        if self.step % self.frequency == 0 or self.step == self.schedule.end_step:
+            self._update_masks()
+        self._apply_masks()
+        self.step += 1
+
+    def on_epoch_end(self, epoch, logs=None):
+        print(f"\n✂️  Sparsity: {sparsity(self.kernels):.1%} (objetivo {self.schedule(self.step):.1%})")
+
+    def on_train_end(self, logs=None):
+        self._update_masks()
+        self._apply_masks()
+
+def kmeans_1d(values: np.ndarray, k: int, iterations: int = 30):
+    """K-means en una dimensión con centroides iniciales equiespaciados."""
+    centroids = np.linspace(values.min(), values.max(), k)
+    for _ in range(iterations):
+        labels = np.searchsorted((centroids[:-1] + centroids[1:]) / 2, values)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.bincount(labels, weights=values, minlength=k)
+        updated = np.where(counts > 0, sums / np.maximum(counts, 1), centroids)
+        if np.allclose(updated, centroids):
+            break
+        centroids = updated
+    labels = np.searchsorted((centroids[:-1] + centroids[1:]) / 2, values)
+    return centroids, labels
+
+class ClusterSharing(keras.callbacks.Callback):
+    """
+    Agrupa cada kernel en `clusters` valores (los ceros de la poda se
+    conservan) y, durante el fine-tuning, tras cada lote reemplaza los pesos
+    de un cluster por su media: equivale a entrenar centroides compartidos.
+    """
+
+    def __init__(self, kernels, clusters: int = 16):
+        super().__init__()
+        self.kernels = kernels
+        self.clusters = clusters
+        self.assignments = []
+        for kernel in kernels:
+            weights = keras.ops.convert_to_numpy(kernel).astype(np.float64)
+            nonzero = weights != 0
+            k = min(clusters, max(1, int(nonzero.sum())))
+            _, labels = kmeans_1d(weights[nonzero], k) if nonzero.any() else (None, None)
+            self.assignments.append((nonzero, labels, k))
+        self._share()
+
+    def _share(self):
+        for kernel, (nonzero, labels, k) in zip(self.kernels, self.assignments):
+            if labels is None:
+                continue
+            weights = keras.ops.convert_to_numpy(kernel).astype(np.float64)
+            values = weights[nonzero]
+            means = np.bincount(labels, weights=values, minlength=k) / \
+                np.maximum(np.bincount(labels, minlength=k), 1)
+            shared = np.zeros_like(weights)
+            shared[nonzero] = means[labels]
+            kernel.assign(shared.astype(keras.backend.standardize_dtype(kernel.dtype)))
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._share()
+
+    def on_train_end(self, logs=None):
+        self._share()
+
+def unique_values(kernels) -> int:
+    """Máximo de valores distintos por kernel (comprobación del clustering)."""
+    return max(len(np.unique(keras.ops.convert_to_numpy(k))) for k in kernels)
+
+def make_samplers(model):
+    """Sampler de entrenamiento (balanceado, con augmentation), validación y test."""
+    binary = model.output_shape[-1] == 1
+    common = dict(
+        class_map=BINARY_CLASS_MAP if binary else None,
+        img_size=model_input_size(model),
+        batch_size=BATCH_SIZE,
+        class_mode='binary' if binary else 'categorical',
+        workers=4
+    )
+    train_gen = BalancedImageSampler(
+        DATA_DIR, 'train',
+        image_data_generator=keras.preprocessing.image.ImageDataGenerator(
+            rescale=1./255, rotation_range=30, width_shift_range=0.2, height_shift_range=0.2,
+            horizontal_flip=True, zoom_range=0.2, brightness_range=[0.8, 1.2], fill_mode='nearest'
+        ),
+        **common
+    )
+    val_gen = BalancedImageSampler(DATA_DIR, 'val', balanced=False, shuffle=False, **common)
+    test_gen = BalancedImageSampler(DATA_DIR, 'test', balanced=False, shuffle=False, **common)
+    return train_gen, val_gen, test_gen
+
+def compile_for_fine_tune(model, profile: Dict):
+    binary = model.output_shape[-1] == 1
+    model.compile(
+        optimizer=keras.optimizers.Adam(learning_rate=FINE_TUNE_LR),
+        loss='binary_crossentropy' if binary else 'categorical_crossentropy',
+        metrics=['accuracy'],
+        jit_compile=profile['jit_compile']
+    )
+
+def measure(name: str, path: str, test_gen, sample_path: str) -> Dict:
+    """Métricas en test, tamaño en disco, tamaño comprimido y latencia de un modelo guardado."""
+    model = keras.models.load_model(path, compile=False)
+    # Los samplers entregan float en [0, 1]: se evalúa el modelo sin preprocesamiento
+    results = evaluate_generator(strip_preprocessing(model), test_gen, verbose=0)
+    candidate = {'model': model, 'img_size': model_input_size(model), 'uint8': accepts_uint8(model)}
+    measure_latency([candidate], sample_path)
+
+    with open(path, 'rb') as f:
+        gzip_mb = len(gzip.compress(f.read(), compresslevel=9)) / (1024 ** 2)
+
+    return {
+        'name': name,
+        'path': path,
+        'accuracy': results['accuracy'],
+        'f1_score': results['f1_score'],
+        'auc': results['auc'],
+        'file_mb': os.path.getsize(path) / (1024 ** 2),
+        'gzip_mb': gzip_mb,
+        'latency_mean_ms': candidate['latency_mean_ms'],
+        'latency_p95_ms': candidate['latency_p95_ms']
+    }
+
+def optimize(model_path: str, output_path: str, target_sparsity: float = 0.5, clusters: int = 16,
+             prune_epochs: int = 4, cluster_epochs: int = 2, scope: str = 'all', profile=None):
+    profile = profile or {'jit_compile': False}
+    # El fine-tuning se hace sobre el modelo interno (entrada float de los samplers)
+    model = strip_preprocessing(keras.models.load_model(model_path, compile=False))
+    train_gen, val_gen, test_gen = make_samplers(model)
+    kernels = prunable_kernels(model, scope)
+    print(f"🎯 {len(kernels)} kernels a optimizar "
+          f"({sum(int(np.prod(k.shape)) for k in kernels):,} pesos)")
+
+    # 1. Poda: el objetivo se alcanza a 3/4 del fine-tuning y el resto recupera precisión
+    steps = len(train_gen) * prune_epochs
+    schedule = PolynomialSparsity(0.0, target_sparsity, begin_step=0, end_step=int(steps * 0.75))
+    compile_for_fine_tune(model, profile)
+    print(f"\n✂️  PODA hasta {target_sparsity:.0%} en {prune_epochs} épocas")
+    model.fit(train_gen, epochs=prune_epochs, validation_data=val_gen, verbose=1,
+              callbacks=[MagnitudePruning(kernels, schedule, frequency=max(1, len(train_gen) // 4))])
+
+    # 2. Clustering con centroides compartidos (los pesos podados siguen en cero)
+    print(f"\n🧩 CLUSTERING a {clusters} valores por kernel ({cluster_epochs} épocas)")
+    sharing = ClusterSharing(kernels, clusters)
+    compile_for_fine_tune(model, profile)
+    model.fit(train_gen, epochs=cluster_epochs, validation_data=val_gen, verbose=1,
+              callbacks=[sharing])
+
+    print(f"\n📉 Sparsity final: {sparsity(kernels):.1%} | "
+          f"valores distintos por kernel: ≤ {unique_values(kernels)}")
+
+    # Modelo Keras sin estado de entrenamiento y con el preprocesamiento incluido
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with_preprocessing(model).save(output_path, include_optimizer=False)
+    print(f"💾 Modelo optimizado: {output_path}")
+
+    sample = test_gen.filepaths[0]
+    report = [
+        measure('base', model_path, test_gen, sample),
+        measure('podado + clustering', output_path, test_gen, sample)
+    ]
+    return report
+
+def print_report(report: List[Dict]):
+    print(f"\n{'Modelo':22} {'Acc':>7} {'F1':>7} {'AUC':>7} {'MB':>7} {'gzip MB':>8} {'ms':>7} {'p95':>7}")
+    for r in report:
+        print(f"{r['name']:22} {r['accuracy']:7.4f} {r['f1_score']:7.4f} {r['auc']:7.4f} "
+              f"{r['file_mb']:7.1f} {r['gzip_mb']:8.1f} {r['latency_mean_ms']:7.1f} {r['latency_p95_ms']:7.1f}")
+    print("\nEl archivo guarda pesos densos: la reducción se ve en el tamaño comprimido (gzip MB).")
+    print("La latencia solo baja con un runtime que aproveche pesos dispersos o agrupados.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Poda y clustering de pesos del modelo servido")
+    parser.add_argument('--model', default='models/whitefly_detector.h5')
+    parser.add_argument('--output', default=None, help="Por defecto <modelo>_optimized.h5")
+    parser.add_argument('--sparsity', type=float, default=0.5)
+    parser.add_argument('--clusters', type=int, default=16)
+    parser.add_argument('--prune-epochs', type=int, default=4)
+    parser.add_argument('--cluster-epochs', type=int, default=2)
+    parser.add_argument('--scope', choices=['all', 'head'], default='all',
+                        help="head = solo capas densas; all = también convoluciones 1x1 del backbone")
+    args = parser.parse_args()
+
+    profile = apply_training_profile()
+    output = args.output or args.model.rsplit('.', 1)[0] + '_optimized.h5'
+
+    report = optimize(args.model, output, args.sparsity, args.clusters,
+                      args.prune_epochs, args.cluster_epochs, args.scope, profile)
+    print_report(report)
+
+    os.makedirs('logs', exist_ok=True)
+    path = f"logs/optimization_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(path, 'w') as f:
+        json.dump({'args': vars(args), 'results': report}, f, indent=4)
+    print(f"\n💾 Reporte guardado en {path}")
+    print(f"   Para servirlo: copiar {output} a models/whitefly_detector.h5")
+
+if __name__ == "__main__":
+    main()
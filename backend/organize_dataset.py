@@ -14,10 +14,11 @@ El script:
 """
 
 import os
-import shutil
 import random
 from pathlib import Path
 from collections import defaultdict
+from dataset_index import list_images
+from materialize import materialize, print_counts
 
 # Configuración
 SOURCE_DIR = "train/images"
@@ -118,7 +119,7 @@ def organize_images():
         return
     
     # Obtener todas las imágenes
-    image_files = list(source_path.glob("*.jpg")) + list(source_path.glob("*.jpeg")) + list(source_path.glob("*.png"))
+    image_files = list_images(source_path)
     
     if not image_files:
         print(f"❌ No se encontraron imágenes en {SOURCE_DIR}")
@@ -150,6 +151,7 @@ def organize_images():
             categorized['infestacion_leve'] = categorized['infestacion_leve'][50:]
     
     # Dividir en train/val/test para cada categoría
+    assignments = {}
     for category, images in categorized.items():
         if not images:
             continue
@@ -173,16 +175,13 @@ def organize_images():
         ]
         
         for split_name, split_images in splits_data:
-            dest_dir = Path(DEST_BASE) / split_name / category
-            
             for img_path in split_images:
-                dest_file = dest_dir / img_path.name
-                try:
-                    shutil.copy2(img_path, dest_file)
-                except Exception as e:
-                    print(f"❌ Error copiando {img_path}: {e}")
+                assignments[f"{split_name}/{category}/{img_path.name}"] = str(img_path)
             
             print(f"✅ {split_name}/{category}: {len(split_images)} imágenes")
+    
+    # Enlazar (hardlink/reflink) o copiar en paralelo; solo lo que cambió
+    print_counts(materialize(assignments, DEST_BASE))
 
 def validate_organization():
     """Valida que la organización sea correcta."""
@@ -0,0 +1,61 @@
+# perceptual_index.py - Índice de imágenes recientes por hash perceptual
+"""
+Guarda el dHash de 64 bits (el mismo de dedupe_dataset.py) de las últimas
+imágenes analizadas junto con su resultado. Una imagen casi idéntica a una
+reciente (cámara fija, varias fotos de la misma planta) se reconoce por
+distancia de Hamming y reutiliza el resultado sin pasar por la CNN.
+
+Los hashes viven en un array uint64 circular: la búsqueda es un XOR contra
+todo el array y un conteo de bits vectorizado (np.bitwise_count), sin
+recorrer entradas en Python.
+"""
+
+import io
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from dedupe_dataset import dhash
+
+def image_dhash(image_bytes: bytes) -> int:
+    """dHash de una imagen codificada (JPEG se decodifica a baja resolución)."""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        return dhash(image)
+
+class PerceptualIndex:
+    """
+    Índice acotado a `capacity` entradas; al llenarse se reemplazan las
+    más antiguas. Seguro entre hilos.
+    """
+
+    def __init__(self, capacity: int = 2048):
+        self.capacity = capacity
+        self._hashes = np.zeros(capacity, dtype=np.uint64)
+        self._results = [None] * capacity
+        self._size = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def lookup(self, image_hash: int, max_distance: int) -> Optional[Tuple[Dict, int]]:
+        """Resultado más cercano y su distancia, si está a max_distance bits o menos."""
+        with self._lock:
+            if self._size == 0:
+                return None
+            distances = np.bitwise_count(self._hashes[:self._size] ^ np.uint64(image_hash))
+            best = int(np.argmin(distances))
+            distance = int(distances[best])
+            if distance > max_distance:
+                return None
+            return self._results[best], distance
+
+    def add(self, image_hash: int, result: Dict):
+        with self._lock:
+            self._hashes[self._next] = image_hash
+            self._results[self._next] = result
+            self._next = (self._next + 1) % self.capacity
+            self._size = min(self._size + 1, self.capacity)
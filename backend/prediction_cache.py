@@ -0,0 +1,95 @@
+# prediction_cache.py - Caché de predicciones por modelo e imagen
+"""
+Guarda las probabilidades que un modelo asigna a cada imagen, indexadas por
+el hash del archivo del modelo y el hash del contenido de la imagen. Al
+reanalizar solo se predicen los pares que faltan; si nada cambió el reporte
+se regenera sin cargar el modelo.
+
+Cada modelo tiene un archivo cache/predictions/<hash_modelo>.npz con dos
+columnas: `image_hashes` (SHA-1 binario, uint8 de 20 columnas) y `probs` (float32).
+"""
+
+import os
+import hashlib
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Sequence
+
+import numpy as np
+
+from dataset_index import FileStatCache
+
+CACHE_DIR = 'cache/predictions'
+IMAGE_HASH_INDEX = 'cache/image_hashes.json'
+
+def file_sha1(path, chunk_size: int = 1 << 20) -> str:
+    """SHA-1 de un archivo leído por bloques."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def content_hashes(paths: Sequence[str], index_path: str = IMAGE_HASH_INDEX,
+                   workers: int = 8) -> List[str]:
+    """SHA-1 de cada imagen; solo se recalculan las nuevas o modificadas."""
+    index = FileStatCache(index_path)
+    pending = [p for p in paths if index.get(p) is None]
+    if pending:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for path, sha1 in zip(pending, executor.map(file_sha1, pending)):
+                index.put(path, {'sha1': sha1})
+        index.save()
+    return [index.get(p)['sha1'] for p in paths]
+
+class PredictionCache:
+    """Probabilidades por imagen para un archivo de modelo concreto."""
+
+    def __init__(self, model_path: str, cache_dir: str = CACHE_DIR):
+        self.model_hash = file_sha1(model_path)
+        self.path = Path(cache_dir) / f"{self.model_hash}.npz"
+        self._probs = {}
+
+        if self.path.exists():
+            data = np.load(self.path)
+            for image_hash, probs in zip(data['image_hashes'], data['probs']):
+                self._probs[image_hash.tobytes()] = probs
+
+    def __len__(self):
+        return len(self._probs)
+
+    def get_or_compute(self, filepaths: Sequence[str],
+                       compute: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        Retorna las probabilidades de todas las imágenes, llamando a
+        `compute(rutas)` solo con las que no están en caché.
+        """
+        keys = [bytes.fromhex(h) for h in content_hashes(filepaths)]
+        missing = [i for i, key in enumerate(keys) if key not in self._probs]
+
+        if missing:
+            # Una sola predicción por contenido, aunque haya archivos repetidos
+            unique = {}
+            for i in missing:
+                unique.setdefault(keys[i], filepaths[i])
+            print(f"🧮 Prediciendo {len(unique)} imágenes nuevas "
+                  f"({len(filepaths) - len(missing)} en caché)")
+            probs = np.asarray(compute(list(unique.values())), dtype=np.float32)
+            for key, p in zip(unique, probs):
+                self._probs[key] = p
+            self.save()
+        else:
+            print(f"⚡ {len(filepaths)} predicciones tomadas de la caché")
+
+        return np.stack([self._probs[key] for key in keys]) if keys else np.zeros((0, 1), np.float32)
+
+    def save(self):
+        """Escritura atómica del archivo columnar."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.stem + '.tmp.npz')
+        np.savez(
+            tmp_path,
+            image_hashes=np.frombuffer(b''.join(self._probs), dtype=np.uint8).reshape(-1, 20),
+            probs=np.stack(list(self._probs.values()))
+        )
+        os.replace(tmp_path, self.path)
@@ -1,35 +1,38 @@
 import os
 import numpy as np
+from training_profile import apply_training_profile
 import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
-from sklearn.metrics import classification_report, confusion_matrix
+from model_config import IMG_SIZE, build_backbone, with_preprocessing
+from evaluation import evaluate_generator
+from training_callbacks import ThroughputProfiler
 import matplotlib.pyplot as plt
 
 # Configuración
-IMG_SIZE = (224, 224)
+# IMG_SIZE y el alpha de MobileNetV2 vienen de model_config (model_arch.json opcional
+# o IMG_SIZE/MOBILENET_ALPHA; por defecto 224 px y alpha 1.0)
 BATCH_SIZE = 16
 EPOCHS = 20
 
 def create_simple_model():
     """Crear un modelo más simple y robusto"""
-    base_model = tf.keras.applications.MobileNetV2(
-        input_shape=(*IMG_SIZE, 3),
-        include_top=False,
-        weights='imagenet'
-    )
+    base_model = build_backbone()
     base_model.trainable = False  # Congelar el modelo base
     
     model = tf.keras.Sequential([
         base_model,
         tf.keras.layers.GlobalAveragePooling2D(),
         tf.keras.layers.Dropout(0.3),
-        tf.keras.layers.Dense(3, activation='softmax')  # 3 clases
+        tf.keras.layers.Dense(3, activation='softmax', dtype='float32')  # 3 clases
     ])
     
     return model
 
 def main():
+    # Aplicar perfil de rendimiento (hilos, XLA, precisión mixta)
+    profile = apply_training_profile()
+    
     print("🔄 Creando modelo simple...")
     
     # Crear generadores más simples
@@ -68,7 +71,8 @@ def main():
     model.compile(
         optimizer='adam',
         loss='categorical_crossentropy',
-        metrics=['accuracy']
+        metrics=['accuracy'],
+        jit_compile=profile['jit_compile']
     )
     
     # Entrenar SIN class_weight primero
@@ -77,11 +81,18 @@ def main():
         train_generator,
         epochs=EPOCHS,
         validation_data=val_generator,
+        callbacks=[
+            ThroughputProfiler(
+                batch_size=BATCH_SIZE,
+                log_dir='logs/simple',
+                profile_steps=profile.get('profile_steps')
+            )
+        ],
         verbose=1
     )
     
-    # Guardar modelo
-    model.save('models/simple_whitefly_detector.h5')
+    # Guardar modelo (con el preprocesamiento incluido: recibe uint8)
+    with_preprocessing(model).save('models/simple_whitefly_detector.h5')
     print("✅ Modelo guardado como simple_whitefly_detector.h5")
     
     # Evaluar en test set
@@ -93,34 +104,30 @@ def main():
         shuffle=False
     )
     
-    # Predicciones
-    predictions = model.predict(test_generator)
-    predicted_classes = np.argmax(predictions, axis=1)
-    true_classes = test_generator.classes
+    # Predicciones y métricas en una sola pasada
+    results = evaluate_generator(model, test_generator)
+    class_names = list(test_generator.class_indices.keys())
     
     # Matriz de confusión
-    cm = confusion_matrix(true_classes, predicted_classes)
     print("\n📊 Matriz de Confusión:")
-    print(cm)
+    print(results['confusion_matrix'])
     
     # Reporte de clasificación
-    class_names = list(test_generator.class_indices.keys())
     print(f"\n📊 Clases: {class_names}")
     print("\n📈 Reporte de Clasificación:")
-    print(classification_report(true_classes, predicted_classes, target_names=class_names))
+    print(results['classification_report'])
     
     # Probar predicción individual
     print("\n🧪 Probando predicción individual...")
     test_image_path = 'dataset/test/infestacion_leve/2014-09-16-13-11-07-004_9307_IJFR_jpg.rf.97a69b9f5ea4b474eb17fec117d0b781.jpg'
     
     if os.path.exists(test_image_path):
-        # Cargar y procesar imagen
+        # Cargar imagen: el modelo guardado escala los píxeles uint8
         img = tf.keras.preprocessing.image.load_img(test_image_path, target_size=IMG_SIZE)
-        img_array = tf.keras.preprocessing.image.img_to_array(img)
-        img_array = np.expand_dims(img_array, axis=0) / 255.0
+        img_array = np.asarray(img)[None]
         
         # Predicción
-        pred = model.predict(img_array)
+        pred = with_preprocessing(model).predict_on_batch(img_array)
         predicted_class = np.argmax(pred[0])
         confidence = pred[0][predicted_class]
         
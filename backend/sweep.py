@@ -0,0 +1,284 @@
+# sweep.py - Búsqueda de hiperparámetros en paralelo con successive halving
+"""
+Entrena muchas configuraciones a la vez, cada una en su propio proceso con
+un número acotado de hilos, y descarta las peores en cada ronda
+(successive halving): todas entrenan `min_epochs`, pasa el mejor 1/eta,
+que entrena hasta min_epochs·eta, y así hasta `max_epochs`.
+
+Cada ronda continúa el modelo guardado en la anterior (no se reentrena desde
+cero). El ranking se escribe en sweeps/<nombre>/leaderboard.json.
+
+Uso:
+    python sweep.py                                    # Modelo binario, valores por defecto
+    python sweep.py --kind multiclass --trials 27 --parallel 4
+    python sweep.py --metric val_accuracy --min-epochs 2 --max-epochs 18 --eta 3
+"""
+
+import os
+import sys
+import json
+import random
+import hashlib
+import argparse
+import itertools
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List
+
+SWEEP_DIR = 'sweeps'
+
+# Espacio de búsqueda (valores actuales de los scripts incluidos)
+SEARCH_SPACE = {
+    'binary': {
+        'learning_rate': [1e-4, 3e-4, 1e-3],
+        'dropout': [0.3, 0.4, 0.5],
+        'unfrozen_layers': [10, 20, 30, 40],
+        'dense_units': [[128], [256, 128], [512, 256, 128]],
+        'class_weights': [None, {'con_plaga': 1.5, 'sin_plaga': 1.0}]
+    },
+    'multiclass': {
+        'learning_rate': [1e-4, 3e-4, 1e-3],
+        'dropout': [0.3, 0.4, 0.5],
+        'unfrozen_layers': [10, 20, 30, 40],
+        'dense_units': [[256, 128], [512, 256, 128]],
+        'class_weights': [None, {'infestacion_severa': 2.0}]
+    }
+}
+
+def sample_configs(kind: str, trials: int, seed: int = 42) -> List[Dict]:
+    """Muestra `trials` combinaciones distintas del espacio de búsqueda."""
+    space = SEARCH_SPACE[kind]
+    grid = [dict(zip(space, values)) for values in itertools.product(*space.values())]
+    random.Random(seed).shuffle(grid)
+    return grid[:trials]
+
+def trial_id(config: Dict) -> str:
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:10]
+
+def _run_trial(spec: Dict) -> Dict:
+    """
+    Entrena una configuración hasta spec['epochs'] épocas (proceso hijo).
+    Continúa desde el modelo guardado si la ronda anterior lo dejó.
+    """
+    from training_profile import apply_training_profile
+    profile = apply_training_profile(verbose=False)
+
+    from tensorflow import keras
+    from balanced_sampler import BalancedImageSampler, BINARY_CLASS_MAP
+
+    config = spec['config']
+    binary = spec['kind'] == 'binary'
+    trial_dir = spec['trial_dir']
+    model_path = os.path.join(trial_dir, 'model.keras')
+    history_path = os.path.join(trial_dir, 'history.json')
+
+    if binary:
+        from binary_train_optimized import BATCH_SIZE, DATA_DIR, IMG_SIZE, create_binary_model
+    else:
+        from train_model import BATCH_SIZE, DATA_DIR, IMG_SIZE, WhiteflyModelTrainer
+
+    common = dict(
+        class_map=BINARY_CLASS_MAP if binary else None,
+        img_size=IMG_SIZE,
+        batch_size=BATCH_SIZE,
+        class_mode='binary' if binary else 'categorical',
+        workers=spec['loader_workers']
+    )
+    train_gen = BalancedImageSampler(
+        DATA_DIR, 'train',
+        class_weights=config['class_weights'],
+        steps_per_epoch=spec['steps_per_epoch'],
+        image_data_generator=keras.preprocessing.image.ImageDataGenerator(
+            rescale=1./255, rotation_range=30, width_shift_range=0.2, height_shift_range=0.2,
+            horizontal_flip=True, zoom_range=0.2, brightness_range=[0.8, 1.2], fill_mode='nearest'
+        ),
+        **common
+    )
+    val_gen = BalancedImageSampler(DATA_DIR, 'val', balanced=False, shuffle=False, **common)
+
+    history = []
+    if os.path.exists(model_path):
+        model = keras.models.load_model(model_path)
+        with open(history_path) as f:
+            history = json.load(f)
+    else:
+        params = dict(
+            learning_rate=config['learning_rate'],
+            dropout=config['dropout'],
+            unfrozen_layers=config['unfrozen_layers'],
+            dense_units=tuple(config['dense_units'])
+        )
+        if binary:
+            model = create_binary_model(profile, **params)
+        else:
+            model = WhiteflyModelTrainer(profile).build_model(**params)
+
+    initial_epoch = len(history)
+    train_gen.epoch = initial_epoch
+    fit = model.fit(
+        train_gen,
+        epochs=spec['epochs'],
+        initial_epoch=initial_epoch,
+        validation_data=val_gen,
+        verbose=0
+    )
+    history += [
+        {k: float(v[i]) for k, v in fit.history.items()}
+        for i in range(len(fit.history.get('loss', [])))
+    ]
+
+    os.makedirs(trial_dir, exist_ok=True)
+    model.save(model_path)
+    with open(history_path, 'w') as f:
+        json.dump(history, f, indent=4)
+
+    scores = [h[spec['metric']] for h in history if spec['metric'] in h]
+    return {'score': max(scores) if scores else float('nan'), 'epochs': len(history)}
+
+class SuccessiveHalvingSweep:
+    """Coordina las rondas y lanza cada prueba como un proceso independiente."""
+
+    def __init__(self, kind='binary', trials=27, parallel=4, metric='val_auc',
+                 min_epochs=2, max_epochs=18, eta=3, steps_per_epoch=None, name=None, seed=42):
+        self.kind = kind
+        self.metric = metric
+        self.parallel = parallel
+        self.eta = eta
+        self.steps_per_epoch = steps_per_epoch
+        self.name = name or f"{kind}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        self.dir = os.path.join(SWEEP_DIR, self.name)
+
+        # Presupuesto de épocas por ronda: min, min·eta, ... hasta max
+        self.rungs = []
+        epochs = min_epochs
+        while epochs < max_epochs:
+            self.rungs.append(epochs)
+            epochs *= eta
+        self.rungs.append(max_epochs)
+
+        # Hilos por prueba: los núcleos se reparten entre las pruebas simultáneas
+        cores = os.cpu_count() or 1
+        self.threads = max(1, cores // parallel)
+        self.loader_workers = max(1, min(4, self.threads))
+
+        self.trials = {
+            trial_id(config): {'config': config, 'score': None, 'epochs': 0, 'status': 'pendiente'}
+            for config in sample_configs(kind, trials, seed)
+        }
+
+    def _launch(self, tid: str, epochs: int) -> Dict:
+        spec = {
+            'kind': self.kind,
+            'config': self.trials[tid]['config'],
+            'trial_dir': os.path.join(self.dir, tid),
+            'epochs': epochs,
+            'metric': self.metric,
+            'steps_per_epoch': self.steps_per_epoch,
+            'loader_workers': self.loader_workers
+        }
+        env = dict(os.environ, INTRA_OP_THREADS=str(self.threads), INTER_OP_THREADS='1')
+        os.makedirs(spec['trial_dir'], exist_ok=True)
+        with open(os.path.join(spec['trial_dir'], 'trial.log'), 'a') as log:
+            proc = subprocess.run(
+                [sys.executable, __file__, '_trial', json.dumps(spec)],
+                stdout=subprocess.PIPE, stderr=log, text=True, env=env
+            )
+        try:
+            return json.loads(proc.stdout.strip().splitlines()[-1])
+        except (IndexError, json.JSONDecodeError):
+            return {'score': None, 'epochs': self.trials[tid]['epochs'], 'error': True}
+
+    def run(self) -> List[Dict]:
+        print(f"🔎 Sweep '{self.name}': {len(self.trials)} configuraciones, "
+              f"{self.parallel} en paralelo ({self.threads} hilos c/u)")
+        print(f"   Rondas (épocas): {self.rungs} | métrica: {self.metric} | eta: {self.eta}\n")
+
+        survivors = list(self.trials)
+        for rung, epochs in enumerate(self.rungs):
+            print(f"🏃 Ronda {rung + 1}/{len(self.rungs)}: {len(survivors)} pruebas hasta {epochs} épocas")
+            with ThreadPoolExecutor(max_workers=self.parallel) as executor:
+                results = dict(zip(survivors, executor.map(lambda t: self._launch(t, epochs), survivors)))
+
+            for tid, result in results.items():
+                trial = self.trials[tid]
+                trial.update(score=result['score'], epochs=result['epochs'], rung=rung + 1)
+                trial['status'] = 'error' if result.get('error') else 'activa'
+                print(f"   {tid}: {self.metric}="
+                      f"{'error' if trial['score'] is None else format(trial['score'], '.4f')}")
+
+            ranked = sorted(
+                (t for t in survivors if self.trials[t]['score'] is not None),
+                key=lambda t: self.trials[t]['score'], reverse=True
+            )
+            if rung == len(self.rungs) - 1:
+                for tid in ranked:
+                    self.trials[tid]['status'] = 'completa'
+                survivors = ranked
+            else:
+                keep = max(1, len(ranked) // self.eta)
+                for tid in ranked[keep:]:
+                    self.trials[tid]['status'] = 'podada'
+                survivors = ranked[:keep]
+            self.write_leaderboard()
+
+            if not survivors:
+                print("❌ Todas las pruebas fallaron (ver trial.log en cada carpeta)")
+                break
+
+        leaderboard = self.write_leaderboard()
+        self.print_leaderboard(leaderboard)
+        return leaderboard
+
+    def write_leaderboard(self) -> List[Dict]:
+        """Ranking: primero las que llegaron más lejos, luego por métrica."""
+        rows = [
+            {'trial': tid, **trial}
+            for tid, trial in self.trials.items()
+        ]
+        rows.sort(key=lambda r: (r['epochs'], r['score'] if r['score'] is not None else -1), reverse=True)
+
+        os.makedirs(self.dir, exist_ok=True)
+        path = os.path.join(self.dir, 'leaderboard.json')
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'kind': self.kind, 'metric': self.metric, 'rungs': self.rungs,
+                       'trials': rows}, f, indent=4)
+        os.replace(path + '.tmp', path)
+        return rows
+
+    def print_leaderboard(self, rows: List[Dict], top: int = 10):
+        print(f"\n🏆 Leaderboard ({self.metric}):")
+        print(f"{'Prueba':12} {'Score':>7} {'Épocas':>7} {'Estado':10} Configuración")
+        for row in rows[:top]:
+            score = '-' if row['score'] is None else f"{row['score']:.4f}"
+            print(f"{row['trial']:12} {score:>7} {row['epochs']:>7} {row['status']:10} {row['config']}")
+        print(f"\n💾 {os.path.join(self.dir, 'leaderboard.json')} "
+              f"(modelos en {self.dir}/<prueba>/model.keras)")
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == '_trial':
+        print(json.dumps(_run_trial(json.loads(sys.argv[2]))))
+        return
+
+    parser = argparse.ArgumentParser(description="Búsqueda de hiperparámetros con successive halving")
+    parser.add_argument('--kind', choices=sorted(SEARCH_SPACE), default='binary')
+    parser.add_argument('--trials', type=int, default=27, help="Configuraciones iniciales")
+    parser.add_argument('--parallel', type=int, default=4, help="Pruebas simultáneas")
+    parser.add_argument('--metric', default='val_auc', help="Métrica de validación a maximizar")
+    parser.add_argument('--min-epochs', type=int, default=2)
+    parser.add_argument('--max-epochs', type=int, default=18)
+    parser.add_argument('--eta', type=int, default=3, help="Se conserva 1/eta de las pruebas por ronda")
+    parser.add_argument('--steps-per-epoch', type=int, default=None,
+                        help="Lotes por época (acorta cada prueba)")
+    parser.add_argument('--name', help="Nombre del sweep (carpeta en sweeps/)")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    SuccessiveHalvingSweep(
+        kind=args.kind, trials=args.trials, parallel=args.parallel, metric=args.metric,
+        min_epochs=args.min_epochs, max_epochs=args.max_epochs, eta=args.eta,
+        steps_per_epoch=args.steps_per_epoch, name=args.name, seed=args.seed
+    ).run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# test_job_queue.py - Cola persistente de trabajos (job_queue.py)
+
+import time
+
+import pytest
+
+import job_queue
+from job_queue import RETRY_BASE_SECONDS, JobQueue, WorkerPool
+
+class Clock:
+    """Reloj manual para job_queue.time.time()."""
+
+    def __init__(self, now=1_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(job_queue, 'time', clock)
+    return clock
+
+@pytest.fixture
+def jobs(tmp_path):
+    return JobQueue(str(tmp_path / 'jobs.db'))
+
+def test_claim_takes_highest_priority_then_oldest(jobs, clock):
+    old = jobs.submit('deteccion', {'n': 1})
+    clock.now += 1
+    urgent = jobs.submit('deteccion', {'n': 2}, prioridad=5)
+    clock.now += 1
+    jobs.submit('deteccion', {'n': 3})
+
+    first = jobs.claim()
+    assert first['id'] == urgent['id']
+    assert first['estado'] == 'en_proceso'
+    assert first['intentos'] == 1
+    assert jobs.claim()['id'] == old['id']
+
+def test_claim_empty_queue_returns_none(jobs, clock):
+    assert jobs.claim() is None
+
+def test_idempotency_key_returns_existing_job(jobs, clock):
+    first = jobs.submit('deteccion', {'archivo': 'a.jpg'}, clave='abc')
+    again = jobs.submit('deteccion', {'archivo': 'b.jpg'}, clave='abc')
+    assert again['id'] == first['id']
+    assert again['datos'] == {'archivo': 'a.jpg'}
+    assert jobs.counts() == {'pendiente': 1}
+
+def test_failure_is_retried_with_exponential_backoff(jobs, clock):
+    job = jobs.submit('deteccion', {}, max_intentos=3)
+
+    jobs.claim()
+    assert jobs.fail(job['id'], 'error 1') == 'pendiente'
+    assert jobs.get(job['id'])['disponible'] == clock.now + RETRY_BASE_SECONDS
+    assert jobs.claim() is None  # Todavía en espera
+
+    clock.now += RETRY_BASE_SECONDS
+    assert jobs.claim()['intentos'] == 2
+    assert jobs.fail(job['id'], 'error 2') == 'pendiente'
+    assert jobs.get(job['id'])['disponible'] == clock.now + 2 * RETRY_BASE_SECONDS
+
+def test_job_fails_after_max_attempts(jobs, clock):
+    job = jobs.submit('deteccion', {}, max_intentos=2)
+    for _ in range(2):
+        clock.now += 60
+        assert jobs.claim()['id'] == job['id']
+        estado = jobs.fail(job['id'], 'ValueError: imagen corrupta')
+
+    assert estado == 'fallido'
+    final = jobs.get(job['id'])
+    assert final['estado'] == 'fallido'
+    assert final['intentos'] == 2
+    assert final['error'] == 'ValueError: imagen corrupta'
+    clock.now += 60
+    assert jobs.claim() is None
+
+def test_complete_stores_result(jobs, clock):
+    job = jobs.submit('deteccion', {})
+    jobs.claim()
+    jobs.complete(job['id'], {'clase': 'sin_plaga'})
+    done = jobs.get(job['id'])
+    assert done['estado'] == 'completado'
+    assert done['resultado'] == {'clase': 'sin_plaga'}
+
+def test_stale_in_progress_jobs_are_reclaimed_on_restart(tmp_path, clock):
+    path = str(tmp_path / 'jobs.db')
+    jobs = JobQueue(path)
+    job = jobs.submit('deteccion', {})
+    assert jobs.claim()['id'] == job['id']
+
+    # El servidor se cae con el trabajo en_proceso; al arrancar vuelve a la cola
+    restarted = JobQueue(path)
+    assert restarted.get(job['id'])['estado'] == 'pendiente'
+    reclaimed = restarted.claim()
+    assert reclaimed['id'] == job['id']
+    assert reclaimed['intentos'] == 2
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+def test_worker_pool_runs_handlers_and_reports_final_failures(jobs):
+    failed = []
+
+    def ok(datos):
+        return {'eco': datos['n']}
+
+    def broken(datos):
+        raise ValueError("imagen corrupta")
+
+    pool = WorkerPool(jobs, {'ok': ok, 'roto': broken}, workers=1, poll_interval=0.01,
+                      on_failure=failed.append)
+    good = jobs.submit('ok', {'n': 7})
+    bad = jobs.submit('roto', {'archivo': 'x.jpg'}, max_intentos=1)
+    pool.start()
+    try:
+        assert _wait_for(lambda: jobs.get(bad['id'])['estado'] == 'fallido')
+        assert _wait_for(lambda: jobs.get(good['id'])['estado'] == 'completado')
+    finally:
+        pool.stop()
+
+    assert jobs.get(good['id'])['resultado'] == {'eco': 7}
+    assert [job['id'] for job in failed] == [bad['id']]
+    assert failed[0]['datos'] == {'archivo': 'x.jpg'}
@@ -0,0 +1,79 @@
+# test_training_callbacks.py - Checkpoint completo y reanudación (training_callbacks.py)
+
+import random
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+keras = tf.keras
+
+from training_callbacks import FullStateCheckpoint, load_latest_checkpoint
+
+class FakeSampler:
+    def __init__(self):
+        self.epoch = 0
+        self.reordered = 0
+
+    def _reorder(self):
+        self.reordered += 1
+
+def _model():
+    model = keras.Sequential([keras.Input((4,)), keras.layers.Dense(2, activation='softmax')])
+    model.compile(optimizer=keras.optimizers.Adam(1e-3), loss='categorical_crossentropy')
+    model.fit(np.zeros((4, 4)), np.eye(2)[[0, 1, 0, 1]], verbose=0)
+    return model
+
+def test_save_then_restore_round_trip(tmp_path):
+    checkpoint_dir = str(tmp_path / 'checkpoints')
+    early_stopping = keras.callbacks.EarlyStopping(patience=3)
+    early_stopping.wait, early_stopping.best = 2, 0.25
+
+    model = _model()
+    model.optimizer.learning_rate.assign(5e-4)
+    saver = FullStateCheckpoint(checkpoint_dir, run_id='run_a', callbacks=[early_stopping])
+    saver.set_model(model)
+
+    random.seed(1)
+    np.random.seed(1)
+    tf.random.set_global_generator(tf.random.Generator.from_seed(1))
+    saver.save(epoch=4)
+    expected = (random.random(), np.random.rand(), tf.random.get_global_generator().normal([]).numpy())
+
+    loaded, state = load_latest_checkpoint(checkpoint_dir)
+    assert state['epoch'] == 4
+    assert state['run_id'] == 'run_a'
+
+    restored_stopping = keras.callbacks.EarlyStopping(patience=3)
+    sampler = FakeSampler()
+    resumed = FullStateCheckpoint(checkpoint_dir, run_id='run_a', callbacks=[restored_stopping],
+                                  samplers=[sampler], resume_state=state)
+    resumed.set_model(loaded)
+    random.seed(99)
+    np.random.seed(99)
+    resumed.on_train_begin()
+
+    assert sampler.epoch == 5
+    assert sampler.reordered == 1
+    assert restored_stopping.wait == 2
+    assert restored_stopping.best == pytest.approx(0.25)
+    assert float(loaded.optimizer.learning_rate.numpy()) == pytest.approx(5e-4)
+    assert random.random() == expected[0]
+    assert np.random.rand() == expected[1]
+    assert tf.random.get_global_generator().normal([]).numpy() == pytest.approx(expected[2])
+
+def test_rotation_keeps_only_this_runs_checkpoints(tmp_path):
+    checkpoint_dir = tmp_path / 'checkpoints'
+    model = _model()
+    old_run = FullStateCheckpoint(str(checkpoint_dir), run_id='old', keep_last=2)
+    old_run.set_model(model)
+    for epoch in range(25, 30):
+        old_run.save(epoch)
+
+    new_run = FullStateCheckpoint(str(checkpoint_dir), run_id='new', keep_last=2)
+    new_run.set_model(model)
+    new_run.save(0)
+
+    assert sorted(p.name for p in (checkpoint_dir / 'old').iterdir()) == ['epoch_0029', 'epoch_0030']
+    assert [p.name for p in (checkpoint_dir / 'new').iterdir()] == ['epoch_0001']
+    assert (checkpoint_dir / 'latest').read_text() == 'new/epoch_0001'
@@ -4,10 +4,10 @@ Script para entrenar el modelo CNN con imágenes etiquetadas de Roboflow.
 Soporta data augmentation y validación cruzada.
 """
 
+from training_profile import apply_training_profile
 import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
-from tensorflow.keras.applications import MobileNetV2
 from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout, BatchNormalization
 from tensorflow.keras.models import Model
 from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping, ReduceLROnPlateau, TensorBoard
@@ -15,14 +15,24 @@ import matplotlib.pyplot as plt
 import numpy as np
 from datetime import datetime
 import os
-import json
-from sklearn.utils.class_weight import compute_class_weight
+import argparse
+from balanced_sampler import BalancedImageSampler
+from model_config import IMG_SIZE, build_backbone, with_preprocessing, write_model_config
+from model_bundle import BUNDLE_EXTENSION, benchmark, dataset_hash, save_bundle
+from evaluation import PARITY_IMAGES, evaluate_generator, print_evaluation
+from distributed import (
+    check_resume_agreement, cluster_info, get_strategy, scale_learning_rate, training_input, worker_path
+)
+from training_callbacks import FullStateCheckpoint, ThroughputProfiler, load_latest_checkpoint
 
 # Configuración
-IMG_SIZE = (224, 224)
+# IMG_SIZE y el alpha de MobileNetV2 vienen de model_config (model_arch.json opcional
+# o IMG_SIZE/MOBILENET_ALPHA; por defecto 224 px y alpha 1.0)
 BATCH_SIZE = 32
 EPOCHS = 50
 LEARNING_RATE = 0.001
+CLASS_SAMPLING_WEIGHTS = None  # None = lotes balanceados; p.ej. {'infestacion_severa': 2.0}
+LOADER_WORKERS = 4
 
 # Rutas (ajustar según tu estructura)
 DATA_DIR = 'dataset/'  # Carpeta con subcarpetas: sin_plaga, leve, severa
@@ -30,13 +40,25 @@ TRAIN_DIR = os.path.join(DATA_DIR, 'train')
 VAL_DIR = os.path.join(DATA_DIR, 'val')
 TEST_DIR = os.path.join(DATA_DIR, 'test')
 MODEL_DIR = 'models/'
+CHECKPOINT_DIR = 'checkpoints/multiclase'  # Checkpoints completos para --resume
+CHECKPOINT_EVERY = 1                      # Épocas entre checkpoints
+CHECKPOINT_KEEP = 3                       # Checkpoints conservados
 
 class WhiteflyModelTrainer:
     """Clase para entrenar el modelo de detección."""
     
-    def __init__(self):
+    def __init__(self, profile=None, strategy=None):
         self.model = None
         self.history = None
+        self.profile = profile or {'jit_compile': False}
+        self.strategy = strategy or tf.distribute.get_strategy()
+        self.worker_index, self.num_workers = cluster_info()
+        self.run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.resume_state = None
+        self.class_names = None   # Orden de las salidas (class_indices)
+        self.test_results = None
+        self.sample_path = None
+        self.parity_paths = []
         
     def create_data_generators(self):
         """
@@ -60,29 +82,43 @@ class WhiteflyModelTrainer:
         # Generador para validación (solo normalización)
         val_datagen = ImageDataGenerator(rescale=1./255)
         
-        # Cargar imágenes
-        train_generator = train_datagen.flow_from_directory(
-            TRAIN_DIR,
-            target_size=IMG_SIZE,
+        # Cargar imágenes: el entrenamiento muestrea lotes balanceados por clase
+        train_generator = BalancedImageSampler(
+            DATA_DIR, 'train',
+            class_weights=CLASS_SAMPLING_WEIGHTS,
+            img_size=IMG_SIZE,
             batch_size=BATCH_SIZE,
+            image_data_generator=train_datagen,
             class_mode='categorical',
-            shuffle=True
+            shard_index=self.worker_index,
+            num_shards=self.num_workers,
+            workers=LOADER_WORKERS
         )
         
-        val_generator = val_datagen.flow_from_directory(
-            VAL_DIR,
-            target_size=IMG_SIZE,
+        val_generator = BalancedImageSampler(
+            DATA_DIR, 'val',
+            balanced=False,
+            shuffle=False,
+            img_size=IMG_SIZE,
             batch_size=BATCH_SIZE,
+            image_data_generator=val_datagen,
             class_mode='categorical',
-            shuffle=False
+            shard_index=self.worker_index,
+            num_shards=self.num_workers,
+            workers=LOADER_WORKERS
         )
         
-        test_generator = val_datagen.flow_from_directory(
-            TEST_DIR,
-            target_size=IMG_SIZE,
+        test_generator = BalancedImageSampler(
+            DATA_DIR, 'test',
+            balanced=False,
+            shuffle=False,
+            img_size=IMG_SIZE,
             batch_size=BATCH_SIZE,
+            image_data_generator=val_datagen,
             class_mode='categorical',
-            shuffle=False
+            shard_index=self.worker_index,
+            num_shards=self.num_workers,
+            workers=LOADER_WORKERS
         )
         
         print(f"\n📊 Distribución del dataset:")
@@ -90,52 +126,63 @@ class WhiteflyModelTrainer:
         print(f"   Validación: {val_generator.samples} imágenes")
         print(f"   Prueba: {test_generator.samples} imágenes")
         print(f"\n🏷️  Clases: {train_generator.class_indices}")
+        self.class_names = sorted(train_generator.class_indices, key=train_generator.class_indices.get)
+        if self.num_workers > 1:
+            print(f"🌐 {self.num_workers} workers: lote global {BATCH_SIZE * self.num_workers} "
+                  f"({BATCH_SIZE} por worker)")
         
         return train_generator, val_generator, test_generator
     
-    def build_model(self):
-        """Construye el modelo CNN optimizado."""
+    def build_model(self, learning_rate=LEARNING_RATE, dropout=0.5, unfrozen_layers=30,
+                    dense_units=(512, 256, 128)):
+        """
+        Construye el modelo CNN optimizado (dentro del scope de la estrategia).
+        
+        Args:
+            learning_rate: Learning rate por worker
+            dropout: Dropout de la primera capa densa (baja 0.1 por capa)
+            unfrozen_layers: Capas finales de MobileNetV2 que se entrenan
+            dense_units: Ancho de cada capa densa
+        """
+        with self.strategy.scope():
+            return self._build_model(learning_rate, dropout, unfrozen_layers, dense_units)
+    
+    def _build_model(self, learning_rate, dropout, unfrozen_layers, dense_units):
         # Cargar modelo base pre-entrenado
-        base_model = MobileNetV2(
-            weights='imagenet',
-            include_top=False,
-            input_shape=(*IMG_SIZE, 3)
-        )
+        base_model = build_backbone()
         
         # Descongelar las últimas capas para fine-tuning
-        for layer in base_model.layers[:-30]:
+        for layer in base_model.layers[:-unfrozen_layers]:
             layer.trainable = False
-        for layer in base_model.layers[-30:]:
+        for layer in base_model.layers[-unfrozen_layers:]:
             layer.trainable = True
         
         # Construir arquitectura
         x = base_model.output
         x = GlobalAveragePooling2D()(x)
-        x = BatchNormalization()(x)
-        x = Dense(512, activation='relu')(x)
-        x = Dropout(0.5)(x)
-        x = BatchNormalization()(x)
-        x = Dense(256, activation='relu')(x)
-        x = Dropout(0.4)(x)
-        x = BatchNormalization()(x)
-        x = Dense(128, activation='relu')(x)
-        x = Dropout(0.3)(x)
-        
-        # Capa de salida
-        predictions = Dense(3, activation='softmax', name='output')(x)
+        for i, units in enumerate(dense_units):
+            x = BatchNormalization()(x)
+            x = Dense(units, activation='relu')(x)
+            x = Dropout(max(0.0, dropout - 0.1 * i))(x)
+        
+        # Capa de salida (float32 aunque se use precisión mixta)
+        predictions = Dense(3, activation='softmax', name='output', dtype='float32')(x)
         
         model = Model(inputs=base_model.input, outputs=predictions)
         
         # Compilar con métricas relevantes
         model.compile(
-            optimizer=keras.optimizers.Adam(learning_rate=LEARNING_RATE),
+            optimizer=keras.optimizers.Adam(
+                learning_rate=scale_learning_rate(learning_rate, self.num_workers)
+            ),
             loss='categorical_crossentropy',
             metrics=[
                 'accuracy',
                 keras.metrics.Precision(name='precision'),
                 keras.metrics.Recall(name='recall'),
                 keras.metrics.AUC(name='auc')
-            ]
+            ],
+            jit_compile=self.profile['jit_compile']
         )
         
         self.model = model
@@ -144,14 +191,34 @@ class WhiteflyModelTrainer:
         
         return model
     
-    def create_callbacks(self):
+    def resume_from_checkpoint(self):
+        """
+        Carga el último checkpoint completo (modelo y optimizador) y retoma
+        el identificador de la ejecución original.
+
+        Returns:
+            True si había un checkpoint para reanudar.
+        """
+        with self.strategy.scope():
+            model, state = load_latest_checkpoint(CHECKPOINT_DIR)
+        check_resume_agreement(self.strategy, state)
+        if model is None:
+            print(f"⚠️  No hay checkpoints en {CHECKPOINT_DIR}, se entrena desde cero")
+            return False
+        
+        self.model = model
+        self.resume_state = state
+        self.run_id = state['run_id']
+        return True
+    
+    def create_callbacks(self, train_gen=None):
         """Crea callbacks para el entrenamiento."""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        timestamp = self.run_id
         
         callbacks = [
             # Guardar mejor modelo
             ModelCheckpoint(
-                filepath=os.path.join(MODEL_DIR, f'best_model_{timestamp}.h5'),
+                filepath=worker_path(os.path.join(MODEL_DIR, f'best_model_{timestamp}.h5')),
                 monitor='val_accuracy',
                 save_best_only=True,
                 mode='max',
@@ -175,53 +242,54 @@ class WhiteflyModelTrainer:
                 verbose=1
             ),
             
-            # TensorBoard
+            # TensorBoard (histogramas de pesos solo si el perfil lo pide)
             TensorBoard(
-                log_dir=f'logs/{timestamp}',
-                histogram_freq=1,
-                write_graph=True
+                log_dir=worker_path(f'logs/{timestamp}'),
+                histogram_freq=self.profile.get('histogram_freq', 0),
+                write_graph=self.profile.get('write_graph', False)
+            ),
+            
+            # Rendimiento: img/s, ocupación de la carga de datos, pico de RAM
+            ThroughputProfiler(
+                batch_size=BATCH_SIZE * self.num_workers,  # Lote global
+                log_dir=worker_path(f'logs/{timestamp}'),
+                sampler=train_gen,
+                profile_steps=self.profile.get('profile_steps')
             )
         ]
         
+        # Checkpoint completo al final: restaura su estado después de que
+        # los demás callbacks se reinicien en on_train_begin
+        callbacks.append(FullStateCheckpoint(
+            worker_path(CHECKPOINT_DIR),
+            run_id=self.run_id,
+            callbacks=list(callbacks),
+            samplers=[train_gen] if train_gen is not None else [],
+            every_n_epochs=CHECKPOINT_EVERY,
+            keep_last=CHECKPOINT_KEEP,
+            resume_state=self.resume_state
+        ))
+        
         return callbacks
     
     def train(self, train_gen, val_gen):
         """Entrena el modelo."""
         print("\n🚀 Iniciando entrenamiento...")
         
-        # Calcular class_weight para balancear las clases
-        # Obtener las etiquetas del generador de entrenamiento
-        train_labels = []
-        
-        # Iterar sobre el generador para obtener todas las etiquetas
-        print("📊 Calculando distribución de clases...")
-        for i in range(len(train_gen)):
-            batch_x, batch_y = train_gen[i]
-            # Convertir one-hot a índices de clase
-            batch_labels = np.argmax(batch_y, axis=1)
-            train_labels.extend(batch_labels)
-        
-        # Resetear el generador
-        train_gen.reset()
+        # El balance de clases lo hace el sampler al armar cada lote,
+        # sin descartar imágenes ni fijar pesos manuales
+        print(f"📊 Imágenes por clase: {train_gen.class_counts()}")
+        print(f"📊 Probabilidad de muestreo por clase: "
+              f"{dict(zip(train_gen.class_indices, np.round(train_gen.class_probabilities, 3)))}")
         
-        train_labels = np.array(train_labels)
-        
-        # Pesos manuales más equilibrados
-        class_weight_dict = {
-            0: 1.0,    # infestacion_leve
-            1: 5.0,    # infestacion_severa (en lugar de ~20)
-            2: 1.0     # sin_plaga
-        }
-        
-        print(f"📊 Pesos de clases manuales: {class_weight_dict}")
-        
-        callbacks = self.create_callbacks()
+        callbacks = self.create_callbacks(train_gen)
+        initial_epoch = self.resume_state['epoch'] + 1 if self.resume_state else 0
         
         self.history = self.model.fit(
-            train_gen,
+            training_input(train_gen, self.num_workers),
             epochs=EPOCHS,
-            validation_data=val_gen,
-            class_weight=class_weight_dict,  # 🔥 Balance de clases
+            initial_epoch=initial_epoch,
+            validation_data=training_input(val_gen, self.num_workers),
             callbacks=callbacks,
             verbose=1
         )
@@ -234,26 +302,20 @@ class WhiteflyModelTrainer:
         """Evalúa el modelo en el conjunto de prueba."""
         print("\n📊 Evaluando modelo...")
         
-        results = self.model.evaluate(test_gen, verbose=1)
-        
-        metrics = {
-            'loss': results[0],
-            'accuracy': results[1],
-            'precision': results[2],
-            'recall': results[3],
-            'auc': results[4]
-        }
+        model = self.model
+        if self.num_workers > 1:
+            # Copia fuera de la estrategia: el jefe evalúa todo el conjunto sin repartirlo
+            model = keras.models.clone_model(self.model)
+            model.set_weights(self.model.get_weights())
         
-        # Calcular F1-score
-        if metrics['precision'] + metrics['recall'] > 0:
-            metrics['f1_score'] = 2 * (metrics['precision'] * metrics['recall']) / \
-                                   (metrics['precision'] + metrics['recall'])
-        else:
-            metrics['f1_score'] = 0
+        # Una sola pasada: decodificación paralela y predicción por lotes
+        results = evaluate_generator(model, test_gen)
+        print_evaluation(results)
+        self.test_results = results
+        self.sample_path = test_gen.filepaths[0] if len(test_gen.filepaths) else None
+        self.parity_paths = list(test_gen.filepaths[:PARITY_IMAGES])
         
-        print("\n📈 Resultados en conjunto de prueba:")
-        for metric, value in metrics.items():
-            print(f"   {metric.capitalize()}: {value:.4f}")
+        metrics = {k: results[k] for k in ['loss', 'accuracy', 'precision', 'recall', 'auc', 'f1_score']}
         
         return metrics
     
@@ -309,22 +371,33 @@ class WhiteflyModelTrainer:
         plt.show()
     
     def save_model(self, filename='whitefly_detector.h5'):
-        """Guarda el modelo entrenado."""
+        """Guarda el modelo entrenado con el preprocesamiento incluido (entrada uint8)."""
         filepath = os.path.join(MODEL_DIR, filename)
-        self.model.save(filepath)
+        model = with_preprocessing(self.model)
+        model.save(filepath)
         print(f"\n💾 Modelo guardado: {filepath}")
         
-        # Guardar configuración
-        config = {
-            'img_size': IMG_SIZE,
-            'classes': ['sin_plaga', 'infestacion_leve', 'infestacion_severa'],
-            'timestamp': datetime.now().isoformat(),
-            'epochs_trained': len(self.history.history['loss']) if self.history else 0
-        }
-        
-        config_path = os.path.join(MODEL_DIR, 'model_config.json')
-        with open(config_path, 'w') as f:
-            json.dump(config, f, indent=4)
+        epochs_trained = len(self.history.history['loss']) if self.history else 0
+        
+        # Bundle autodescriptivo: lo que carga el servidor
+        bundle_path = os.path.splitext(filepath)[0] + BUNDLE_EXTENSION
+        save_bundle(
+            model, bundle_path, self.class_names, 'multiclass',
+            data_hash=dataset_hash(DATA_DIR),
+            benchmarks=benchmark(model, self.test_results, self.sample_path, self.parity_paths),
+            epochs_trained=epochs_trained,
+            run_id=self.run_id
+        )
+        print(f"📦 Bundle guardado: {bundle_path}")
+        
+        # Configuración para modelos .h5 sin bundle
+        write_model_config(
+            self.class_names,
+            path=os.path.join(MODEL_DIR, 'model_config.json'),
+            kind='multiclass',
+            timestamp=datetime.now().isoformat(),
+            epochs_trained=epochs_trained
+        )
 
 def main():
     """Función principal de entrenamiento."""
@@ -332,22 +405,38 @@ def main():
     print("🌱 SISTEMA DE DETECCIÓN DE MOSCA BLANCA - ENTRENAMIENTO")
     print("="*60)
     
+    parser = argparse.ArgumentParser(description="Entrenamiento del modelo multiclase")
+    parser.add_argument('--resume', action='store_true',
+                        help=f"Continuar desde el último checkpoint en {CHECKPOINT_DIR}")
+    args = parser.parse_args()
+    
+    # Aplicar perfil de rendimiento (hilos, XLA, precisión mixta)
+    profile = apply_training_profile()
+    
+    # Estrategia distribuida si TF_CONFIG describe varios workers (launch_distributed.py)
+    strategy = get_strategy()
+    
     # Crear directorios
     os.makedirs(MODEL_DIR, exist_ok=True)
     
     # Inicializar trainer
-    trainer = WhiteflyModelTrainer()
+    trainer = WhiteflyModelTrainer(profile, strategy)
     
     # Crear generadores de datos
     train_gen, val_gen, test_gen = trainer.create_data_generators()
     
-    # Construir modelo
-    model = trainer.build_model()
-    model.summary()
+    # Construir modelo (o recuperarlo del último checkpoint)
+    if not (args.resume and trainer.resume_from_checkpoint()):
+        model = trainer.build_model()
+        model.summary()
     
     # Entrenar
     trainer.train(train_gen, val_gen)
     
+    # Evaluación, gráficas y guardado solo en el worker jefe
+    if trainer.worker_index != 0:
+        return
+    
     # Evaluar
     metrics = trainer.evaluate(test_gen)
     
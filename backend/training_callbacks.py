@@ -0,0 +1,305 @@
+# training_callbacks.py - Callbacks compartidos por los scripts de entrenamiento
+"""
+Callbacks de Keras reutilizados por train_model.py, binary_train_optimized.py
+y simple_train.py.
+"""
+
+import os
+import json
+import time
+from typing import Optional, Sequence
+
+import tensorflow as tf
+from tensorflow import keras
+
+def _peak_rss_mb() -> Optional[float]:
+    """Pico de memoria residente del proceso en MB (None si el sistema no lo informa)."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    # En Linux ru_maxrss está en KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+LOADER_BOUND_UTILIZATION = 0.9  # Con los workers de carga ocupados por encima de esto, faltan datos
+
+class ThroughputProfiler(keras.callbacks.Callback):
+    """
+    Mide el rendimiento del entrenamiento por época: imágenes/seg, duración
+    de la época y pico de memoria.
+
+    La espera por datos ocurre dentro de la función de entrenamiento de
+    Keras (el `next(iterator)` está en el grafo), así que no se ve entre
+    callbacks. Si se pasa el `sampler` de entrenamiento se mide el tiempo
+    de sus `__getitem__`: la fracción del tiempo en que sus `workers` están
+    ocupados cargando lotes. Cerca de 1, el entrenamiento espera a los datos.
+
+    Si se indica `profile_steps=(inicio, fin)`, captura una traza del
+    profiler de TensorFlow solo en esos pasos (visible en TensorBoard).
+    """
+
+    def __init__(self, batch_size: int, log_dir: str, sampler=None,
+                 profile_steps: Optional[Sequence[int]] = None, verbose: int = 1):
+        super().__init__()
+        self.batch_size = batch_size
+        self.log_dir = log_dir
+        self.sampler = sampler
+        self.profile_steps = tuple(profile_steps) if profile_steps else None
+        self.verbose = verbose
+        self.global_step = 0
+        self.epochs = []
+        self._tracing = False
+        # Sin ru_maxrss se muestrea la RSS en cada paso y se guarda el máximo
+        self._process = None
+        self._max_rss_mb = 0.0
+        if _peak_rss_mb() is None:
+            import psutil
+            self._process = psutil.Process()
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch_start = time.perf_counter()
+        self._train_start = None
+        self._last_batch_end = self._epoch_start
+        self._step_time = 0.0
+        self._steps = 0
+        if self.sampler is not None:
+            self.sampler.load_times = []
+
+    def on_train_batch_begin(self, batch, logs=None):
+        now = time.perf_counter()
+        if self._train_start is None:
+            self._train_start = now
+        self._batch_start = now
+
+        if self.profile_steps and self.global_step == self.profile_steps[0] and not self._tracing:
+            tf.profiler.experimental.start(self.log_dir)
+            self._tracing = True
+
+    def on_train_batch_end(self, batch, logs=None):
+        now = time.perf_counter()
+        self._step_time += now - self._batch_start
+        self._last_batch_end = now
+        self._steps += 1
+        self.global_step += 1
+        if self._process is not None:
+            self._max_rss_mb = max(self._max_rss_mb, self._process.memory_info().rss / (1024 ** 2))
+
+        if self._tracing and self.global_step >= self.profile_steps[1]:
+            self._stop_trace()
+
+    def on_epoch_end(self, epoch, logs=None):
+        wall = time.perf_counter() - self._epoch_start
+        # Del primer paso al último: incluye la espera de datos, no la validación
+        train_time = self._last_batch_end - self._train_start if self._train_start is not None else 0.0
+        stats = {
+            'epoch': epoch + 1,
+            'wall_time_s': wall,
+            'train_time_s': train_time,
+            'images_per_sec': self._steps * self.batch_size / train_time if train_time else 0.0,
+            'train_step_s': self._step_time,
+            'data_load_s': None,
+            'loader_utilization': None,
+            'peak_rss_mb': _peak_rss_mb() or self._max_rss_mb
+        }
+        if self.sampler is not None:
+            stats['data_load_s'] = float(sum(self.sampler.load_times))
+            loaders = max(1, getattr(self.sampler, 'workers', 1) or 1)
+            stats['loader_utilization'] = stats['data_load_s'] / (loaders * train_time) if train_time else 0.0
+        self.epochs.append(stats)
+
+        if self.verbose:
+            loading = (f"carga de datos {stats['loader_utilization']:.0%} | "
+                       if stats['loader_utilization'] is not None else "")
+            print(f"\n⏱️  Época {stats['epoch']}: {stats['images_per_sec']:.1f} img/s | {loading}"
+                  f"{wall:.1f}s (incl. validación) | pico RAM {stats['peak_rss_mb']:.0f} MB")
+            if (stats['loader_utilization'] or 0) > LOADER_BOUND_UTILIZATION:
+                print("   ⚠️  El entrenamiento está limitado por la carga de datos")
+
+        self._save()
+
+    def on_train_end(self, logs=None):
+        if self._tracing:
+            self._stop_trace()
+
+    def _stop_trace(self):
+        tf.profiler.experimental.stop()
+        self._tracing = False
+        if self.verbose:
+            print(f"\n🔬 Traza del profiler guardada en {self.log_dir}")
+
+    def _save(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        with open(os.path.join(self.log_dir, 'throughput.json'), 'w') as f:
+            json.dump(self.epochs, f, indent=4)
+
+# Atributos de callbacks de Keras que forman parte del estado a reanudar
+_CALLBACK_STATE_ATTRS = ('wait', 'best', 'cooldown_counter', 'stopped_epoch', 'best_epoch')
+
+class FullStateCheckpoint(keras.callbacks.Callback):
+    """
+    Checkpoint cada `every_n_epochs` épocas para poder reanudar: modelo con
+    estado del optimizador (.keras), época, learning rate, estado de
+    EarlyStopping/ReduceLROnPlateau/ModelCheckpoint y estado de los
+    generadores aleatorios de random, NumPy y el generador global de
+    TensorFlow. Los samplers pasados en `samplers` se reposicionan en la
+    época siguiente al reanudar (su orden y su augmentation dependen solo
+    de la semilla y la época).
+
+    No es una restauración bit a bit: las operaciones aleatorias con semilla
+    propia dentro del grafo (p.ej. Dropout) no guardan su estado, así que
+    tras reanudar sus máscaras difieren de las de una ejecución sin cortes.
+
+    Cada ejecución escribe en su propio subdirectorio
+    `checkpoint_dir/<run_id>/` y la rotación solo toca los checkpoints de
+    esa ejecución, de modo que una ejecución nueva nunca borra los suyos
+    por ordenarse antes que los de una anterior. Cada checkpoint se escribe
+    en un directorio temporal que luego se renombra, y el puntero
+    `checkpoint_dir/latest` se actualiza al final, así que un corte a mitad
+    de escritura nunca deja un checkpoint inválido como el último. Se
+    conservan los `keep_last` más recientes de la ejecución.
+
+    Debe ir al final de la lista de callbacks: al reanudar restaura su
+    estado después de que los demás se reinicien en on_train_begin.
+    """
+
+    def __init__(self, checkpoint_dir: str, run_id: str, callbacks: Sequence = (),
+                 samplers: Sequence = (), every_n_epochs: int = 1, keep_last: int = 3,
+                 resume_state: Optional[dict] = None):
+        super().__init__()
+        self.checkpoint_dir = checkpoint_dir
+        self.run_id = run_id
+        self.tracked_callbacks = list(callbacks)
+        self.samplers = list(samplers)
+        self.every_n_epochs = every_n_epochs
+        self.keep_last = keep_last
+        self.resume_state = resume_state
+
+    def on_train_begin(self, logs=None):
+        if self.resume_state is not None:
+            self._restore(self.resume_state)
+            self.resume_state = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        if (epoch + 1) % self.every_n_epochs == 0:
+            self.save(epoch)
+
+    def save(self, epoch: int):
+        import pickle
+        import random
+        import shutil
+        import numpy as np
+
+        run_dir = os.path.join(self.checkpoint_dir, self.run_id)
+        os.makedirs(run_dir, exist_ok=True)
+        name = f"epoch_{epoch + 1:04d}"
+        final_dir = os.path.join(run_dir, name)
+        tmp_dir = os.path.join(run_dir, f".tmp_{name}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        # Modelo completo: arquitectura, pesos y variables del optimizador
+        self.model.save(os.path.join(tmp_dir, 'model.keras'))
+
+        callback_states = {}
+        for i, callback in enumerate(self.tracked_callbacks):
+            attrs = {a: _to_json(getattr(callback, a)) for a in _CALLBACK_STATE_ATTRS
+                     if hasattr(callback, a)}
+            callback_states[f"{i}_{type(callback).__name__}"] = attrs
+
+            best_weights = getattr(callback, 'best_weights', None)
+            if best_weights is not None:
+                np.savez(os.path.join(tmp_dir, f"best_weights_{i}.npz"), *best_weights)
+
+        state = {
+            'run_id': self.run_id,
+            'epoch': epoch,
+            'learning_rate': float(keras.ops.convert_to_numpy(self.model.optimizer.learning_rate)),
+            'callbacks': callback_states
+        }
+        with open(os.path.join(tmp_dir, 'state.json'), 'w') as f:
+            json.dump(state, f, indent=4)
+        with open(os.path.join(tmp_dir, 'rng.pkl'), 'wb') as f:
+            generator = tf.random.get_global_generator()
+            pickle.dump({
+                'python': random.getstate(),
+                'numpy': np.random.get_state(),
+                'tensorflow': (generator.state.numpy(), generator.algorithm)
+            }, f)
+
+        if os.path.exists(final_dir):
+            shutil.rmtree(final_dir)
+        os.replace(tmp_dir, final_dir)
+        _write_atomic(os.path.join(self.checkpoint_dir, 'latest'), f"{self.run_id}/{name}")
+
+        # Rotación (solo los checkpoints de esta ejecución; los nombres tienen ancho fijo)
+        checkpoints = sorted(d for d in os.listdir(run_dir) if d.startswith('epoch_'))
+        for old in checkpoints[:-self.keep_last]:
+            shutil.rmtree(os.path.join(run_dir, old), ignore_errors=True)
+
+    def _restore(self, state: dict):
+        import pickle
+        import random
+        import numpy as np
+
+        path = state['path']
+        self.model.optimizer.learning_rate.assign(state['learning_rate'])
+
+        for i, callback in enumerate(self.tracked_callbacks):
+            attrs = state['callbacks'].get(f"{i}_{type(callback).__name__}", {})
+            for attr, value in attrs.items():
+                setattr(callback, attr, value)
+            weights_path = os.path.join(path, f"best_weights_{i}.npz")
+            if os.path.exists(weights_path):
+                with np.load(weights_path) as data:
+                    callback.best_weights = [data[f"arr_{j}"] for j in range(len(data.files))]
+
+        # Los samplers derivan el orden de (semilla, época): basta con avanzar el contador
+        for sampler in self.samplers:
+            sampler.epoch = state['epoch'] + 1
+            if hasattr(sampler, '_reorder'):
+                sampler._reorder()
+
+        with open(os.path.join(path, 'rng.pkl'), 'rb') as f:
+            rng = pickle.load(f)
+        random.setstate(rng['python'])
+        np.random.set_state(rng['numpy'])
+        if 'tensorflow' in rng:
+            tf_state, algorithm = rng['tensorflow']
+            tf.random.set_global_generator(tf.random.Generator.from_state(tf_state, algorithm))
+
+        print(f"\n♻️  Reanudando desde {path} (época {state['epoch'] + 1} completada)")
+
+def load_latest_checkpoint(checkpoint_dir: str):
+    """
+    Carga el último checkpoint completo.
+
+    Returns:
+        (modelo compilado, estado) o (None, None) si no hay checkpoint.
+    """
+    pointer = os.path.join(checkpoint_dir, 'latest')
+    if not os.path.exists(pointer):
+        return None, None
+    with open(pointer) as f:
+        path = os.path.join(checkpoint_dir, f.read().strip())
+
+    with open(os.path.join(path, 'state.json')) as f:
+        state = json.load(f)
+    state['path'] = path
+
+    model = keras.models.load_model(os.path.join(path, 'model.keras'))
+    return model, state
+
+def _to_json(value):
+    """Convierte escalares de NumPy/TF a tipos nativos para JSON."""
+    try:
+        return float(value) if not isinstance(value, (int, bool, type(None))) else value
+    except (TypeError, ValueError):
+        return None
+
+def _write_atomic(path: str, content: str):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
@@ -0,0 +1,227 @@
+# training_profile.py - Perfil de rendimiento para entrenamiento en CPU
+"""
+Perfil compartido de rendimiento para los scripts de entrenamiento.
+Configura hilos de TensorFlow (intra/inter-op), oneDNN, compilación XLA
+y la política de precisión mixta desde un único archivo JSON.
+
+Uso:
+    python training_profile.py show                - Mostrar perfil efectivo
+    python training_profile.py benchmark [--save]  - Medir imágenes/seg por combinación
+
+IMPORTANTE: importar este módulo antes que tensorflow, ya que la opción de
+oneDNN solo se respeta si la variable de entorno existe al cargar TF.
+"""
+
+import os
+import sys
+import json
+import itertools
+import subprocess
+from typing import Dict, List
+
+# Ruta del perfil (puede sobrescribirse con la variable TRAINING_PROFILE)
+PROFILE_PATH = os.environ.get('TRAINING_PROFILE', 'training_profile.json')
+
+DEFAULT_PROFILE = {
+    'intra_op_threads': 0,        # 0 = lo decide TensorFlow
+    'inter_op_threads': 0,
+    'onednn': True,               # Kernels oneDNN en CPU
+    'jit_compile': False,         # XLA; Keras lo desactiva por defecto en CPU
+    'mixed_precision': 'auto',    # 'auto', 'mixed_bfloat16' o 'float32'
+    'histogram_freq': 0,          # Histogramas de pesos en TensorBoard (0 = desactivado)
+    'write_graph': False,
+    'profile_steps': None         # [inicio, fin] para una traza del profiler de TF
+}
+
+def load_profile(path: str = PROFILE_PATH) -> Dict:
+    """Carga el perfil desde JSON combinándolo con los valores por defecto."""
+    profile = dict(DEFAULT_PROFILE)
+    if os.path.exists(path):
+        with open(path) as f:
+            profile.update(json.load(f))
+    # Traza bajo demanda sin editar el archivo: PROFILE_STEPS=20,30
+    if os.environ.get('PROFILE_STEPS'):
+        profile['profile_steps'] = [int(s) for s in os.environ['PROFILE_STEPS'].split(',')]
+    # Límite de hilos por proceso (lo fija launch_distributed.py para cada worker)
+    for key, env in (('intra_op_threads', 'INTRA_OP_THREADS'), ('inter_op_threads', 'INTER_OP_THREADS')):
+        if os.environ.get(env):
+            profile[key] = int(os.environ[env])
+    return profile
+
+def save_profile(profile: Dict, path: str = PROFILE_PATH):
+    """Guarda el perfil en JSON."""
+    with open(path, 'w') as f:
+        json.dump(profile, f, indent=4)
+
+def cpu_supports_bfloat16() -> bool:
+    """Indica si la CPU tiene instrucciones nativas bfloat16 (AVX512-BF16 o AMX)."""
+    try:
+        with open('/proc/cpuinfo') as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+def resolve_precision_policy(profile: Dict) -> str:
+    """Traduce 'auto' a la política concreta según la CPU del host."""
+    policy = profile.get('mixed_precision', 'auto')
+    if policy == 'auto':
+        return 'mixed_bfloat16' if cpu_supports_bfloat16() else 'float32'
+    return policy
+
+# oneDNN se lee al importar tensorflow: fijarlo lo antes posible
+os.environ.setdefault('TF_ENABLE_ONEDNN_OPTS', '1' if load_profile()['onednn'] else '0')
+
+def apply_training_profile(path: str = PROFILE_PATH, verbose: bool = True) -> Dict:
+    """
+    Aplica el perfil al runtime de TensorFlow.
+
+    Debe llamarse antes de ejecutar cualquier operación de TF, porque los
+    hilos no pueden cambiarse una vez inicializado el runtime.
+
+    Returns:
+        Perfil efectivo, con 'mixed_precision' ya resuelto.
+    """
+    import tensorflow as tf
+    from tensorflow import keras
+
+    profile = load_profile(path)
+    profile['mixed_precision'] = resolve_precision_policy(profile)
+
+    tf.config.threading.set_intra_op_parallelism_threads(profile['intra_op_threads'])
+    tf.config.threading.set_inter_op_parallelism_threads(profile['inter_op_threads'])
+    keras.mixed_precision.set_global_policy(profile['mixed_precision'])
+
+    if verbose:
+        print("⚙️  Perfil de entrenamiento:")
+        print(f"   Hilos intra-op: {profile['intra_op_threads'] or 'auto'}")
+        print(f"   Hilos inter-op: {profile['inter_op_threads'] or 'auto'}")
+        print(f"   oneDNN: {os.environ.get('TF_ENABLE_ONEDNN_OPTS')}")
+        print(f"   XLA jit_compile: {profile['jit_compile']}")
+        print(f"   Precisión: {profile['mixed_precision']}")
+        if profile['profile_steps']:
+            print(f"   Traza del profiler: pasos {profile['profile_steps']}")
+
+    return profile
+
+def _benchmark_candidates() -> List[Dict]:
+    """Combinaciones a medir en el host actual."""
+    cores = os.cpu_count() or 1
+    threads = sorted({0, max(1, cores // 2), cores})
+    policies = ['float32']
+    if cpu_supports_bfloat16():
+        policies.append('mixed_bfloat16')
+
+    candidates = []
+    for intra, jit, policy in itertools.product(threads, [False, True], policies):
+        candidates.append({
+            'intra_op_threads': intra,
+            'inter_op_threads': 0 if intra == 0 else 2,
+            'onednn': True,
+            'jit_compile': jit,
+            'mixed_precision': policy
+        })
+    return candidates
+
+def _run_single_benchmark(profile: Dict, batch_size: int = 32, steps: int = 15, warmup: int = 3):
+    """Mide imágenes/seg de un paso de entrenamiento sintético (proceso hijo)."""
+    import time
+    import numpy as np
+    import tensorflow as tf
+    from tensorflow import keras
+
+    tf.config.threading.set_intra_op_parallelism_threads(profile['intra_op_threads'])
+    tf.config.threading.set_inter_op_parallelism_threads(profile['inter_op_threads'])
+    keras.mixed_precision.set_global_policy(profile['mixed_precision'])
+
+    model = keras.Sequential([
+        keras.applications.MobileNetV2(input_shape=(224, 224, 3), include_top=False, weights=None),
+        keras.layers.GlobalAveragePooling2D(),
+        keras.layers.Dense(128, activation='relu'),
+        keras.layers.Dense(3, activation='softmax', dtype='float32')
+    ])
+    model.compile(
+        optimizer=keras.optimizers.Adam(learning_rate=0.001),
+        loss='categorical_crossentropy',
+        jit_compile=profile['jit_compile']
+    )
+
+    x = np.random.rand(batch_size, 224, 224, 3).astype('float32')
+    y = keras.utils.to_categorical(np.random.randint(0, 3, batch_size), 3)
+
+    for _ in range(warmup):
+        model.train_on_batch(x, y)
+
+    start = time.perf_counter()
+    for _ in range(steps):
+        loss = model.train_on_batch(x, y)
+    elapsed = time.perf_counter() - start
+
+    loss = float(loss[0] if isinstance(loss, (list, tuple)) else loss)
+    return {
+        'images_per_sec': batch_size * steps / elapsed,
+        'loss_finite': bool(np.isfinite(loss))
+    }
+
+def benchmark_profiles(save: bool = False):
+    """
+    Mide cada combinación en un proceso separado (los hilos y la política
+    solo se pueden fijar una vez por proceso) y reporta imágenes/seg.
+    """
+    print("🏁 Midiendo combinaciones de rendimiento en este host...\n")
+    results = []
+
+    for candidate in _benchmark_candidates():
+        env = dict(os.environ, TF_ENABLE_ONEDNN_OPTS='1' if candidate['onednn'] else '0')
+        proc = subprocess.run(
+            [sys.executable, __file__, '_bench', json.dumps(candidate)],
+            capture_output=True, text=True, env=env
+        )
+        try:
+            measurement = json.loads(proc.stdout.strip().splitlines()[-1])
+        except (IndexError, json.JSONDecodeError):
+            print(f"❌ Falló la combinación {candidate}")
+            continue
+        results.append((candidate, measurement))
+        print(f"   intra={candidate['intra_op_threads'] or 'auto':>4} "
+              f"jit={str(candidate['jit_compile']):5} "
+              f"{candidate['mixed_precision']:15} "
+              f"{measurement['images_per_sec']:8.1f} img/s"
+              f"{'' if measurement['loss_finite'] else '  ⚠️  pérdida no finita'}")
+
+    safe = [(c, m) for c, m in results if m['loss_finite']]
+    if not safe:
+        print("\n❌ Ninguna combinación terminó correctamente")
+        return None
+
+    best, measurement = max(safe, key=lambda item: item[1]['images_per_sec'])
+    print(f"\n🏆 Mejor combinación segura: {measurement['images_per_sec']:.1f} img/s")
+    print(f"   {best}")
+
+    if save:
+        save_profile({**load_profile(), **best})
+        print(f"💾 Perfil guardado en {PROFILE_PATH}")
+
+    return best
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Uso:")
+        print("  python training_profile.py show                - Mostrar perfil efectivo")
+        print("  python training_profile.py benchmark [--save]  - Medir combinaciones")
+    else:
+        command = sys.argv[1]
+
+        if command == "show":
+            profile = load_profile()
+            profile['mixed_precision'] = resolve_precision_policy(profile)
+            print(json.dumps(profile, indent=4))
+
+        elif command == "benchmark":
+            benchmark_profiles(save='--save' in sys.argv)
+
+        elif command == "_bench" and len(sys.argv) > 2:
+            print(json.dumps(_run_single_benchmark(json.loads(sys.argv[2]))))
+
+        else:
+            print("❌ Comando no reconocido")
@@ -4,7 +4,6 @@ Funciones auxiliares para preparación de datos, validación y análisis.
 """
 
 import os
-import shutil
 from pathlib import Path
 import numpy as np
 import cv2
@@ -13,6 +12,8 @@ import json
 from typing import List, Tuple, Dict
 import matplotlib.pyplot as plt
 from sklearn.model_selection import train_test_split
+from dataset_index import CLASSES, FileStatCache, list_images
+from materialize import materialize, print_counts
 
 class DatasetPreparator:
     """Clase para preparar y organizar el dataset."""
@@ -38,6 +39,7 @@ class DatasetPreparator:
                 (self.output_dir / split / clase).mkdir(parents=True, exist_ok=True)
         
         # Procesar cada clase
+        assignments = {}
         for clase in ['sin_plaga', 'infestacion_leve', 'infestacion_severa']:
             source_class_dir = self.source_dir / clase
             
@@ -46,9 +48,7 @@ class DatasetPreparator:
                 continue
             
             # Obtener todas las imágenes
-            images = list(source_class_dir.glob('*.jpg')) + \
-                    list(source_class_dir.glob('*.jpeg')) + \
-                    list(source_class_dir.glob('*.png'))
+            images = list_images(source_class_dir)
             
             if len(images) == 0:
                 print(f"⚠️  No hay imágenes en {clase}")
@@ -67,22 +67,26 @@ class DatasetPreparator:
                 random_state=42
             )
             
-            # Copiar archivos
-            for img in train_imgs:
-                shutil.copy(img, self.output_dir / 'train' / clase / img.name)
-            
-            for img in val_imgs:
-                shutil.copy(img, self.output_dir / 'val' / clase / img.name)
-            
-            for img in test_imgs:
-                shutil.copy(img, self.output_dir / 'test' / clase / img.name)
+            # Registrar asignaciones (se materializan todas juntas al final)
+            for split, split_imgs in [('train', train_imgs), ('val', val_imgs), ('test', test_imgs)]:
+                for img in split_imgs:
+                    assignments[f"{split}/{clase}/{img.name}"] = str(img)
             
             print(f"✅ {clase}: {len(train_imgs)} train, {len(val_imgs)} val, {len(test_imgs)} test")
         
+        # Enlazar o copiar en paralelo solo lo que cambió
+        print_counts(materialize(assignments, self.output_dir))
+        
         print("\n✨ Dataset organizado exitosamente")
     
-    def validate_dataset(self):
-        """Valida la estructura y calidad del dataset."""
+    def validate_dataset(self, workers: int = None):
+        """
+        Valida la estructura y calidad del dataset.
+        
+        Todas las imágenes se revisan en paralelo (cabecera, verify y
+        decodificación completa). Los resultados se guardan en caché por
+        tamaño y fecha de modificación, así que solo se revisan las nuevas.
+        """
         print("\n🔍 Validando dataset...")
         
         report = {
@@ -93,6 +97,8 @@ class DatasetPreparator:
             'issues': []
         }
         
+        all_images = []
+        
         for split in ['train', 'val', 'test']:
             split_dir = self.output_dir / split
             
@@ -110,9 +116,7 @@ class DatasetPreparator:
                     continue
                 
                 # Contar imágenes
-                images = list(class_dir.glob('*.jpg')) + \
-                        list(class_dir.glob('*.jpeg')) + \
-                        list(class_dir.glob('*.png'))
+                images = list_images(class_dir)
                 
                 count = len(images)
                 split_count += count
@@ -121,20 +125,33 @@ class DatasetPreparator:
                     report['classes'][clase] = 0
                 report['classes'][clase] += count
                 
-                # Validar calidad de imágenes
-                for img_path in images[:10]:  # Muestra de 10
-                    try:
-                        img = Image.open(img_path)
-                        report['image_sizes'].append(img.size)
-                        
-                        # Verificar que no esté corrupta
-                        img.verify()
-                    except Exception as e:
-                        report['issues'].append(f"Imagen corrupta: {img_path}")
+                all_images.extend(images)
             
             report['splits'][split] = split_count
             report['total_images'] += split_count
         
+        # Validar calidad de todas las imágenes (solo las que cambiaron)
+        cache = FileStatCache(self.output_dir / VALIDATION_CACHE_FILENAME, self.output_dir)
+        pending = [str(p) for p in all_images if cache.get(p) is None]
+        print(f"   {len(all_images) - len(pending)} en caché, {len(pending)} por revisar")
+        
+        if pending:
+            from concurrent.futures import ProcessPoolExecutor
+            
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for path, result in zip(pending, executor.map(_inspect_image, pending, chunksize=64)):
+                    cache.put(path, result)
+        
+        cache.prune(all_images)
+        cache.save()
+        
+        for img_path in all_images:
+            result = cache.get(img_path)
+            if result['size']:
+                report['image_sizes'].append(tuple(result['size']))
+            for issue in result['issues']:
+                report['issues'].append(f"{issue}: {img_path}")
+        
         # Imprimir reporte
         print("\n📊 Reporte del Dataset:")
         print(f"   Total de imágenes: {report['total_images']}")
@@ -163,24 +180,20 @@ class DatasetPreparator:
         
         return report
     
-    def augment_dataset(self, target_per_class: int = 500):
+    def augment_dataset(self, target_per_class: int = 500, workers: int = None, seed: int = 42):
         """
         Aumenta el dataset aplicando transformaciones si hay pocas imágenes.
+        
+        Cada imagen de origen se lee una sola vez y genera todas sus variantes
+        en un proceso del pool; la semilla de cada origen es fija, así que el
+        resultado no depende de cuántos procesos se usen.
         """
         print(f"\n🔄 Aumentando dataset a {target_per_class} imágenes por clase...")
         
-        import albumentations as A
-        
-        # Definir transformaciones
-        transform = A.Compose([
-            A.HorizontalFlip(p=0.5),
-            A.VerticalFlip(p=0.5),
-            A.Rotate(limit=40, p=0.7),
-            A.RandomBrightnessContrast(p=0.5),
-            A.GaussNoise(p=0.3),
-            A.Blur(blur_limit=3, p=0.3),
-        ])
+        import albumentations  # Fallar aquí si no está instalado
         
+        tasks = []
+        expected = {}
         for split in ['train']:  # Solo aumentar entrenamiento
             for clase in ['sin_plaga', 'infestacion_leve', 'infestacion_severa']:
                 class_dir = self.output_dir / split / clase
@@ -188,67 +201,184 @@ class DatasetPreparator:
                 if not class_dir.exists():
                     continue
                 
-                images = list(class_dir.glob('*.jpg')) + \
-                        list(class_dir.glob('*.jpeg')) + \
-                        list(class_dir.glob('*.png'))
-                
+                images = list_images(class_dir)
                 current_count = len(images)
                 
                 if current_count >= target_per_class:
                     print(f"✅ {clase}: Ya tiene suficientes imágenes ({current_count})")
                     continue
                 
+                if current_count == 0:
+                    print(f"⚠️  {clase}: No hay imágenes de origen")
+                    continue
+                
                 needed = target_per_class - current_count
                 print(f"🔄 {clase}: Generando {needed} imágenes adicionales...")
                 
-                # Generar imágenes aumentadas
-                generated = 0
-                while generated < needed:
-                    for img_path in images:
-                        if generated >= needed:
-                            break
-                        
-                        # Cargar imagen
-                        image = cv2.imread(str(img_path))
-                        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-                        
-                        # Aplicar transformación
-                        transformed = transform(image=image)
-                        augmented_img = transformed['image']
-                        
-                        # Guardar
-                        output_path = class_dir / f"aug_{generated}_{img_path.name}"
-                        augmented_img_bgr = cv2.cvtColor(augmented_img, cv2.COLOR_RGB2BGR)
-                        cv2.imwrite(str(output_path), augmented_img_bgr)
-                        
-                        generated += 1
-                
-                print(f"✅ {clase}: {current_count + generated} imágenes totales")
+                # La variante k sale de la imagen k % n (mismo reparto que antes)
+                for i, img_path in enumerate(images):
+                    variant_ids = list(range(i, needed, current_count))
+                    if variant_ids:
+                        tasks.append((clase, str(img_path), variant_ids, seed + i))
+                expected[clase] = (current_count, needed)
+        
+        if not tasks:
+            return
+        
+        # Generar en paralelo, mostrando progreso y rendimiento
+        import time
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        
+        total_needed = sum(needed for _, needed in expected.values())
+        generated = dict.fromkeys(expected, 0)
+        start = time.perf_counter()
+        
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_augment_worker) as executor:
+            futures = [executor.submit(_augment_source_image, task) for task in tasks]
+            for future in as_completed(futures):
+                clase, count = future.result()
+                generated[clase] += count
+                done = sum(generated.values())
+                rate = done / (time.perf_counter() - start)
+                print(f"\r   {done}/{total_needed} imágenes ({rate:.1f} img/s)", end='', flush=True)
+        print()
+        
+        for clase, (current_count, _) in expected.items():
+            print(f"✅ {clase}: {current_count + generated[clase]} imágenes totales")
+
+# Límites de la validación de imágenes
+VALIDATION_CACHE_FILENAME = '.validation_cache.json'
+VALID_MODES = ('RGB', 'L')
+MAX_ASPECT_RATIO = 4.0
+
+def _inspect_image(path: str) -> Dict:
+    """Revisa una imagen: tamaño del archivo, cabecera, verify y decodificación."""
+    result = {'size': None, 'mode': None, 'issues': []}
+    
+    if os.path.getsize(path) == 0:
+        result['issues'].append("Archivo vacío")
+        return result
+    
+    try:
+        # La cabecera da dimensiones y modo sin decodificar los píxeles
+        with Image.open(path) as img:
+            result['size'] = img.size
+            result['mode'] = img.mode
+            img.verify()
+    except Exception:
+        result['issues'].append("Imagen corrupta")
+        return result
+    
+    try:
+        # verify() no detecta datos truncados: decodificar completa
+        with Image.open(path) as img:
+            img.load()
+    except Exception:
+        result['issues'].append("Imagen truncada")
+    
+    if result['mode'] not in VALID_MODES:
+        result['issues'].append(f"Modo de color {result['mode']}")
+    
+    width, height = result['size']
+    if min(width, height) == 0 or max(width, height) / min(width, height) > MAX_ASPECT_RATIO:
+        result['issues'].append(f"Relación de aspecto extrema {width}x{height}")
+    
+    return result
+
+# Transformación de cada proceso del pool de augmentation
+_augment_transform = None
+
+def _init_augment_worker():
+    """Inicializa un proceso del pool: un hilo de OpenCV y el pipeline de albumentations."""
+    global _augment_transform
+    import albumentations as A
+    
+    cv2.setNumThreads(1)
+    _augment_transform = A.Compose([
+        A.HorizontalFlip(p=0.5),
+        A.VerticalFlip(p=0.5),
+        A.Rotate(limit=40, p=0.7),
+        A.RandomBrightnessContrast(p=0.5),
+        A.GaussNoise(p=0.3),
+        A.Blur(blur_limit=3, p=0.3),
+    ])
+
+def _augment_source_image(task) -> Tuple[str, int]:
+    """Carga una imagen una vez y escribe todas sus variantes aumentadas."""
+    import random
+    clase, img_path, variant_ids, seed = task
+    img_path = Path(img_path)
+    
+    # Semilla determinista por imagen de origen
+    random.seed(seed)
+    np.random.seed(seed)
+    if hasattr(_augment_transform, 'set_random_seed'):
+        _augment_transform.set_random_seed(seed)
+    
+    image = cv2.imread(str(img_path))
+    if image is None:
+        return clase, 0
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    
+    for variant_id in variant_ids:
+        augmented_img = _augment_transform(image=image)['image']
+        output_path = img_path.parent / f"aug_{variant_id}_{img_path.name}"
+        cv2.imwrite(str(output_path), cv2.cvtColor(augmented_img, cv2.COLOR_RGB2BGR))
+    
+    return clase, len(variant_ids)
 
 class ModelAnalyzer:
     """Analiza y visualiza el rendimiento del modelo."""
     
-    def __init__(self, model_path: str):
-        from tensorflow import keras
-        self.model = keras.models.load_model(model_path)
-        self.class_names = ['sin_plaga', 'infestacion_leve', 'infestacion_severa']
+    def __init__(self, model_path: str, use_cache: bool = True):
+        from prediction_cache import PredictionCache
+        from model_bundle import BUNDLE_EXTENSION, ModelRegistry
+        self.model_path = model_path
+        self._model = None
+        self.bundle = None
+        if model_path.endswith(BUNDLE_EXTENSION):
+            # El manifiesto trae el orden de clases; el modelo se lee al predecir
+            self.bundle = ModelRegistry(os.path.dirname(model_path)).get(model_path)
+            self.class_names = self.bundle.classes
+        else:
+            # Clases registradas al entrenar (orden de class_indices, alfabético)
+            from model_config import read_model_config
+            self.class_names = read_model_config().get('classes', sorted(CLASSES))
+        self.cache = PredictionCache(model_path) if use_cache else None
+    
+    @property
+    def model(self):
+        """El modelo se carga solo si hay algo que predecir."""
+        if self.bundle is not None:
+            return self.bundle.model
+        if self._model is None:
+            from tensorflow import keras
+            from model_config import with_preprocessing
+            # Los modelos anteriores esperan float en [0, 1]: se les antepone el preprocesamiento
+            self._model = with_preprocessing(keras.models.load_model(self.model_path))
+        return self._model
     
     def predict_image(self, image_path: str) -> Dict:
         """Predice una sola imagen y retorna resultados detallados."""
-        from tensorflow.keras.preprocessing.image import load_img, img_to_array
+        from tensorflow.keras.preprocessing.image import load_img
+        from evaluation import model_input_size
         
-        # Cargar y preprocesar
-        img = load_img(image_path, target_size=(224, 224))
-        img_array = img_to_array(img) / 255.0
-        img_array = np.expand_dims(img_array, axis=0)
+        # Cargar al tamaño de entrada del modelo; el escalado lo hace el modelo
+        img = load_img(image_path, target_size=model_input_size(self.model))
+        img_array = np.asarray(img)[None]
         
         # Predecir
-        predictions = self.model.predict(img_array, verbose=0)[0]
+        predictions = self.model.predict_on_batch(img_array)
+        if self.bundle is not None:
+            predictions = self.bundle.probabilities(predictions)
+        predictions = np.asarray(predictions)[0]
+        # Los bundles binarios usan su umbral de decisión
+        class_idx = int(self.bundle.decide(predictions)[0]) if self.bundle is not None else int(np.argmax(predictions))
         
         # Crear resultado
         result = {
-            'predicted_class': self.class_names[np.argmax(predictions)],
-            'confidence': float(np.max(predictions)),
+            'predicted_class': self.class_names[class_idx],
+            'confidence': float(predictions[class_idx]),
             'probabilities': {
                 name: float(prob) 
                 for name, prob in zip(self.class_names, predictions)
@@ -258,41 +388,44 @@ class ModelAnalyzer:
         return result
     
     def analyze_test_set(self, test_dir: str):
-        """Analiza el conjunto de prueba completo."""
-        from sklearn.metrics import classification_report, confusion_matrix
+        """Analiza el conjunto de prueba completo en una sola pasada por lotes."""
+        from balanced_sampler import BINARY_CLASS_MAP
+        from evaluation import compute_metrics, predict_files
         import seaborn as sns
         
         print("\n📊 Analizando conjunto de prueba...")
         
-        y_true = []
-        y_pred = []
+        # Las carpetas de prueba son las clases originales; un modelo binario las agrupa
+        binary = set(self.class_names) == set(BINARY_CLASS_MAP.values())
+        filepaths = []
+        labels = []
         
-        for i, clase in enumerate(self.class_names):
-            class_dir = Path(test_dir) / clase
-            
-            if not class_dir.exists():
-                continue
-            
-            images = list(class_dir.glob('*.jpg')) + \
-                    list(class_dir.glob('*.jpeg')) + \
-                    list(class_dir.glob('*.png'))
-            
-            for img_path in images:
-                result = self.predict_image(str(img_path))
-                y_true.append(i)
-                y_pred.append(self.class_names.index(result['predicted_class']))
+        for clase in sorted(CLASSES):
+            images = list_images(Path(test_dir) / clase)
+            target = BINARY_CLASS_MAP[clase] if binary else clase
+            filepaths.extend(str(p) for p in images)
+            labels.extend([self.class_names.index(target)] * len(images))
+        
+        # Reusar predicciones de este mismo modelo sobre imágenes sin cambios
+        def predict(paths):
+            return predict_files(self.model, paths, verbose=1)
+        
+        if self.cache is not None:
+            probs = self.cache.get_or_compute(filepaths, predict)
+        else:
+            probs = predict(filepaths)
+        
+        # Los bundles deciden con su propio umbral, igual que el servidor
+        y_pred = self.bundle.decide(self.bundle.probabilities(probs)) if self.bundle is not None else None
+        results = compute_metrics(labels, probs, self.class_names, y_pred=y_pred)
         
         # Reporte de clasificación
         print("\n📈 Reporte de Clasificación:")
-        print(classification_report(
-            y_true, 
-            y_pred, 
-            target_names=self.class_names,
-            digits=4
-        ))
+        print(results['classification_report'])
+        print(f"   Pérdida: {results['loss']:.4f} | AUC: {results['auc']:.4f}")
         
         # Matriz de confusión
-        cm = confusion_matrix(y_true, y_pred)
+        cm = results['confusion_matrix']
         
         plt.figure(figsize=(10, 8))
         sns.heatmap(
@@ -395,7 +528,7 @@ if __name__ == "__main__":
         print("  python utils.py check          - Verificar requisitos")
         print("  python utils.py organize <dir> - Organizar dataset")
         print("  python utils.py validate       - Validar dataset")
-        print("  python utils.py analyze <model>- Analizar modelo")
+        print("  python utils.py analyze <model> [--no-cache] - Analizar modelo")
     else:
         command = sys.argv[1]
         
@@ -411,7 +544,7 @@ if __name__ == "__main__":
             preparator.validate_dataset()
         
         elif command == "analyze" and len(sys.argv) > 2:
-            analyzer = ModelAnalyzer(sys.argv[2])
+            analyzer = ModelAnalyzer(sys.argv[2], use_cache='--no-cache' not in sys.argv)
             analyzer.analyze_test_set('dataset/test')
         
         else: